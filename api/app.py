@@ -1,3 +1,4 @@
+import asyncio
 import binascii
 
 import multiprocessing
@@ -18,7 +19,7 @@ from conf import CONF
 from logm import logger
 from db import MarsDB
 from roman_parliament import register_parliament
-from server_model.user_data import initialize_user_data_roaming
+from server_model.user_data import initialize_user_data_roaming, UserTable
 
 try:
     with os.popen('git describe --abbrev=0 2>/dev/null') as p:
@@ -58,15 +59,6 @@ if module_name == 'server':
     )
 
 
-ALL_USERS = {}
-
-
-def update_all_users(token):
-    global ALL_USERS
-    for user_name, token in MarsDB().execute("""select "user_name", "token" from "user" where "token" = %s """, (token, )).fetchall():
-        ALL_USERS[token] = user_name
-
-
 def query_mask(url: str, query_key: str, keep: float = 0.2):
     if query_key in url:
         query_key_index = url.index(query_key)
@@ -174,9 +166,13 @@ async def add_log_context(request: Request, call_next):
     if request.url.query:
         req_query = {q.split('=')[0]: q.split('=')[1] for q in request.url.query.split('&') if '=' in q}
         token = req_query.get('token')
-    if token is not None and ALL_USERS.get(token) is None:
-        update_all_users(token)
-    req_user = ALL_USERS.get(token, 'NA') if token else 'NA'
+    req_user = 'NA'
+    if token is not None and not token.startswith('ACCESS-'):
+        try:
+            if (user := (await UserTable.async_snapshot).first('token', token)) is not None:
+                req_user = user['user_name']
+        except Exception as e:
+            logger.error(f'按 token 查找用户失败: {e}')
     if token is not None and token.startswith('ACCESS-'):
         split_tokens = token.split('-')
         try:
@@ -242,6 +238,12 @@ instrumentator = pfi.Instrumentator(
 async def startup_event():
     if module_name == 'server':
         initialize_user_data_roaming(tables_to_subscribe='*')
+    # 预先建立数据库连接，避免发布后的第一批请求建连接
+    await MarsDB.a_warmup()
+    if 'monitor' in os.environ.get('SERVER', '').split(','):
+        # 各个 worker 都会尝试, 只有抢到写锁的进程真正写入任务性能数据
+        from monitor.task_perf_store import TaskPerfStore
+        asyncio.create_task(TaskPerfStore.feed_forever())
     instrumentator.instrument(app).expose(app)
 
 
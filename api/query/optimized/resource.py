@@ -1,16 +1,26 @@
 
 
+import asyncio
 import copy
+import time
 from collections import defaultdict
 
-from fastapi import Depends
+import pandas as pd
+from fastapi import Depends, Request, Response
 
 from api.depends import get_api_user_with_token
+from conf import CONF
 from conf.flags import USER_ROLE, ALL_USER_ROLES
+from db import a_redis
 from k8s.async_v1_api import async_get_nodes_df
+from logm import logger
 from server_model.user import User
 
 
+NODES_DF_VERSION_POLL_SECONDS = 1
+MONITOR_REFRESH_SECONDS = CONF.try_get('server_config.nodes_overview.monitor_refresh_seconds', default=10)
+
+
 async def get_train_images(user: User = Depends(get_api_user_with_token())):
     """ 获取内部的 train_image, 有两个来源，一个是用户组自己的 images，另一个是内建的 train_environment 表 """
     return {
@@ -122,37 +132,178 @@ def get_nodes_overview_impl(nodes: list, for_monitor: bool):
     return overview
 
 
-async def get_nodes_overview_api(user: User = Depends(get_api_user_with_token())):
-    nodes = (await get_nodes_detail_api(user))['result']
+def none_if_nan(value):
+    return None if value != value else value
+
+
+def get_nodes_overview_df_impl(nodes_df: pd.DataFrame, for_monitor: bool):
+    """
+    get_nodes_overview_impl 的向量化版本，结果一致，直接对 nodes_df 做 groupby 计数
+    """
+    overview = defaultdict(lambda: get_node_type_template())
+    if len(nodes_df) == 0:
+        return get_nodes_overview_impl([], for_monitor)
+    df = nodes_df
+    category = df.current_category
+    ready = category.eq('training') & df.status.eq('Ready')
+    free = ready & df.working.isnull()
+    working = ready & df.working.notnull()
+    indicators = pd.DataFrame({
+        'total': True,
+        'service': category.eq('service'),
+        'dev_and_release.total': category.isin(['release', 'dev']),
+        'dev_and_release.release': category.eq('release'),
+        'dev_and_release.dev': category.eq('dev'),
+        'train.total': category.eq('training'),
+        'train.schedulable.total': ready,
+        'train.schedulable.free': free,
+        'train.schedulable.working': working,
+        **{f'train.schedulable.{role}_working': working & df.working_user_role.eq(role) for role in ALL_USER_ROLES},
+        'train.unschedulable': category.eq('training') & ~df.status.eq('Ready'),
+        'err': category.eq('err'),
+        'exclusive': category.eq('exclusive'),
+    }, index=df.index).astype(int)
+    indicators['type'] = df['type']
+    indicators['schedule_zone'] = df['schedule_zone']
+
+    def fill_count(count: dict, row: dict):
+        for key, value in row.items():
+            *path, leaf = key.split('.')
+            target = count
+            for p in path:
+                target = target[p]
+            target[leaf] = int(value)
+
+    count_columns = [c for c in indicators.columns if c not in ('type', 'schedule_zone')]
+    for typ, row in indicators.groupby('type', dropna=False)[count_columns].sum().iterrows():
+        fill_count(overview[none_if_nan(typ)]['count'], row.to_dict())
+    for (typ, zone), row in indicators.groupby(['type', 'schedule_zone'], dropna=False)[count_columns].sum().iterrows():
+        fill_count(overview[none_if_nan(typ)]['count_schedule_zone'][none_if_nan(zone)], row.to_dict())
+
+    def fill_detail(mask: pd.Series, key: str, get_target):
+        for (typ, value), cnt in df[mask].groupby(['type', key], dropna=False).size().items():
+            get_target(overview[none_if_nan(typ)]['detail'])[none_if_nan(value)] += int(cnt)
+
+    fill_detail(indicators.service.astype(bool), 'use', lambda d: d['service'])
+    fill_detail(free, 'group', lambda d: d['train']['free'])
+    fill_detail(indicators['train.unschedulable'].astype(bool), 'group', lambda d: d['train']['unschedulable'])
+    fill_detail(indicators.err.astype(bool), 'group', lambda d: d['err'])
+    fill_detail(indicators.exclusive.astype(bool), 'group', lambda d: d['exclusive'])
+    for role in ALL_USER_ROLES:
+        fill_detail(indicators[f'train.schedulable.{role}_working'].astype(bool), 'working_user', lambda d: d['train']['working'][role])
+    if not for_monitor:
+        to_ret = overview['gpu']['count']
+        # 公开的展示接口，隐藏调度细节
+        for role in ALL_USER_ROLES:
+            del to_ret['train']['schedulable'][f'{role}_working']
+        return to_ret
+    return overview
+
+
+class NodesOverviewSnapshot(object):
+    """
+    nodes / overview / client overview 在后台刷新，请求直接返回 snapshot，不再每次请求都拿 nodes_df
+        - node watcher 每次写 nodes_df 都会更新 nodes_df_version，后台每秒只读这个版本号，变了才重新计算
+        - 监控数据 (monitor_info) 不走 node watcher，每隔 MONITOR_REFRESH_SECONDS 重新拿一次
+        - 重新计算之后内容真的变了，version 才会变，ETag 保持稳定
+    客户端带上 If-None-Match 且版本没变时，返回 304
+    """
+    version = None
+    source_version = None
+    generation = 0
+    refreshed_at = 0
+    nodes_df = None
+    nodes = None
+    overview = None
+    client_overview = None
+    _refresher: asyncio.Task = None
+
+    @classmethod
+    async def refresh(cls, force=False):
+        source_version = await a_redis.get('nodes_df_version')
+        source_version = source_version.decode() if isinstance(source_version, bytes) else str(source_version)
+        if not force and source_version == cls.source_version and time.time() - cls.refreshed_at < MONITOR_REFRESH_SECONDS:
+            return
+        cls.refreshed_at = time.time()
+        nodes_df = await async_get_nodes_df(monitor=True)
+        # 只是监控数据到了刷新时间，内容没变的话不换版本
+        if source_version == cls.source_version and cls.nodes_df is not None and nodes_df.equals(cls.nodes_df):
+            return
+        overview = get_nodes_overview_df_impl(nodes_df, True)
+        cls.nodes_df = nodes_df
+        cls.nodes = nodes_df.to_dict('records')
+        cls.overview = overview
+        cls.client_overview = get_client_overview_from_base(overview)
+        cls.source_version = source_version
+        cls.generation += 1
+        cls.version = f'{source_version}.{cls.generation}'
+
+    @classmethod
+    async def refresh_forever(cls):
+        while True:
+            await asyncio.sleep(NODES_DF_VERSION_POLL_SECONDS)
+            try:
+                await cls.refresh()
+            except Exception as e:
+                logger.exception(e)
+
+    @classmethod
+    async def get(cls):
+        if cls.version is None:
+            await cls.refresh(force=True)
+        if cls._refresher is None or cls._refresher.done():
+            cls._refresher = asyncio.create_task(cls.refresh_forever())
+        return cls
+
+    @staticmethod
+    def not_modified(request: Request, version: str):
+        return request.headers.get('if-none-match', '').strip('"') == version
+
+
+def get_client_overview_from_base(base):
+    types = ('cpu', 'gpu')
+    ret = {t: {} for t in types}
+    for typ in types:
+        if typ not in base:
+            ret[typ] = {t: 0 for t in ('other', 'usage_rate', 'total', 'working', 'free')}
+            continue
+        data = base[typ]['count']
+        others_count = data['dev_and_release']['total'] + data['err'] + data['train']['unschedulable'] + data['service'] + data['exclusive']
+        usage_rate = 0 if data['train']['total'] == 0 else (data['train']['total'] - data['train']['schedulable']['free'] ) / data['train']['total']
+        ret[typ] = {
+            'other': others_count,
+            'usage_rate': usage_rate,
+            'total': data['total'],
+            'working': data['train']['schedulable']['working'],
+            'free': data['train']['schedulable']['free'],
+        }
+    return ret
+
+
+async def get_nodes_overview_api(request: Request, response: Response, user: User = Depends(get_api_user_with_token())):
+    snapshot = await NodesOverviewSnapshot.get()
+    if NodesOverviewSnapshot.not_modified(request, snapshot.version):
+        return Response(status_code=304, headers={'ETag': f'"{snapshot.version}"'})
+    response.headers['ETag'] = f'"{snapshot.version}"'
     return {
         'success': 1,
+        'version': snapshot.version,
         'result': {
-            'nodes': nodes,
-            'overview': get_nodes_overview_impl(nodes, True)
+            'nodes': snapshot.nodes,
+            'overview': snapshot.overview
         }
     }
 
 
-async def get_cluster_overview_for_client_api(user: User = Depends(get_api_user_with_token())):
+async def get_cluster_overview_for_client_api(request: Request, response: Response, user: User = Depends(get_api_user_with_token())):
     try:
-        nodes = (await get_nodes_detail_api(user))['result']
-        base = get_nodes_overview_impl(nodes, True)
-        types = ('cpu', 'gpu')
-        ret = {t: {} for t in types}
-        for typ in types:
-            if typ not in base:
-                ret[typ] = {t: 0 for t in ('other', 'usage_rate', 'total', 'working', 'free')}
-                continue
-            data = base[typ]['count']
-            others_count = data['dev_and_release']['total'] + data['err'] + data['train']['unschedulable'] + data['service'] + data['exclusive']
-            usage_rate = 0 if data['train']['total'] == 0 else (data['train']['total'] - data['train']['schedulable']['free'] ) / data['train']['total']
-            ret[typ] = {
-                'other': others_count,
-                'usage_rate': usage_rate,
-                'total': data['total'],
-                'working': data['train']['schedulable']['working'],
-                'free': data['train']['schedulable']['free'],
-            }
+        snapshot = await NodesOverviewSnapshot.get()
+        # 外部用户看不到 cpu_detail，ETag 需要区分
+        etag = f'"{snapshot.version}-{int(user.is_external)}"'
+        if request.headers.get('if-none-match', '') == etag:
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+        ret = snapshot.client_overview
         resp = {
             'success': 1,
             'result': ret['gpu'].copy()
@@ -1,5 +1,8 @@
 
 
+from collections import defaultdict
+from typing import List
+
 import pandas as pd
 from fastapi import Depends, HTTPException
 
@@ -11,6 +14,25 @@ from server_model.user_data import UserWithAllGroupsTable, SchedulerUserTable, U
 from conf.flags import ALL_USER_ROLES
 
 
+def nest_quota_df(quota_df: pd.DataFrame, outer_keys: List[str], inner_keys: List[str], value: str = 'quota') -> pd.DataFrame:
+    """
+    按 outer_keys 分组, 每组把 inner_keys 逐层嵌套成 dict, 例如
+        outer_keys=['user_name'], inner_keys=['group', 'resource', 'priority']
+        -> user_name, quota: {group: {resource: {priority: quota}}}
+    和 groupby.apply 的写法结果一致 (inner_keys 为空的行会被丢掉), 但只需要对数据遍历一次
+    """
+    quota_df = quota_df.dropna(subset=outer_keys + inner_keys).sort_values(outer_keys, kind='stable')
+    nested = {}
+    columns = [quota_df[k].tolist() for k in outer_keys + inner_keys + [value]]
+    for row in zip(*columns):
+        outer, inner, v = row[:len(outer_keys)], row[len(outer_keys):-1], row[-1]
+        target = nested.setdefault(outer, {})
+        for k in inner[:-1]:
+            target = target.setdefault(k, {})
+        target[inner[-1]] = v
+    return pd.DataFrame([[*outer, v] for outer, v in nested.items()], columns=outer_keys + [value])
+
+
 async def get_user_api(user: User = Depends(get_api_user_with_token())):
     return {
         'success': 1,
@@ -37,14 +59,7 @@ async def get_user_node_quota_api(role: str , user: User = Depends(get_api_user_
         raise HTTPException(403, detail='无权操作')
     quota_df = await SchedulerUserTable.async_df
     quota_df = quota_df[(quota_df.user_name == quota_df.hit_group) & (quota_df.role == role)]
-    json_agg = lambda k, v: lambda df: pd.DataFrame([[df[[k, v]].set_index(k).to_dict()[v]]], columns=[v])
-    quota_df = quota_df \
-        .groupby(['user_name', 'role', 'group', 'resource']) \
-            .apply(json_agg(k='priority', v='quota')).reset_index(-1, drop=True).reset_index() \
-        .groupby(['user_name', 'role', 'group']) \
-            .apply(json_agg(k='resource', v='quota')).reset_index(-1, drop=True).reset_index() \
-        .groupby(['user_name', 'role']) \
-            .apply(json_agg(k='group', v='quota')).reset_index(-1, drop=True).reset_index()
+    quota_df = nest_quota_df(quota_df, outer_keys=['user_name', 'role'], inner_keys=['group', 'resource', 'priority'])
     user_group_df = await UserAllGroupsTable.async_df
     quota_df = quota_df.merge(user_group_df, how='left', on='user_name')
 
@@ -57,9 +72,11 @@ async def get_user_node_quota_api(role: str , user: User = Depends(get_api_user_
 async def get_all_user_node_quota_api(user: User=Depends(get_internal_api_user_with_token(allowed_groups=['internal_quota_limit_editor']))):
     """ 获取全部用户的所有节点 quota 和 node limit """
     def process_df(df, prefix):
-        df = df[df.resource.str.startswith(prefix)].copy()
-        df['resource'] = df.resource.str.slice(len(prefix))
-        return df.groupby('user_name').apply(lambda x: x.set_index('resource').to_dict()['quota']).to_dict()
+        df = df[df.resource.str.startswith(prefix)]
+        result = defaultdict(dict)
+        for user_name, resource, quota in zip(df.user_name.tolist(), df.resource.str.slice(len(prefix)).tolist(), df.quota.tolist()):
+            result[user_name][resource] = quota
+        return result
 
     quota_df = await UserAllQuotaTable.async_df
     quota_df = quota_df[['user_name', 'resource', 'quota']]
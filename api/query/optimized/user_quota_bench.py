@@ -0,0 +1,112 @@
+"""
+用户 quota 查询的性能基准，用法:
+    python -m api.query.optimized.user_quota_bench --users 3000
+    # 同时对比已用 quota 的两种查法，需要能连上 DB 和 redis
+    python -m api.query.optimized.user_quota_bench --used-quota-users alice bob
+    - get_user_node_quota_api 的聚合: 原来三层 groupby.apply(json_agg) 的写法和 nest_quota_df，两者的 records 必须一致
+    - 已用 quota: UsedQuotaView.async_get 和回退时查 task_ng 的 UserQuota.async_get_used_quota_from_db
+"""
+
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.query.optimized.user import nest_quota_df
+
+
+GROUPS = ['jd_a100', 'jd_a800', 'jd_h800', 'jd_dev', 'jd_a100_dedicated']
+PRIORITIES = [50, 40, 30, 20, 0]
+RESOURCES = ['node', 'node_limit']
+
+
+def generate(n_users, seed) -> pd.DataFrame:
+    """
+    和 SchedulerUserTable 一样的列，每个用户在每个分组、资源、优先级上一行
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([[f'user{i:05d}' for i in range(n_users)], GROUPS, RESOURCES, PRIORITIES],
+                                       names=['user_name', 'group', 'resource', 'priority'])
+    df = index.to_frame(index=False)
+    # 只留一部分组合，用户之间的配置不完全一样
+    df = df[rng.random(len(df)) < 0.75].reset_index(drop=True)
+    df['hit_group'] = df.user_name
+    df['role'] = rng.choice(['internal', 'external'], len(df))
+    df['quota'] = rng.integers(0, 100, len(df))
+    df['expire_time'] = pd.NaT
+    df['active'] = True
+    return df[['user_name', 'hit_group', 'resource', 'group', 'quota', 'role', 'priority', 'expire_time', 'active']]
+
+
+def groupby_apply_nest(quota_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    改成 nest_quota_df 之前 get_user_node_quota_api 里的写法
+    """
+    json_agg = lambda k, v: lambda df: pd.DataFrame([[df[[k, v]].set_index(k).to_dict()[v]]], columns=[v])
+    return quota_df \
+        .groupby(['user_name', 'role', 'group', 'resource']) \
+            .apply(json_agg(k='priority', v='quota')).reset_index(-1, drop=True).reset_index() \
+        .groupby(['user_name', 'role', 'group']) \
+            .apply(json_agg(k='resource', v='quota')).reset_index(-1, drop=True).reset_index() \
+        .groupby(['user_name', 'role']) \
+            .apply(json_agg(k='group', v='quota')).reset_index(-1, drop=True).reset_index()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+async def bench_used_quota(user_names, repeat):
+    from server_model.selector import AioUserSelector
+    from server_model.user_impl.used_quota_view import UsedQuotaView
+    for user_name in user_names:
+        user = await AioUserSelector.find_one(user_name=user_name)
+        if user is None:
+            print(f'{user_name}: 用户不存在')
+            continue
+        await user.quota.prefetch_quota_df()
+        costs = {}
+        for name, get in [
+            ('UsedQuotaView', lambda: UsedQuotaView.async_get(user_name)),
+            ('task_ng', user.quota.async_get_used_quota_from_db),
+        ]:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = await get()
+            costs[name] = ((time.perf_counter() - start) / repeat, result)
+        view, db = costs['UsedQuotaView'][1], costs['task_ng'][1]
+        # 视图是 scheduler 上一个 tick 的结果，和 DB 之间可能差一个 tick
+        same = view is not None and all(int(view.get(k, 0)) == v for k, v in db.items())
+        print(f'{user_name}: UsedQuotaView {costs["UsedQuotaView"][0] * 1000:.3f}ms, '
+              f'task_ng {costs["task_ng"][0] * 1000:.3f}ms, same={same}{"" if view is not None else " (视图过期)"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用户 quota 查询的性能基准')
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--role', type=str, default='internal')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--used-quota-users', nargs='*', default=[], help='对比已用 quota 两种查法的用户，需要 DB 和 redis')
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    quota_df = generate(args.users, args.seed)
+    # 和 get_user_node_quota_api 一样先过滤
+    quota_df = quota_df[(quota_df.user_name == quota_df.hit_group) & (quota_df.role == args.role)]
+    old_cost, old = timed(groupby_apply_nest, quota_df)
+    new_cost, new = timed(nest_quota_df, quota_df, ['user_name', 'role'], ['group', 'resource', 'priority'])
+    assert old.to_dict('records') == new.to_dict('records')
+    print(f'{args.users} users, {len(quota_df)} rows')
+    print(f'groupby.apply: {old_cost:.3f}s, nest_quota_df: {new_cost:.3f}s, records are identical')
+
+    if args.used_quota_users:
+        asyncio.run(bench_used_quota(args.used_quota_users, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
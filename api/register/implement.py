@@ -76,8 +76,10 @@ if 'ugc' in REG_SERVERS:
 if 'query' in REG_SERVERS:
     app.post('/query/task')(aq_optimized_task.get_task_api)
     app.post('/query/task/log')(at_exp.task_node_log_api)
+    app.post('/query/task/log/stream')(at_exp.task_node_log_stream_api)
     app.post('/query/task/sys_log')(at_exp.task_sys_log_api)
     app.post('/query/task/log/search')(at_exp.task_search_in_global)
+    app.post('/query/task/scheduler_lifecycle')(at_exp.task_scheduler_lifecycle_api)
     app.post('/query/task/ssh_ip')(at_port.task_ssh_ip)
     app.post('/query/task/list')(aq_optimized_task.get_tasks_api)
     app.post('/query/task/list_all_unfinished')(aq_optimized_task.get_running_tasks_api)
@@ -12,6 +12,8 @@ import time
 import urllib
 from typing import Optional, List
 from fastapi import Depends, Request, Query, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from logm import logger
 from api.depends import get_api_user_with_token, get_api_task, JUPYTER_ADMIN_GROUP, check_user_access_to_task
@@ -28,6 +30,7 @@ from server_model.task_impl import AioDbOperationImpl
 from server_model.training_task_impl import TaskApiImpl, DashboardApiImpl
 from server_model.user import User
 from server_model.task_runtime_config import TaskRuntimeConfig
+from server_model.task_lifecycle import TaskLifecycleLog
 from utils import convert_to_external_node, convert_to_external_task, get_task_node_idx_log
 
 
@@ -96,8 +99,7 @@ async def suspend_task_by_name(
     return res
 
 
-async def task_node_log_api(task: TrainingTask = Depends(get_api_task(allow_shared_task=True)), rank: int = 0,
-                            last_seen: str = 'null', service: str = None):
+def parse_last_seen(last_seen: str):
     try:
         last_seen = json.loads(last_seen)
     except:
@@ -107,6 +109,12 @@ async def task_node_log_api(task: TrainingTask = Depends(get_api_task(allow_shar
             last_seen['timestamp'] = datetime.datetime.strptime(last_seen['timestamp'], "%Y-%m-%dT%H:%M:%S.%f")
         except:
             last_seen['timestamp'] = datetime.datetime.strptime(last_seen['timestamp'], "%Y-%m-%dT%H:%M:%S")
+    return last_seen
+
+
+async def task_node_log_api(task: TrainingTask = Depends(get_api_task(allow_shared_task=True)), rank: int = 0,
+                            last_seen: str = 'null', service: str = None):
+    last_seen = parse_last_seen(last_seen)
     task.re_impl(AutoTaskApiImpl)
     res = await task.log(rank, last_seen=last_seen, service=service)
     # 兜底逻辑，任务没启动就失败了，日志文件都没有，标记 stop
@@ -115,6 +123,22 @@ async def task_node_log_api(task: TrainingTask = Depends(get_api_task(allow_shar
     return res
 
 
+async def task_node_log_stream_api(task: TrainingTask = Depends(get_api_task(allow_shared_task=True)), rank: int = 0,
+                                   last_seen: str = 'null'):
+    """
+    以 SSE (text/event-stream) 推送日志, 每个事件的 data 是 json, 事件类型见 TaskApiImpl.log_stream
+    """
+    if task.task_type != TASK_TYPE.TRAINING_TASK:
+        return {'success': 0, 'msg': '只有训练任务支持日志推送, 请使用 /query/task/log'}
+    last_seen = parse_last_seen(last_seen)
+
+    async def events():
+        async for event, data in task.re_impl(TaskApiImpl).log_stream(rank, last_seen=last_seen):
+            yield f'event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n'
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 async def task_sys_log_api(task: TrainingTask = Depends(get_api_task())):
     res = await task.re_impl(TaskApiImpl).sys_log()
     # if not user.is_internal:
@@ -122,9 +146,24 @@ async def task_sys_log_api(task: TrainingTask = Depends(get_api_task())):
     return res
 
 
-async def task_search_in_global(content, task: TrainingTask = Depends(get_api_task()), user=Depends(get_api_user_with_token())):
+async def task_scheduler_lifecycle_api(start: Optional[float] = None, end: Optional[float] = None, count: Optional[int] = None,
+                                       chain: bool = False, task: TrainingTask = Depends(get_api_task())):
+    """
+    按时间范围查询任务在调度器中的生命周期记录
+    :param start: 开始时间 timestamp (秒)
+    :param end: 结束时间 timestamp (秒)
+    :param chain: 是否查询整个 chain
+    """
+    task_ids = sorted(task.id_list) if chain else [task.id]
+    return {
+        'success': 1,
+        'data': await TaskLifecycleLog.a_query_chain(task_ids, start=start, end=end, count=count)
+    }
+
+
+async def task_search_in_global(content, max_matches: int = 100, task: TrainingTask = Depends(get_api_task()), user=Depends(get_api_user_with_token())):
     content = urllib.parse.unquote(content)
-    res = await task.re_impl(TaskApiImpl).search_in_global(content)
+    res = await task.re_impl(TaskApiImpl).search_in_global(content, max_matches=max_matches)
     return res
 
 
@@ -63,6 +63,26 @@ class TrainingTask(BaseTask):
 
         return await self.__impl__.log_ng(rank, last_seen, *args, **kwargs)
 
+    @BaseTask._bind_impl_
+    def log_stream(self, rank: int = 0, last_seen=None, *args, **kwargs):
+        """
+        持续获取训练任务日志, 服务端有新日志时推送, 不需要客户端轮询
+
+        Args:
+            rank (int): 节点编号
+            last_seen (str, optional): 上次读取到的日志的last_seen，用于断点续读，默认为None
+
+        Returns:
+            async generator, 每次 yield (event, data), event 为 log 或者 status
+
+        Examples:
+
+            >>> async for event, data in experiment.log_stream(rank=0):
+            >>>     print(data.get('data', ''))
+
+        """
+        return self.__impl__.log_stream(rank, last_seen, *args, **kwargs)
+
     @BaseTask._bind_impl_
     async def sys_log(self, *args, **kwargs):
         """获取sys log的方法"""
@@ -169,6 +189,9 @@ class ITrainingTaskImpl(ITaskImpl):
     async def log_ng(self, rank: int = 0, last_seen=None, *args, **kwargs):
         raise NotImplementedError
 
+    def log_stream(self, rank: int = 0, last_seen=None, *args, **kwargs):
+        raise NotImplementedError
+
     async def sys_log(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -119,6 +119,36 @@ async def async_requests(method: RequestMethod, url: str, assert_success: list =
                     await sleep(2)
 
 
+async def async_stream_events(method: RequestMethod, url: str, **kwargs):
+    """
+    读取 SSE (text/event-stream) 接口, 逐个 yield (event, data), data 按 json 解析
+    经过 bff 转发时不支持推送, 直接报错, 由调用方回退到轮询
+    """
+    if os.environ.get('external') == 'true':
+        raise NotImplementedError('外部用户暂不支持日志推送')
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=kwargs.pop('read_timeout', 60))
+    async with aiohttp.ClientSession(trust_env=True) as session:
+        action = session.post if method == RequestMethod.POST else session.get
+        async with action(url=url, timeout=timeout, headers={'Accept': 'text/event-stream'}, **kwargs) as response:
+            check_client_version(response.headers.get('client-version', 'NotFound'))
+            if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                result = json.loads(await response.text())
+                raise Exception(f'请求失败: {result.get("msg", result)}')
+            event, data = 'message', []
+            async for line in response.content:
+                line = line.decode().rstrip('\r\n')
+                if line == '':
+                    if data:
+                        yield event, json.loads('\n'.join(data))
+                    event, data = 'message', []
+                elif line.startswith(':'):
+                    continue
+                elif line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data.append(line[len('data:'):].lstrip())
+
+
 def request_url(method: RequestMethod, url: str, assert_success: list = None, allow_unsuccess: bool = False, **kwargs):
     """
     向url发送一个同步请求
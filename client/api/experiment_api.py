@@ -16,7 +16,7 @@ import urllib
 
 from .api_config import get_mars_token as mars_token
 from .api_config import get_mars_url as mars_url
-from .api_utils import async_requests, RequestMethod
+from .api_utils import async_requests, async_stream_events, RequestMethod
 
 
 # ==============================================================================
@@ -179,6 +179,21 @@ class ExperimentImpl(ITrainingTaskImpl, ABC):
         self.task.last_seen = res['last_seen']
         return res
 
+    async def log_stream(self, rank: int = 0, last_seen: str = 'null', *args, **kwargs):
+        """
+        持续查看日志, 服务端有新日志时推送, yield (event, data)
+        @param rank:
+        @param last_seen:
+        @return:
+        """
+        task = self.task
+        token = kwargs.get('token', mars_token())
+        url = f'{mars_url()}/query/task/log/stream?token={token}&chain_id={task.chain_id}&rank={rank}&last_seen={urllib.parse.quote(last_seen)}'
+        async for event, data in async_stream_events(RequestMethod.POST, url):
+            if data.get('last_seen'):
+                self.task.last_seen = data['last_seen']
+            yield event, data
+
     async def sys_log(self, *args, **kwargs):
         """
         查看系统错误日志
@@ -105,8 +105,9 @@ async def logs(experiment, follow, rank, exp_type, container=False):
     else:
         console.print('=' * 20 + f' [blue] fetching [/blue] log on rank {rank}... ' + '=' * 20)
         hf_tqdm = False
-        while True:
-            log, exit_code, stop_code = await experiment.log(rank=rank, last_seen=json.dumps(experiment.last_seen), with_code=True)
+
+        def print_log(log):
+            nonlocal hf_tqdm
             log = '' if log == '还没产生日志' else log
             # console.out(log, end='')
             log_lines = log.split('\n')
@@ -128,6 +129,8 @@ async def logs(experiment, follow, rank, exp_type, container=False):
                 segments = log_line.split('\r')
                 for idx, seg in enumerate(segments):
                     console.out(seg, end='\r' if idx + 1 < len(segments) else '\n')
+
+        def check_exit(exit_code, stop_code):
             # 如果 stop_code 不是被打断的，那么 exit
             if stop_code < STOP_CODE.HOOK_RESTART:
                 if stop_code == STOP_CODE.STOP:
@@ -136,6 +139,28 @@ async def logs(experiment, follow, rank, exp_type, container=False):
                     sys.exit(exit_code or 1)
             # 其他的任务就算 stop 了，也没跑完，等着调度
 
+        if follow:
+            # 优先使用服务端推送, 推送结束 (chain 有新任务等) 后重新获取任务再连上; 不支持推送时回退到轮询
+            try:
+                while True:
+                    async for event, data in experiment.log_stream(rank=rank, last_seen=json.dumps(experiment.last_seen)):
+                        if event == 'log':
+                            print_log(data['data'])
+                        if 'stop_code' in data:
+                            check_exit(data['exit_code'], data['stop_code'])
+                    last_seen = experiment.last_seen
+                    await asyncio.sleep(5)
+                    experiment = await status.callback(experiment.id, False, 'id', print_out=False)
+                    experiment.last_seen = last_seen
+            except SystemExit:
+                raise
+            except Exception as e:
+                console.print(f'[yellow]日志推送不可用 ({e})，改为轮询[/yellow]')
+        while True:
+            log, exit_code, stop_code = await experiment.log(rank=rank, last_seen=json.dumps(experiment.last_seen), with_code=True)
+            print_log(log)
+            check_exit(exit_code, stop_code)
+
             if follow:
                 await asyncio.sleep(11)
             else:
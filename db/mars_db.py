@@ -9,6 +9,7 @@ from typing import Dict, List
 
 import sqlalchemy
 import sqlparams
+from prometheus_client import Histogram
 from sqlalchemy import create_engine
 from sqlalchemy.ext.asyncio import create_async_engine
 
@@ -25,12 +26,20 @@ def get_db_engine(db_name):
 
 
 def get_async_db_engine(db_name):
-    db_url = 'postgresql+asyncpg://{user}:{password}@{host}:{port}/{db}'.format(**CONF.database.postgres[db_name])
+    db_url = 'postgresql+asyncpg://{user}:{password}@{host}:{port}/{db}?prepared_statement_cache_size={cache_size}'.format(
+        **CONF.database.postgres[db_name], cache_size=CONF.database.postgres[db_name].get('prepared_statement_cache_size', 500))
     # command_timeout 只有 async 的好使，同步的尽量不要 apply_remote
     return create_async_engine(db_url, pool_pre_ping=True, pool_size=CONF.database.postgres[db_name].pool_size, connect_args={"server_settings": {"application_name": PG_APPLICATION_NAME}})
 
 
 sql_params = sqlparams.SQLParams(in_style='format', out_style='named')
+prepare_sql_params = sqlparams.SQLParams(in_style='format', out_style='numeric_dollar')
+
+
+MARS_DB_QUERY_SECONDS = Histogram(
+    'mars_db_query_seconds', 'MarsDB 执行语句的耗时', ['statement', 'target'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
 
 
 class MarsDB(object):
@@ -55,6 +64,8 @@ class MarsDB(object):
     FALLBACK_SECONDS = 60 * 60
     # 记录目前的 context
     __contexts = {}
+    # 注册过的具名语句, name -> sql (format 风格的 %s 参数)
+    __statements: Dict[str, str] = {}
 
     def __init__(self, overwrite_use_db: str = None):
         # 使用从库
@@ -85,6 +96,64 @@ class MarsDB(object):
             cls.__db['secondary'] = cls.__db['primary']
             cls.__a_db['secondary'] = cls.__a_db['primary']
 
+    @classmethod
+    def register_statement(cls, name: str, sql: str):
+        """
+        注册热点查询，之后用 execute_prepared / a_execute_prepared 执行:
+            sync (psycopg2): 每个连接第一次用到时 PREPARE，之后直接 EXECUTE，不需要每次重新 plan
+            async (asyncpg): asyncpg 本身按 sql 文本缓存 prepared statement，具名语句保证文本稳定，能稳定命中缓存
+        """
+        registered_sql = cls.__statements.get(name)
+        assert registered_sql is None or registered_sql == sql, f'具名语句 {name} 已经注册了不同的 sql'
+        cls.__statements[name] = sql
+
+    @classmethod
+    def __prepare(cls, conn: sqlalchemy.engine.base.Connection, name: str):
+        prepared = conn.connection.info.setdefault('mars_prepared_statements', set())
+        if name not in prepared:
+            sql, _ = prepare_sql_params.format(cls.__statements[name], (None, ) * cls.__statements[name].count('%s'))
+            conn.exec_driver_sql(f'prepare "{name}" as {sql}')
+            prepared.add(name)
+
+    @classmethod
+    def warmup(cls, connections: int = None):
+        """
+        启动时预先建立连接池里的连接，并在每个连接上 prepare 已注册的语句
+        """
+        # secondary 可能 fallback 成了 primary 的 engine，去个重
+        for target, engine in {id(e): (t, e) for t, e in cls.__db.items() if e is not None}.values():
+            conns = []
+            try:
+                for _ in range(connections or engine.pool.size()):
+                    conn = engine.connect()
+                    conns.append(conn)
+                    conn.exec_driver_sql('select 1')
+                    for name in cls.__statements:
+                        try:
+                            cls.__prepare(conn, name)
+                        except Exception as e:
+                            logger.warning(f'warmup 时 prepare {name} 失败: {e}')
+                            conn.rollback()
+            except Exception as e:
+                logger.error(f'warmup {target} 连接池失败: {e}')
+            finally:
+                for conn in conns:
+                    conn.close()
+
+    @classmethod
+    async def a_warmup(cls, connections: int = None):
+        async def connect(engine):
+            async with engine.connect() as conn:
+                await conn.exec_driver_sql('select 1')
+                # 占住连接，保证同时建立 connections 个连接
+                await asyncio.sleep(0.1)
+
+        for target, engine in {id(e): (t, e) for t, e in cls.__a_db.items() if e is not None}.values():
+            try:
+                await asyncio.gather(*[connect(engine) for _ in range(connections or engine.sync_engine.pool.size())])
+            except Exception as e:
+                logger.error(f'warmup {target} 异步连接池失败: {e}')
+
     @classmethod
     def check_fallback_status(cls):
         if cls.fallback_primary_time is not None and time.time() - cls.fallback_primary_time > cls.FALLBACK_SECONDS:
@@ -112,6 +181,12 @@ class MarsDB(object):
             return self.__class__.__a_db[self.overwrite_use_db]
         return self.__class__.__a_db[self.__class__.use_db]
 
+    @property
+    def target(self) -> str:
+        if self.__class__.fallback_primary_time is not None:
+            return 'primary'
+        return self.overwrite_use_db or self.__class__.use_db
+
     def catch_fallback_to_primary(self, e: Exception):
         # 看要不要退回到主库
         if self.overwrite_use_db == 'secondary' or self.__class__.use_db == 'secondary':
@@ -138,12 +213,62 @@ class MarsDB(object):
             return results
 
     def execute_many(self, sql_list: List[str], params_list: List[tuple]) -> List[sqlalchemy.engine.cursor.CursorResult]:
-        try:
-            return self.__execute_many(sql_list, params_list)
-        except Exception as e:
-            if 'canceling statement due to conflict with recovery' in str(e):
+        with MARS_DB_QUERY_SECONDS.labels('unnamed', self.target).time():
+            try:
                 return self.__execute_many(sql_list, params_list)
-            raise e
+            except Exception as e:
+                if 'canceling statement due to conflict with recovery' in str(e):
+                    return self.__execute_many(sql_list, params_list)
+                raise e
+
+    @staticmethod
+    def is_prepared_statement_error(e: Exception, name: str) -> bool:
+        """
+        只认 prepared statement 本身的问题，缺表、缺列这种真正的 sql 错误不重试
+            26000: prepared statement 不存在 (连接被重建过 / 被 deallocate 了)
+            42P05: prepared statement 已经存在 (连接上的记录丢了)
+            0A000: cached plan must not change result type (表结构变了)
+        """
+        orig = getattr(e, 'orig', e)
+        msg = str(orig)
+        pgcode = getattr(orig, 'pgcode', None)
+        if pgcode is not None and pgcode not in ('26000', '42P05', '0A000'):
+            return False
+        if f'prepared statement "{name}"' in msg and ('does not exist' in msg or 'already exists' in msg):
+            return True
+        return 'cached plan must not change result type' in msg
+
+    def __execute_prepared(self, name: str, params: tuple) -> sqlalchemy.engine.cursor.CursorResult:
+        placeholders = ', '.join(['%s'] * len(params))
+        execute_sql = f'execute "{name}"' + (f' ({placeholders})' if params else '')
+        with self as conn:
+            try:
+                self.__class__.__prepare(conn, name)
+                return conn.exec_driver_sql(execute_sql, tuple(params))
+            except Exception as e:
+                if not self.is_prepared_statement_error(e, name):
+                    raise e
+                # 在出错的这个连接上恢复: 事务已经 abort 了，先回滚，再清掉这个连接上的 prepared statement 重新 prepare
+                logger.warning(f'具名语句 {name} 需要重新 prepare: {e}')
+                dbapi_conn = conn.connection
+                dbapi_conn.rollback()
+                with dbapi_conn.cursor() as cursor:
+                    cursor.execute('deallocate all')
+                dbapi_conn.info.pop('mars_prepared_statements', None)
+                self.__class__.__prepare(conn, name)
+                return conn.exec_driver_sql(execute_sql, tuple(params))
+
+    def execute_prepared(self, name: str, params: tuple = ()) -> sqlalchemy.engine.cursor.CursorResult:
+        """
+        执行通过 register_statement 注册的具名语句
+        """
+        with MARS_DB_QUERY_SECONDS.labels(name, self.target).time():
+            try:
+                return self.__execute_prepared(name, params)
+            except Exception as e:
+                if 'canceling statement due to conflict with recovery' in str(e):
+                    return self.__execute_prepared(name, params)
+                raise e
 
     async def a_execute(self, sql: str, params: tuple = (), remote_apply: bool = False, timeout: int = 10) -> sqlalchemy.engine.cursor.CursorResult:
         return (await self.a_execute_many(sql_list=[sql], params_list=[params], remote_apply=remote_apply, timeout=timeout))[0]
@@ -172,13 +297,21 @@ class MarsDB(object):
                         raise
             return results
 
-    async def a_execute_many(self, sql_list: List[str], params_list: List[tuple], remote_apply: bool = False, timeout: int = 10) -> List[sqlalchemy.engine.cursor.CursorResult]:
-        try:
-            return await self.__a_execute_many(sql_list, params_list, remote_apply, timeout)
-        except Exception as e:
-            if 'canceling statement due to conflict with recovery' in str(e):
+    async def a_execute_many(self, sql_list: List[str], params_list: List[tuple], remote_apply: bool = False, timeout: int = 10, statement_name: str = 'unnamed') -> List[sqlalchemy.engine.cursor.CursorResult]:
+        with MARS_DB_QUERY_SECONDS.labels(statement_name, self.target).time():
+            try:
                 return await self.__a_execute_many(sql_list, params_list, remote_apply, timeout)
-            raise e
+            except Exception as e:
+                if 'canceling statement due to conflict with recovery' in str(e):
+                    return await self.__a_execute_many(sql_list, params_list, remote_apply, timeout)
+                raise e
+
+    async def a_execute_prepared(self, name: str, params: tuple = (), remote_apply: bool = False, timeout: int = 10) -> sqlalchemy.engine.cursor.CursorResult:
+        """
+        执行通过 register_statement 注册的具名语句, asyncpg 会按 sql 文本缓存 prepared statement
+        """
+        return (await self.a_execute_many(sql_list=[self.__class__.__statements[name]], params_list=[params],
+                                          remote_apply=remote_apply, timeout=timeout, statement_name=name))[0]
 
     def __enter__(self) -> sqlalchemy.engine.base.Connection:
         try:
@@ -36,7 +36,7 @@ def init_parliament():
 node_list_watcher = NodeListWatcher(process_interval=10)
 namespaces = list(CONF.launcher.task_namespaces_by_role.values())
 pod_list_watcher = PodListWatcher(namespaces, process_interval=1)
-event_list_watcher = EventListWatcher(namespaces, field_selector='type=Warning', process_interval=10)
+event_list_watcher = EventListWatcher(namespaces, field_selector='type=Warning', process_interval=10, pod_list_watcher=pod_list_watcher)
 
 
 healthy = True
@@ -56,6 +56,8 @@ class ListWatcher(ABC):
                 raw = list_func(**kwargs)
                 latest_resource_version = raw['metadata']['resourceVersion']
                 self._data[index] = {item['metadata']['name']: item for item in raw['items']}
+                for item in raw['items']:
+                    self.on_update(index, item)
                 self.last_update[index] = datetime.now()
                 self._ready[index] = True
                 # 为了保证stream重试，不需要添加timeout_seconds参数，且需指定resource_version
@@ -67,6 +69,7 @@ class ListWatcher(ABC):
                         name = event['object']['metadata']['name']
                         if event['type'] == 'ADDED' or event['type'] == 'MODIFIED':
                             self._data[index][name] = event['object']
+                            self.on_update(index, event['object'])
                         elif event['type'] == 'DELETED':
                             self._data[index].pop(name, None)
                         self.last_update[index] = datetime.now()
@@ -81,6 +84,10 @@ class ListWatcher(ABC):
                              f'last update time: {self.last_update[index].strftime("%Y-%m-%d %H:%M:%S") if index in self.last_update.keys() else "None"}!')
             time.sleep(5)
 
+    def on_update(self, index, obj):
+        # list 或 watch 到新增/修改的对象时调用，运行在 list_watch 线程里，子类需要增量处理时覆盖，不要做耗时操作
+        pass
+
     @abstractmethod
     def process(self):
         # process 运行有两种触发方式：定时任务，或者接收到k8s watch事件
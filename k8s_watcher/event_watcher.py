@@ -1,59 +1,110 @@
 
+
+import time
 import ujson
+from collections import defaultdict, deque
 from dateutil.parser import parse
 from datetime import datetime, timedelta, timezone
 
 from .base import ListWatcher
+from conf import CONF
 from logm import log_stage
 from db import redis_conn
 from .utils import all_corev1, all_custom_corev1, module
 
 
 class EventListWatcher(ListWatcher):
-    def __init__(self, namespaces=None, label_selector=None, field_selector=None, process_interval=10):
+    def __init__(self, namespaces=None, label_selector=None, field_selector=None, process_interval=10, pod_list_watcher=None,
+                 dedupe_window=CONF.try_get('k8swatcher.event_dedupe_window', default=1800)):
+        """
+        @param pod_list_watcher: 传入 PodListWatcher 时，pod 信息直接从它的 list watch cache 里拿，不再逐个请求 api server
+        @param dedupe_window: 去重窗口（秒），窗口内同一个 event 版本只处理一次、同一个 pod 只上报一次
+        """
         list_watch_funcs = {
             host: (all_custom_corev1[host].list_namespaced_event, all_corev1[host].list_namespaced_event)
             for host in all_custom_corev1.keys()
         }
         super().__init__('event', list_watch_funcs, namespaces, label_selector, field_selector, process_interval)
-        self.reported_pods = set()
+        self.pod_list_watcher = pod_list_watcher
+        self.dedupe_window = dedupe_window
+        # list watch 线程收到的、还没处理的 fail event
+        self.pending_events = deque()
+        # (index, event name) -> (resourceVersion, 处理时间)，relist 的时候不会重复处理
+        self.seen_versions = dict()
+        # pod_name -> 上报时间
+        self.reported_pods = dict()
+
+    @staticmethod
+    def is_failing_event(item):
+        # 只看节点上报的fail event
+        if not ('source' in item.keys() and item['source'].get('component', '') == 'kubelet' and 'fail' in item.get('message', '').lower()):
+            return False
+        # skip as this is normal warning
+        return 'failed to delete \\"eth0\\": no such device' not in item['message']
+
+    def on_update(self, index, obj):
+        if self.is_failing_event(obj):
+            self.pending_events.append((index, obj))
+
+    def expire(self, now):
+        expire_before = now - self.dedupe_window
+        self.seen_versions = {k: v for k, v in self.seen_versions.items() if v[1] > expire_before}
+        self.reported_pods = {k: v for k, v in self.reported_pods.items() if v > expire_before}
+
+    def get_pod(self, index, namespace, pod_name):
+        """
+        优先从 pod list watch 的 cache 里取，cache 没 ready 的时候才去请求 api server
+        """
+        if self.pod_list_watcher is not None and self.pod_list_watcher._ready.get(index, False):
+            return self.pod_list_watcher._data.get(index, {}).get(pod_name)
+        cluster_host = index.split(':')[0]
+        resp = all_corev1[cluster_host].read_namespaced_pod_with_retry(pod_name, namespace, _preload_content=False, _request_timeout=5)
+        return None if resp is None else ujson.loads(resp.data)
 
     @log_stage(f'{module}.eventwatcher')
     def process(self):
-        task_messages = dict()
-        self._data_copied = {k: v.copy() for k, v in self._data.items()}
-        for index, data in self._data_copied.items():
-            for item in data.values():
-                # 只看节点上报的fail event
-                if 'source' in item.keys() and item['source'].get('component', '') == 'kubelet' and 'fail' in item['message'].lower():
-                    if 'failed to delete \\"eth0\\": no such device' in item['message']:
-                        # skip as this is normal warning
-                        continue
-                    pod_name = item['involvedObject']['name']
-                    namespace = item['involvedObject']['namespace']
-                    try:
-                        task_id = pod_name.split('-')[-2]
-                    except:
-                        continue
-                    if pod_name not in self.reported_pods:
-                        self.log_info(f"index: {index}, pod_name: {pod_name}, event: {item['message']}")
-                        self.reported_pods.add(pod_name)
-                        cluster_host = index.split(':')[0]
-                        resp = all_corev1[cluster_host].read_namespaced_pod_with_retry(pod_name, namespace, _preload_content=False, _request_timeout=5)
-                        if resp is None:
-                            self.log_info(f"index {index}, {pod_name} already deleted")
-                            continue
-                        pod = ujson.loads(resp.data)
-                        # 过滤非任务容器
-                        # 任务启动时间小于30分钟才记录到redis
-                        if pod['metadata'].get('labels', {}).get('compute_node', '') == 'true' and \
-                            datetime.utcnow().replace(tzinfo=timezone.utc) - \
-                                parse(pod['metadata']['creationTimestamp']).astimezone(timezone.utc) \
-                                    <= timedelta(minutes=30):
-                            if task_id not in task_messages.keys():
-                                task_messages[task_id] = item['message']
-                            else:
-                                task_messages[task_id] += f"\n{item['message']}"
-        for task_id, msg in task_messages.items():
+        now = time.time()
+        self.expire(now)
+        # (index, namespace, pod_name) -> message -> event name -> count，同一个 pod 的重复 event 聚合到一起
+        pod_events = defaultdict(lambda: defaultdict(dict))
+        for _ in range(len(self.pending_events)):
+            index, item = self.pending_events.popleft()
+            key = (index, item['metadata']['name'])
+            resource_version = item['metadata'].get('resourceVersion')
+            if self.seen_versions.get(key, (None, ))[0] == resource_version:
+                continue
+            self.seen_versions[key] = (resource_version, now)
+            pod_name = item['involvedObject']['name']
+            if pod_name in self.reported_pods:
+                continue
+            # 同一个 event 被更新时 count 会累加，取最新的
+            pod_events[(index, item['involvedObject']['namespace'], pod_name)][item['message']][item['metadata']['name']] = item.get('count') or 1
+
+        task_messages = defaultdict(list)
+        for (index, namespace, pod_name), messages in pod_events.items():
+            try:
+                task_id = pod_name.split('-')[-2]
+            except:
+                continue
+            self.reported_pods[pod_name] = now
+            messages = [msg if (count := sum(counts.values())) == 1 else f'{msg} (x{count})' for msg, counts in messages.items()]
+            self.log_info(f"index: {index}, pod_name: {pod_name}, event: {messages}")
+            pod = self.get_pod(index, namespace, pod_name)
+            if pod is None:
+                self.log_info(f"index {index}, {pod_name} already deleted")
+                continue
+            # 过滤非任务容器
+            # 任务启动时间小于30分钟才记录到redis
+            if pod['metadata'].get('labels', {}).get('compute_node', '') == 'true' and \
+                datetime.utcnow().replace(tzinfo=timezone.utc) - \
+                    parse(pod['metadata']['creationTimestamp']).astimezone(timezone.utc) \
+                        <= timedelta(minutes=30):
+                task_messages[task_id] += messages
+        if not task_messages:
+            return
+        pipe = redis_conn.pipeline(transaction=False)
+        for task_id, messages in task_messages.items():
+            msg = '\n'.join(messages)
             self.log_info(f'reported {task_id} error event: {msg}')
-            redis_conn.set(f'lifecycle:{task_id}:task_event', f'有任务容器遇到错误，请及时联系管理员\n{msg}')
+            pipe.set(f'lifecycle:{task_id}:task_event', f'有任务容器遇到错误，请及时联系管理员\n{msg}')
+        pipe.execute()
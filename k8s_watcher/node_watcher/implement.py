@@ -5,6 +5,7 @@ from .custom import *
 
 
 import pickle
+import time
 from operator import ior
 from functools import reduce
 from k8s_watcher.base import ListWatcher
@@ -150,5 +151,9 @@ class NodeListWatcher(ListWatcher):
         nodes_df = self._get_nodes_df()
         if not nodes_df.equals(self.last_nodes_df):
             logger.info(f'set nodes_df_pickle in redis')
-            redis_conn.set('nodes_df_pickle', pickle.dumps(nodes_df))  # 这里改成 pickle，json 反序列化 None 可能会变成 NAN
+            # 这里改成 pickle，json 反序列化 None 可能会变成 NAN；同时更新版本号，读的一方只看版本号就知道变没变
+            with redis_conn.pipeline() as pipe:
+                pipe.set('nodes_df_pickle', pickle.dumps(nodes_df))
+                pipe.set('nodes_df_version', time.time_ns())
+                pipe.execute()
             self.last_nodes_df = nodes_df
@@ -5,5 +5,6 @@ setup_custom_finder()
 
 from .monitor_data import get_node_monitor_stats, async_get_node_monitor_stats, \
     get_container_monitor_stats, async_get_container_monitor_stats, \
+    get_task_perf_samples, async_get_task_perf_samples, \
     get_storage_usage, async_get_storage_usage, async_get_storage_usage_at, \
     StorageTypes, DefaultStorage
@@ -1,13 +1,21 @@
 
-
+# 各容器当前的监控数据, list of dict 或 DataFrame, `monitor.task_perf_store` 用到其中的 task_id / rank / node / cpu / mem
 def get_container_monitor_stats():              return None
 async def async_get_container_monitor_stats():  return None
 
 
+# 各节点当前的监控数据, list of dict / DataFrame / {node: dict},
+# `monitor.task_perf_store` 用到其中的 node (或 name) / gpu / every_card / every_card_mem / ib_recv / ib_trans
 def get_node_monitor_stats():               return None
 async def async_get_node_monitor_stats():   return None
 
 
+# 各任务各 rank 当前的性能数据, 写入 `monitor.task_perf_store`, 不实现时用上面两个接口的数据拼出来, 格式为
+# [{'task_id', 'rank', 'node', 'timestamp', 'gpu', 'cpu', 'mem', 'ib_recv', 'ib_trans', 'every_card': [...], 'every_card_mem': [...]}]
+def get_task_perf_samples():                return None
+async def async_get_task_perf_samples():    return None
+
+
 def get_storage_usage(*args, **kwargs):                 return None
 async def async_get_storage_usage(*args, **kwargs):     return None
 async def async_get_storage_usage_at(*args, **kwargs):   return None
@@ -0,0 +1,324 @@
+"""
+任务性能数据 (GPU / CPU / 内存 / IB) 的本地时序存储, 给任务的性能面板用, 不依赖外部的 TSDB
+    - 数据来源是 `monitor.monitor_data` 里已有的 `async_get_container_monitor_stats` / `async_get_node_monitor_stats`,
+      节点数据通过 nodes_df 的 working_task_id / working_task_rank 对应到任务; 实现了 `async_get_task_perf_samples` 时直接用它
+    - 由 monitor server 里抢到写锁的进程定时拉取写入
+    - 按 tier 降采样 (默认 1min / 5min), 每个 bucket 存平均值, 不同 tier 保留不同的时间
+    - 存储结构: {root}/{task_id}/{tier}/{rank}/{segment 起始时间}.bin, 每个 segment 覆盖 tier 的一段固定时间窗口,
+      只追加定长记录, 记录按时间有序, 查询时 np.fromfile + searchsorted; 过期按 segment 整个删掉,
+      所以长时间运行的任务文件也不会无限变大
+    - {root}/{task_id}/nodes.json 记录每个 rank 所在的节点
+"""
+
+
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import ujson
+
+from conf import CONF
+from logm import logger
+
+
+ROOT = CONF.try_get('monitor.task_perf_store.path', default='/var/lib/hai/task_perf')
+# tier -> (bucket 秒数, 保留秒数, segment 秒数)
+# segment 默认是保留时间的 1/7, 实际保留的数据最多比 retention 多一个 segment
+TIERS = {
+    tier: (config['interval'], config['retention'], config.get('segment', max(config['interval'], config['retention'] // 7)))
+    for tier, config in CONF.try_get('monitor.task_perf_store.tiers', default={
+        '1min': {'interval': 60, 'retention': 7 * 86400},
+        '5min': {'interval': 300, 'retention': 90 * 86400},
+    }).items()
+}
+FEED_INTERVAL = CONF.try_get('monitor.task_perf_store.feed_interval', default=15)
+EXPIRE_INTERVAL = 3600
+# 只能在末尾追加, 已经写入的数据里 metric 用的是下标
+METRICS = ('gpu', 'cpu', 'mem', 'every_card', 'every_card_mem', 'ib_recv', 'ib_trans')
+METRIC_IDS = {metric: i for i, metric in enumerate(METRICS)}
+# 每张卡一个值的指标, 样本里是 list
+CARD_METRICS = {'every_card', 'every_card_mem'}
+# 从容器 / 节点的监控数据里取的指标
+CONTAINER_METRICS = ('cpu', 'mem')
+NODE_METRICS = ('gpu', 'every_card', 'every_card_mem', 'ib_recv', 'ib_trans')
+RECORD_DTYPE = np.dtype([('ts', '<u4'), ('metric', 'u1'), ('card', 'u1'), ('value', '<f4')])
+
+
+def series_dir(task_id, tier, rank):
+    return os.path.join(ROOT, str(task_id), tier, str(rank))
+
+
+def segment_path(task_id, tier, rank, ts):
+    segment = TIERS[tier][2]
+    return os.path.join(series_dir(task_id, tier, rank), f'{ts - ts % segment}.bin')
+
+
+def list_segments(task_id, tier, rank, start=None, end=None) -> List[str]:
+    """
+    按时间排序的 segment 文件, 只返回和 [start, end] 有交集的
+    """
+    segment = TIERS[tier][2]
+    try:
+        starts = sorted(int(name[:-4]) for name in os.listdir(series_dir(task_id, tier, rank)) if name.endswith('.bin'))
+    except FileNotFoundError:
+        return []
+    return [
+        os.path.join(series_dir(task_id, tier, rank), f'{ts}.bin') for ts in starts
+        if (start is None or ts + segment > start) and (end is None or ts <= end)
+    ]
+
+
+def as_records(stats) -> List[dict]:
+    """
+    监控数据可能是 DataFrame / list of dict / {node: dict}, 统一成 list of dict
+    """
+    if stats is None:
+        return []
+    if isinstance(stats, pd.DataFrame):
+        return stats.to_dict('records')
+    if isinstance(stats, dict):
+        return [{'node': node, **values} for node, values in stats.items()]
+    return list(stats)
+
+
+def build_samples(container_stats, node_stats, nodes_df: Optional[pd.DataFrame]) -> List[dict]:
+    """
+    用已有的监控数据拼出 append 需要的样本
+        - container_stats: 每个容器一条, 用到 task_id / rank / node 和 CONTAINER_METRICS
+        - node_stats: 每个节点一条, 用到 node (或 name) 和 NODE_METRICS
+        - 节点的数据按 nodes_df 的 working_task_id / working_task_rank 算到独占这个节点的任务上
+    """
+    samples = {}
+    for row in as_records(container_stats):
+        if row.get('task_id') is None or row.get('rank') is None:
+            continue
+        key = (int(row['task_id']), int(row['rank']))
+        sample = samples.setdefault(key, {'task_id': key[0], 'rank': key[1], 'node': row.get('node')})
+        sample.update({metric: row[metric] for metric in CONTAINER_METRICS if row.get(metric) is not None})
+    working = {}
+    if nodes_df is not None and len(nodes_df) > 0:
+        df = nodes_df[nodes_df.working_task_id.notna() & nodes_df.working_task_rank.notna()]
+        working = dict(zip(df.name, zip(df.working_task_id.astype(int), df.working_task_rank.astype(int))))
+    for row in as_records(node_stats):
+        node = row.get('node', row.get('name'))
+        if (key := working.get(node)) is None:
+            continue
+        sample = samples.setdefault(key, {'task_id': key[0], 'rank': key[1], 'node': node})
+        sample.update({metric: row[metric] for metric in NODE_METRICS if row.get(metric) is not None})
+    return list(samples.values())
+
+
+def read_records(path, tail: Optional[int] = None) -> np.ndarray:
+    """
+    tail: 只读最后 tail 条记录; 写入方可能正写了半条, 多出来的字节忽略
+    """
+    try:
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        offset = 0 if tail is None else max(count - tail, 0)
+        return np.fromfile(path, dtype=RECORD_DTYPE, count=count - offset, offset=offset * RECORD_DTYPE.itemsize)
+    except FileNotFoundError:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+
+class TaskPerfStore(object):
+    # 写入状态, 只在抢到写锁的进程里有
+    # tier -> {(task_id, rank): [bucket 起始时间, {(metric_id, card): [sum, count]}]}
+    _buckets: Dict[str, dict] = {tier: {} for tier in TIERS}
+    _nodes: Dict[int, dict] = {}
+    _lock_file = None
+    _last_expire = 0
+
+    @classmethod
+    def try_become_writer(cls) -> bool:
+        """
+        一台机器上只有一个进程写, 写的进程挂了之后其他进程下次尝试时接手
+        """
+        if cls._lock_file is not None:
+            return True
+        os.makedirs(ROOT, exist_ok=True)
+        lock_file = open(os.path.join(ROOT, '.writer.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        cls._lock_file = lock_file
+        return True
+
+    @classmethod
+    def _write_bucket(cls, tier, task_id, rank, bucket_ts, values: dict):
+        records = np.array([(bucket_ts, metric_id, card, s / c) for (metric_id, card), (s, c) in sorted(values.items())], dtype=RECORD_DTYPE)
+        path = segment_path(task_id, tier, rank, bucket_ts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(records.tobytes())
+
+    @classmethod
+    def _update_nodes(cls, task_id, rank, node):
+        nodes = cls._nodes.setdefault(task_id, {})
+        if node is None or nodes.get(rank) == node:
+            return
+        nodes[rank] = node
+        os.makedirs(os.path.join(ROOT, str(task_id)), exist_ok=True)
+        tmp_path = os.path.join(ROOT, str(task_id), f'nodes.json.{os.getpid()}')
+        with open(tmp_path, 'w') as f:
+            ujson.dump({str(r): n for r, n in nodes.items()}, f)
+        os.replace(tmp_path, os.path.join(ROOT, str(task_id), 'nodes.json'))
+
+    @classmethod
+    def append(cls, samples: List[dict]):
+        """
+        samples: [{'task_id', 'rank', 'node', 'timestamp'(可选), 'gpu', 'cpu', 'mem', 'every_card': [..], ...}]
+        """
+        now = time.time()
+        for sample in samples:
+            task_id, rank = int(sample['task_id']), int(sample['rank'])
+            ts = int(sample.get('timestamp') or now)
+            cls._update_nodes(task_id, rank, sample.get('node'))
+            for tier, (interval, *_) in TIERS.items():
+                bucket_ts = ts - ts % interval
+                state = cls._buckets[tier].get((task_id, rank))
+                if state is not None and bucket_ts < state[0]:
+                    continue    # 迟到的样本, bucket 已经写出去了
+                if state is not None and bucket_ts > state[0]:
+                    cls._write_bucket(tier, task_id, rank, *state)
+                    state = None
+                if state is None:
+                    state = cls._buckets[tier][(task_id, rank)] = [bucket_ts, {}]
+                for metric, metric_id in METRIC_IDS.items():
+                    if (value := sample.get(metric)) is None:
+                        continue
+                    for card, v in (enumerate(value) if metric in CARD_METRICS else [(0, value)]):
+                        if v is None or v != v or card > 255:
+                            continue
+                        acc = state[1].setdefault((metric_id, card), [0.0, 0])
+                        acc[0] += float(v)
+                        acc[1] += 1
+
+    @classmethod
+    def flush(cls, now=None, force=False):
+        """
+        把已经结束的 bucket 写到文件里, 多等一个 interval 接收迟到的样本
+        """
+        now = now or time.time()
+        for tier, (interval, *_) in TIERS.items():
+            for key, state in list(cls._buckets[tier].items()):
+                if force or now >= state[0] + 2 * interval:
+                    cls._write_bucket(tier, *key, *cls._buckets[tier].pop(key))
+
+    @classmethod
+    def expire(cls, now=None):
+        """
+        按 tier 删除整个时间窗口都超过保留时间的 segment, 所有 tier 都删光了就把任务目录删掉
+        """
+        now = now or time.time()
+        if not os.path.isdir(ROOT):
+            return
+        for task_dir in os.scandir(ROOT):
+            if not task_dir.is_dir() or not task_dir.name.isdigit():
+                continue
+            for tier, (_, retention, segment) in TIERS.items():
+                tier_dir = os.path.join(task_dir.path, tier)
+                if not os.path.isdir(tier_dir):
+                    continue
+                for rank_dir in os.scandir(tier_dir):
+                    for file in os.scandir(rank_dir.path):
+                        if file.name.endswith('.bin') and int(file.name[:-4]) + segment < now - retention:
+                            os.remove(file.path)
+                    if len(os.listdir(rank_dir.path)) == 0:
+                        os.rmdir(rank_dir.path)
+                if len(os.listdir(tier_dir)) == 0:
+                    os.rmdir(tier_dir)
+            if not any(os.path.isdir(os.path.join(task_dir.path, tier)) for tier in TIERS):
+                shutil.rmtree(task_dir.path, ignore_errors=True)
+                cls._nodes.pop(int(task_dir.name), None)
+
+    @classmethod
+    async def get_samples(cls) -> List[dict]:
+        from monitor import async_get_task_perf_samples, async_get_container_monitor_stats, async_get_node_monitor_stats
+        from k8s.async_v1_api import async_get_nodes_df
+        if (samples := await async_get_task_perf_samples()) is not None:
+            return samples
+        container_stats, node_stats = await asyncio.gather(async_get_container_monitor_stats(), async_get_node_monitor_stats())
+        if container_stats is None and node_stats is None:
+            return []
+        nodes_df = await async_get_nodes_df() if node_stats is not None else None
+        return build_samples(container_stats, node_stats, nodes_df)
+
+    @classmethod
+    async def feed_forever(cls):
+        while True:
+            await asyncio.sleep(FEED_INTERVAL)
+            try:
+                if not cls.try_become_writer():
+                    continue
+                cls.append(await cls.get_samples())
+                cls.flush()
+                if time.time() - cls._last_expire > EXPIRE_INTERVAL:
+                    cls._last_expire = time.time()
+                    cls.expire()
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f'写入任务性能数据失败: {e}')
+
+    @classmethod
+    def get_nodes(cls, task_id) -> dict:
+        try:
+            with open(os.path.join(ROOT, str(task_id), 'nodes.json')) as f:
+                return {int(r): n for r, n in ujson.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @classmethod
+    def query(cls, task_ids, rank: int, query_type: str, tier: str, start=None, end=None) -> List[dict]:
+        """
+        查询多个任务 (一般是整条 chain) 某个 rank 的时序数据, 按时间排序
+        """
+        if query_type not in METRIC_IDS:
+            raise ValueError(f'不支持的 query_type: {query_type}')
+        if tier not in TIERS:
+            raise ValueError(f'不支持的 data_interval: {tier}')
+        result = []
+        for task_id in sorted(task_ids):
+            segments = list_segments(task_id, tier, rank, start, end)
+            records = np.concatenate([read_records(path) for path in segments]) if segments else np.empty(0, dtype=RECORD_DTYPE)
+            lo = 0 if start is None else np.searchsorted(records['ts'], start, side='left')
+            hi = len(records) if end is None else np.searchsorted(records['ts'], end, side='right')
+            records = records[lo:hi]
+            records = records[records['metric'] == METRIC_IDS[query_type]]
+            node = cls.get_nodes(task_id).get(rank)
+            with_card = query_type in CARD_METRICS
+            for ts, card, value in zip(records['ts'].tolist(), records['card'].tolist(), records['value'].tolist()):
+                item = {'timestamp': ts, 'task_id': task_id, 'rank': rank, 'node': node, 'value': round(value, 3)}
+                if with_card:
+                    item['card'] = card
+                result.append(item)
+        return result
+
+    @classmethod
+    def latest(cls, task_id, ranks: int) -> Dict[str, float]:
+        """
+        最近一个 bucket 的值, 各个 rank 的 gpu 取平均, ib 流量求和; 没有数据的指标不返回
+        """
+        tier = min(TIERS, key=lambda t: TIERS[t][0])
+        values = {}
+        for rank in range(ranks):
+            # 刚切到新的 segment 时最新的文件里可能还没有数据
+            for path in reversed(list_segments(task_id, tier, rank)[-2:]):
+                if len(records := read_records(path, tail=len(METRICS) * 256)) > 0:
+                    break
+            else:
+                continue
+            records = records[records['ts'] == records['ts'][-1]]
+            for metric_id, value in zip(records['metric'].tolist(), records['value'].tolist()):
+                if METRICS[metric_id] in ('gpu', 'ib_recv', 'ib_trans'):
+                    values.setdefault(METRICS[metric_id], []).append(value)
+        return {
+            metric: (sum(v) / len(v) if metric == 'gpu' else sum(v))
+            for metric, v in values.items()
+        }
@@ -1,6 +1,12 @@
 
 
 import os
+import time
+
+import ujson
+
+from db import redis_conn
+from logm import logger
 from roman_parliament.archive import register_archive, archive_dict
 from roman_parliament.utils import generate_key
 from server_model.selector import TrainingTaskSelector
@@ -12,6 +18,36 @@ from .base_trigger import BaseTrigger
 
 LAUNCHER_COUNT = int(os.environ['LAUNCHER_COUNT'])
 CURRENT_LAUNCHER = int(os.environ['REPLICA_RANK']) if os.environ.get('MODULE_NAME', '') == 'launcher' and 'REPLICA_RANK' in os.environ else -1
+# matcher 发起动信号时写 {key}:{task_id}，launcher 收到之后把延迟写回 {latency key}:{matcher}，matcher 下个 tick 取走上报
+SIGNAL_DECIDED_KEY = 'launcher_task_trigger:decided_at'
+SIGNAL_LATENCY_KEY = 'launcher_task_trigger:pickup_latency'
+SIGNAL_DECIDED_EXPIRE = 600
+SIGNAL_LATENCY_MAX_LEN = 10000
+
+
+def report_pickup_latency(task_ids):
+    """
+    记录从 matcher 做出决定到 launcher 收到任务的延迟
+    """
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.get(f'{SIGNAL_DECIDED_KEY}:{task_id}')
+            pipe.delete(f'{SIGNAL_DECIDED_KEY}:{task_id}')
+        decisions = pipe.execute()[::2]
+        now = time.time()
+        pipe = redis_conn.pipeline(transaction=False)
+        for decision in decisions:
+            # 重发的信号、或者太久没收到的已经没有记录了
+            if decision is None:
+                continue
+            decision = ujson.loads(decision)
+            latency_key = f'{SIGNAL_LATENCY_KEY}:{decision["matcher"]}'
+            pipe.lpush(latency_key, round((now - decision['decided_at']) * 1000, 3))
+            pipe.ltrim(latency_key, 0, SIGNAL_LATENCY_MAX_LEN - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.exception(e)
 
 
 class LauncherTaskTrigger(BaseTrigger):
@@ -21,6 +57,7 @@ class LauncherTaskTrigger(BaseTrigger):
     @classmethod
     def create_archive(cls, data):
         if CURRENT_LAUNCHER >= 0:
+            picked_task_ids = []
             for task_id, assigned_launcher_id in data.items():
                 if assigned_launcher_id != CURRENT_LAUNCHER:
                     continue
@@ -29,3 +66,6 @@ class LauncherTaskTrigger(BaseTrigger):
                     task = TrainingTaskSelector.find_one_by_id(AutoTaskSchemaImpl, id=task_id)
                     if task.task_type in [TASK_TYPE.JUPYTER_TASK, TASK_TYPE.TRAINING_TASK, TASK_TYPE.VALIDATION_TASK, TASK_TYPE.BACKGROUND_TASK]:
                         register_archive(archive=task, sign='id')
+                        picked_task_ids.append(task_id)
+            if len(picked_task_ids):
+                report_pickup_latency(picked_task_ids)
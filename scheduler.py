@@ -5,7 +5,7 @@ from logm import logger
 from conf import CONF
 from db import MarsDB
 import multiprocessing as mp
-from scheduler.base_model import ProcessConnection
+from scheduler.base_model import ProcessConnection, expand_module, expand_edge, merger_upstreams
 from roman_parliament import register_parliament
 
 
@@ -29,37 +29,49 @@ if __name__ == '__main__':
     ''')}, dumps=pickle.dumps, loads=pickle.loads)
     MarsDB.dispose()
     scheduler_modules = {}
+
+    def add_module(name, cls, kwargs):
+        scheduler_modules[name] = {
+            'conn': ProcessConnection(name),
+            'class': cls,
+            'kwargs': kwargs
+        }
+        scheduler_modules[name]['instance'] = cls(
+            name=name,
+            conn=scheduler_modules[name]['conn'],
+            global_config_conn=global_config_conn,
+            **kwargs
+        )
+
+    # 分片模式: {assigner / matcher 的名字: {num_shards, group_sets}}
+    partitions = CONF.scheduler.get('partition', {})
     # 初始化除了 monitor 以外的 modules
     for suffix in ['beater', 'assigner', 'matcher', 'feedbacker', 'subscriber']:
         for name, config in CONF.scheduler.get(suffix, {}).items():
-            name = f'{name}_{suffix}'
-            scheduler_modules[name] = {
-                'conn': ProcessConnection(name),
-                'class': import_from_str(config['class']),
-                'kwargs': config.get('kwargs', {})
-            }
-            scheduler_modules[name]['instance'] = scheduler_modules[name]['class'](
-                name=name,
-                conn=scheduler_modules[name]['conn'],
-                global_config_conn=global_config_conn,
-                **scheduler_modules[name]['kwargs']
-            )
+            cls = import_from_str(config['class'])
+            for module_name, module_cls, module_kwargs in expand_module(suffix, name, cls, config.get('kwargs', {}), partitions):
+                add_module(module_name, module_cls, module_kwargs)
+            if suffix == 'matcher' and name in partitions:
+                for upstream_name, shard_name in merger_upstreams(name, partitions):
+                    scheduler_modules[f'{name}_{suffix}']['instance'].add_upstream(upstream_name, scheduler_modules[shard_name]['conn'])
+            if name in partitions and suffix in ('assigner', 'matcher'):
+                logger.info(f'{name}_{suffix} 分为 {partitions[name]["num_shards"]} 片')
+
     # 指定 relation
     for relation_name, relations in CONF.scheduler.relations.items():
         for k, v in relations.items():
             for item in v:
-                upstream = f"{k.split('.')[1]}_{k.split('.')[0]}"
                 upstream_name = 'default'
                 dot_downstream = item
                 if item.find('[') > 0:
                     dot_downstream = item.split('[')[0]
                     upstream_name = item.split('[')[1].split(']')[0]
-                downstream = f"{dot_downstream.split('.')[1]}_{dot_downstream.split('.')[0]}"
-                scheduler_modules[downstream]['instance'].add_upstream(
-                    upstream_name,
-                    scheduler_modules[upstream]['conn']
-                )
-                logger.info(f'[{relation_name}] {upstream} -[{upstream_name}]-> {downstream}')
+                for upstream, downstream, edge_name in expand_edge(k, dot_downstream, upstream_name, partitions):
+                    scheduler_modules[downstream]['instance'].add_upstream(
+                        edge_name,
+                        scheduler_modules[upstream]['conn']
+                    )
+                    logger.info(f'[{relation_name}] {upstream} -[{edge_name}]-> {downstream}')
     # 启动
     for name, module in scheduler_modules.items():
         module['process'] = mp.Process(target=module['instance'].start, name=name)
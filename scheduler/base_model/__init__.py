@@ -6,6 +6,7 @@ from .base_types import TickData, ASSIGN_RESULT, MATCH_RESULT
 from .beater import Beater
 from .connection import ProcessConnection
 from .feedbacker import FeedBacker
-from .matcher import Matcher, modify_task_df_safely
+from .matcher import Matcher, TaskDfMutations, modify_task_df_safely
 from .monitor import Monitor
+from .partition import Partition, PartitionMerger, expand_module, expand_edge, merger_upstreams
 from .subscriber import Subscriber
@@ -1,19 +1,27 @@
 
 
+from typing import Optional
+
 from .base_processor import BaseProcessor
+from .partition import Partition
 
 
 class Assigner(BaseProcessor):
     """
     Assigner 模块，规定唯一上游为 Beater，负责处理 TickData，产出可以运行的任务
+    partition: 分片模式下由 scheduler.py 传入 {'shard', 'num_shards', 'group_sets'}，只处理这个分片的分组
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, partition: Optional[dict] = None, **kwargs):
+        self.partition = Partition(**partition) if partition else None
         super(Assigner, self).__init__(**kwargs)
 
     def user_tick_process(self):
         # 等待 beater 下一次 tick_data
-        self.set_tick_data(self.waiting_for_upstream_data())
+        tick_data = self.waiting_for_upstream_data()
+        if self.partition is not None:
+            tick_data = self.partition.filter(tick_data)
+        self.set_tick_data(tick_data)
         # 开始调度
         self.process_schedule()
 
@@ -12,6 +12,7 @@ from logm import logger
 from k8s import K8sPreStopHook
 from .base_types import TickData
 from .connection import ProcessConnection
+from .memory_profiler import MemoryProfiler
 
 
 class TickDataDescriptor(object):
@@ -56,6 +57,7 @@ class BaseProcessor(object):
         self.__last_perf_counter = -1
         self.__last_perf_counter_list = defaultdict(list)
         self.__last_write_result = -1
+        self.__memory_profiler = MemoryProfiler(name)
 
     def _log(self, log_func, *args, **kwargs):
         with logger.contextualize(uuid=f'{self.name}#{self.seq}'):
@@ -129,8 +131,21 @@ class BaseProcessor(object):
         if not self.__load_global_config():
             self.valid = False
         self.user_tick_process()
+        self.__check_memory()
         self.__write_result()
 
+    def __check_memory(self):
+        """
+        打开了内存诊断的话，RSS 超过阈值时写一份报告
+        """
+        if not self.__memory_profiler.enabled:
+            return
+        self.perf_counter()
+        if (report_path := self.__memory_profiler.check(self.tick_data)) is not None:
+            self.warning(f'RSS 超过了阈值或者 trace 到时间了，内存诊断报告写到了 {report_path}')
+            self.update_metric('memory_profile', self.perf_counter())
+        self.update_metric('memory_profile_reports', self.__memory_profiler.reports)
+
     def user_tick_process(self):
         raise NotImplementedError
 
@@ -148,6 +163,9 @@ class BaseProcessor(object):
         self.tick_data.extra_data['registered_global_config'] = self.__registered_global_config
         if self.__last_write_result > 0:
             self.update_metric('write_result', self.__last_write_result)
+        # 上一次写入之后共享内存的大小、碎片和扩缩容次数
+        for k, v in self.__conn.stats().items():
+            self.update_metric(k, v)
         self.perf_counter()
         self.__conn.put(self.tick_data, seq=self.seq)
         self.__last_write_result = self.perf_counter()
@@ -9,7 +9,9 @@ import pandas as pd
 
 from . import get_dfs
 from .base_processor import BaseProcessor
+from .feedback_ops import KEY_COLUMNS, merge_feedback_ops, apply_feedback_ops
 from db import MarsDB
+from logm import logger
 from server_model.user_data import initialize_user_data_roaming
 from base_model.base_task import BaseTask
 from server_model.task_runtime_config import TaskRuntimeConfig
@@ -66,25 +68,22 @@ class Beater(BaseProcessor):
         """
         self.perf_counter()
         priority_tick = int(time.time())
-        priority_changed_tasks = \
-            set((tid, pri) for tid, pri in zip(self.task_df.id, self.task_df.priority)) - \
-            set((tid, pri) for tid, pri in zip(self.__last_tick_data.task_df.id, self.__last_tick_data.task_df.priority))
-        sql = ''
-        params = ()
-        for task_id, priority in list(sorted(priority_changed_tasks)):
-            task = self.task_df.loc[task_id]
-            running_priority = task.runtime_config_json.get('running_priority', [])
+        # task_df 的 index 就是 id，和上个 tick 对齐之后比较，新来的任务上个 tick 是 NaN，也算变了
+        last_priority = self.__last_tick_data.task_df.priority
+        last_priority = last_priority[~last_priority.index.duplicated()].reindex(self.task_df.index)
+        changed_df = self.task_df[self.task_df.priority.ne(last_priority).to_numpy()]
+        running_priorities = {}
+        for task_id, priority, runtime_config_json in sorted(zip(changed_df.id, changed_df.priority, changed_df.runtime_config_json)):
+            running_priority = runtime_config_json.get('running_priority', [])
             if len(running_priority) == 0 or running_priority[-1]['priority'] != priority:
                 running_priority.append({
                     'priority': priority,
                     'timestamp': priority_tick
                 })
-                self.runtime_config.task.id = task_id
-                s, p = self.runtime_config.get_insert_sql('running_priority', running_priority)
-                sql += s
-                params += p
-        if sql:
-            MarsDB().execute(sql, params)
+                running_priorities[task_id] = running_priority
+        if len(running_priorities):
+            MarsDB().execute(*self.runtime_config.get_multi_insert_sql('running_priority', running_priorities))
+        self.update_metric('record_priority_rows', len(running_priorities))
         self.update_metric('record_priority', self.perf_counter())
 
     @property
@@ -105,12 +104,33 @@ class Beater(BaseProcessor):
             self.warmup = False
         else:
             # 非预热阶段
+            # 这里需要定义操作，而不是传过来改动后的 df，因为有可能已经过时了
+            ops_by_upstream = {}
+            exec_list = []
             for upstream in self.upstreams:
                 modifier = self.get_upstream_data(upstream)
                 # 只要有一个 feedbacker 还没有就绪，就认为还在 warmup
                 if not modifier.valid:
                     self.valid = False
-                # 这样写感觉不是很直观，但暂时没想到更好的办法，这里需要定义操作，而不是传过来改动后的 df，因为有可能已经过时了
-                for exec_str in modifier.extra_data.get('exec_list', []):
-                    exec(exec_str)
+                ops_by_upstream[upstream] = modifier.extra_data.get('feedback_ops', [])
+                self.update_metric(f'feedback_ops_{upstream}', len(ops_by_upstream[upstream]))
+                if (process_ms := modifier.extra_data.get('process_modifier_ms')) is not None:
+                    self.update_metric(f'feedback_process_{upstream}', process_ms)
+                exec_list += modifier.extra_data.get('exec_list', [])
+            try:
+                merged, conflicts = merge_feedback_ops(ops_by_upstream)
+                if len(conflicts):
+                    # 只打前几条，避免刷屏
+                    self.warning(f'feedback 有 {len(conflicts)} 处冲突: ' + '; '.join(
+                        f'{c["df"]}.{c["column"]}[{c["key"]}] {c["changes"]}' for c in conflicts[:10]))
+                self.update_metric('feedback_conflicts', len(conflicts))
+                for df_name, df in apply_feedback_ops({name: getattr(self, name) for name in KEY_COLUMNS}, merged).items():
+                    setattr(self, df_name, df)
+            except Exception as e:
+                logger.exception(e)
+                self.error(f'应用 feedback 出错，这次的数据无效: {e}')
+                self.valid = False
+            # 兼容以前的 exec_list，新的 FeedBacker 请用 feedback_ops
+            for exec_str in exec_list:
+                exec(exec_str)
         self.update_metric('feedback', self.perf_counter())
@@ -4,8 +4,8 @@ import os
 import mmap
 import pickle
 import posix_ipc
-from typing import Callable
-from collections import namedtuple
+from typing import Callable, List, Tuple
+from collections import namedtuple, deque
 
 from conf import CONF
 from scheduler.base_model.base_types import TickData
@@ -14,6 +14,172 @@ from scheduler.base_model.base_types import TickData
 # 默认 5 个 rotate 位置
 DEFAULT_ROTATE_NUM = CONF.scheduler.get('rotate_num', 5)
 Header = namedtuple('Header', ['seq', 'frames'])
+# 大帧按大页对齐，内核支持的话 madvise 成透明大页，减少 page fault
+SHM_HUGEPAGE = CONF.scheduler.get('shm_hugepage', True)
+HUGEPAGE_SIZE = 2 << 20
+# 每隔多少次 put 检查一次能不能缩小共享内存；一个 slot 这么多次没用过才会被回收，防止还有进程在读
+SHM_SHRINK_INTERVAL = CONF.scheduler.get('shm_shrink_interval', 60)
+# 按最近多少帧的大小来预分配
+SHM_HISTORY = 32
+# 每翻一倍分成几档
+SIZE_CLASSES_PER_DOUBLING = 4
+# 扩容的时候多留一些，帧在慢慢变大的时候不用每次都扩
+GROWTH_HEADROOM = 1.25
+
+
+def size_class(n: int, hugepage=SHM_HUGEPAGE) -> int:
+    """
+    向上取整到 size class: 每翻一倍分 SIZE_CLASSES_PER_DOUBLING 档，浪费不超过 1 / SIZE_CLASSES_PER_DOUBLING
+    """
+    n = max(n, mmap.PAGESIZE)
+    step = max((1 << (n - 1).bit_length()) // (2 * SIZE_CLASSES_PER_DOUBLING), mmap.PAGESIZE)
+    if hugepage and n >= HUGEPAGE_SIZE:
+        step = max(step, HUGEPAGE_SIZE)
+    return -(-n // step) * step
+
+
+class SlabAllocator(object):
+    """
+    写进程自己记录共享内存数据区的划分，读进程只看 header 里的 frames，不需要知道
+        - 数据区从 start 开始，连续地分成若干 slot，每个 slot 是 [position, capacity, 最后一次使用的 put 序号]
+        - header.frames 里还在的帧占着 slot，其他 slot 可以复用，按位置优先用前面的，让后面的能空出来缩掉
+        - 放不下时合并相邻的空闲 slot，还不行才扩容，扩容时按最近帧的大小一次预分配够 rotate_num + 1 个 slot
+        - 每隔 shrink_interval 次 put，把末尾长时间没用过的 slot 缩掉
+    """
+
+    def __init__(self, start: int, rotate_num: int, shrink_interval=SHM_SHRINK_INTERVAL, hugepage=SHM_HUGEPAGE):
+        self.start = start
+        self.rotate_num = rotate_num
+        self.shrink_interval = shrink_interval
+        self.hugepage = hugepage
+        self.slots: List[list] = []
+        self.history = deque(maxlen=SHM_HISTORY)
+        self.puts = 0
+        self.resizes = 0
+        self.shrinks = 0
+
+    @property
+    def end(self) -> int:
+        return self.slots[-1][0] + self.slots[-1][1] if self.slots else self.start
+
+    def rebuild(self, frames: List[Tuple[int, int]], size: int):
+        """
+        重启之后从 header 恢复 slot 的划分: 每个帧占一个 slot，空隙作为空闲 slot
+        """
+        self.slots = []
+        last_position = self.start
+        for p, l in sorted(set(frames)):
+            if p < last_position:
+                continue
+            if p > last_position:
+                self.slots.append([last_position, p - last_position, 0])
+            self.slots.append([p, l, 0])
+            last_position = p + l
+        if size > last_position:
+            self.slots.append([last_position, size - last_position, 0])
+
+    def _busy(self, frames) -> set:
+        return {p for p, _ in frames[-self.rotate_num:]}
+
+    def allocate(self, length: int, frames: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """
+        :return: 写入的位置，需要的数据区大小 (比现在大就要扩容)
+        """
+        self.puts += 1
+        self.history.append(length)
+        busy = self._busy(frames)
+        slot = self._first_fit(length, busy) or self._coalesce(length, busy) or self._grow(length, busy)
+        self._split(slot, length)
+        slot[2] = self.puts
+        return slot[0], self.end
+
+    def _typical(self, length) -> int:
+        """
+        最近帧的 p75，偶尔一个特别大的帧不会让所有 slot 都按它来分配
+        """
+        return size_class(max(length, sorted(self.history)[len(self.history) * 3 // 4]), self.hugepage)
+
+    def _split(self, slot, length):
+        """
+        剩下的部分还能再放一帧的话，拆成两个 slot
+        """
+        capacity = self._typical(length)
+        if slot[1] - capacity >= capacity:
+            i = self.slots.index(slot)
+            self.slots.insert(i + 1, [slot[0] + capacity, slot[1] - capacity, 0])
+            slot[1] = capacity
+
+    def _first_fit(self, length, busy):
+        for slot in self.slots:
+            if slot[0] not in busy and slot[1] >= length:
+                return slot
+        return None
+
+    def _coalesce(self, length, busy):
+        i = 0
+        while i < len(self.slots):
+            j, total = i, 0
+            while j < len(self.slots) and self.slots[j][0] not in busy:
+                total += self.slots[j][1]
+                j += 1
+                if total >= length:
+                    self.slots[i:j] = [[self.slots[i][0], total, 0]]
+                    return self.slots[i]
+            i = j + 1
+        return None
+
+    def _grow(self, length, busy):
+        capacity = size_class(int(length * GROWTH_HEADROOM), self.hugepage)
+        # 末尾是空的就直接把它扩大
+        if self.slots and self.slots[-1][0] not in busy:
+            self.slots[-1][1] = max(self.slots[-1][1], capacity)
+            slot = self.slots[-1]
+        else:
+            slot = [self.end, capacity, 0]
+            self.slots.append(slot)
+        # 最近的帧普遍变大了的话，一次预分配够，后面几帧就不用再扩容了
+        typical = size_class(int(self._typical(0) * GROWTH_HEADROOM), self.hugepage)
+        fitting = sum(s[1] >= typical for s in self.slots)
+        for _ in range(self.rotate_num + 1 - fitting):
+            self.slots.append([self.end, typical, 0])
+        self.resizes += 1
+        return slot
+
+    def shrink(self, frames: List[Tuple[int, int]]) -> int:
+        """
+        :return: 缩完之后需要的数据区大小，不需要缩的时候返回 -1
+        """
+        if self.puts % self.shrink_interval != 0 or len(self.history) == 0:
+            return -1
+        old_end = self.end
+        target = self._typical(0)
+        busy = self._busy(frames)
+        while len(self.slots) > 1:
+            position, capacity, last_used = self.slots[-1]
+            if position in busy or self.puts - last_used < self.shrink_interval:
+                break
+            if sum(s[1] >= target for s in self.slots[:-1]) >= self.rotate_num + 1:
+                self.slots.pop()
+                continue
+            if capacity > 2 * target:
+                self.slots[-1][1] = target
+            break
+        if self.end >= old_end:
+            return -1
+        self.shrinks += 1
+        return self.end
+
+    def stats(self, frames: List[Tuple[int, int]]) -> dict:
+        data_size = self.end - self.start
+        live = sum(l for _, l in frames[-self.rotate_num:])
+        return {
+            'shm_size': self.end,
+            'shm_slots': len(self.slots),
+            # 数据区里没有被当前帧用到的比例
+            'shm_fragmentation': round(1 - live / data_size, 4) if data_size > 0 else 0,
+            'shm_resizes': self.resizes,
+            'shm_shrinks': self.shrinks,
+        }
 
 
 class ProcessConnection(object):
@@ -37,10 +203,40 @@ class ProcessConnection(object):
             os.ftruncate(self.shm.fd, (self.header_size + self.rotate_num * len(self.dumps(init_obj))) * 2)
         self.mm = mmap.mmap(self.shm.fileno(), 0)
         self._size = self.mm.size()
+        self._advise()
+        self.allocator = SlabAllocator(start=self.header_size, rotate_num=rotate_num)
         if _init:
             self.set_header(Header(seq=0, frames=[]))
+            self.allocator.rebuild([], self._size)
             for i in range(self.rotate_num):
                 self.put(init_obj)
+        else:
+            self.allocator.rebuild(self.header.frames, self._size)
+
+    def _advise(self):
+        if SHM_HUGEPAGE and hasattr(mmap, 'MADV_HUGEPAGE'):
+            try:
+                self.mm.madvise(mmap.MADV_HUGEPAGE)
+            except OSError:
+                pass
+
+    def _resize(self, size):
+        old_size = self.mm.size()
+        self.mm.resize(size)
+        self._size = size
+        if size > old_size:
+            # 先把新的页分配好，不要等到写的时候再 page fault
+            try:
+                os.posix_fallocate(self.shm.fd, old_size, size - old_size)
+            except (AttributeError, OSError):
+                pass
+        self._advise()
+
+    def stats(self) -> dict:
+        """
+        写进程调用，共享内存的大小、碎片和扩缩容次数
+        """
+        return self.allocator.stats(self.header.frames)
 
     def set_header(self, header: Header):
         # 我们是只有一个进程一秒钟一个脉冲 put obj，所以这样没有问题
@@ -69,8 +265,9 @@ class ProcessConnection(object):
     def get(self):
         header = self.header
         last_start_position, last_data_length = header.frames[-1]
-        if last_start_position + last_data_length >= self._size:
+        if last_start_position + last_data_length > self._size:
             self.mm.resize(self.mm.size())
+            self._size = self.mm.size()
         self.mm.seek(last_start_position)
         return self.loads(self.mm.read(last_data_length))
 
@@ -78,18 +275,12 @@ class ProcessConnection(object):
         header = self.header
         pickle_bytes = self.dumps(obj)
         pickle_bytes_length = len(pickle_bytes)
-        max_position = self.mm.size()
-        frames = sorted(header.frames[-self.rotate_num:]) + [(max_position, 0)]
-        position = -1
-        last_position = self.header_size
-        for p, l in frames:
-            if p - last_position >= pickle_bytes_length:
-                position = last_position
-                break
-            last_position = p + l
-        if position < 0:
-            position = max_position
-            self.mm.resize(max_position + pickle_bytes_length)
+        position, size = self.allocator.allocate(pickle_bytes_length, header.frames)
+        if size > self._size:
+            self._resize(size)
         self.mm.seek(position)
         self.mm.write(pickle_bytes)
-        self.set_header(Header(seq=seq, frames=(header.frames + [(position, pickle_bytes_length)])[-self.rotate_num:]))
+        frames = (header.frames + [(position, pickle_bytes_length)])[-self.rotate_num:]
+        self.set_header(Header(seq=seq, frames=frames))
+        if (size := self.allocator.shrink(frames)) > 0:
+            self._resize(size)
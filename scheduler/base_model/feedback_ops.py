@@ -0,0 +1,92 @@
+"""
+FeedBacker 给 Beater 的修改意见，用结构化的操作代替 exec 字符串
+    - set: 把某列在指定 key 上的值改成给定的值，{key: value}
+    - add: 给某列在指定 key 上的值加上增量，{key: delta}，比如调整优先级
+    - key 是各个 df 的主键: task_df 为 id，user_df 为 user_name，resource_df 为 name
+Beater 收齐所有 FeedBacker 的操作之后按 (df, 列) 合并，每列只改一次 df
+    - 同一个 key 被多个 FeedBacker set 成不同的值时，以后面的 FeedBacker 为准，并记录冲突
+    - 同一个 key 上的 add 会累加；set 会丢掉在它之前的 add，只有它之后（同一个或后面的 FeedBacker）的 add 会加在 set 的值上，
+      结果和按顺序依次执行一样，set 和 add 同时出现时记录冲突
+"""
+
+
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+
+class FEEDBACK_OP:
+    SET = 'set'
+    ADD = 'add'
+
+
+KEY_COLUMNS = {'task_df': 'id', 'user_df': 'user_name', 'resource_df': 'name'}
+
+
+def set_op(column: str, values: Dict[Any, Any], df='task_df') -> dict:
+    return {'op': FEEDBACK_OP.SET, 'df': df, 'column': column, 'values': values}
+
+
+def add_op(column: str, deltas: Dict[Any, Any], df='task_df') -> dict:
+    return {'op': FEEDBACK_OP.ADD, 'df': df, 'column': column, 'values': deltas}
+
+
+def merge_feedback_ops(ops_by_source: Dict[str, List[dict]]) -> Tuple[dict, List[dict]]:
+    """
+    ops_by_source: {FeedBacker 名字: [操作]}，按 FeedBacker 的顺序合并
+    :return: {(df, column): {'set': {key: value}, 'add': {key: delta}}}, 冲突列表
+    """
+    merged = {}
+    # (df, column, key) -> [(source, op, value)]
+    touched = {}
+    for source, ops in ops_by_source.items():
+        for op in ops:
+            if op['op'] not in (FEEDBACK_OP.SET, FEEDBACK_OP.ADD) or op['df'] not in KEY_COLUMNS:
+                raise ValueError(f'{source} 提交了不支持的操作: {op["op"]} {op["df"]}')
+            column_ops = merged.setdefault((op['df'], op['column']), {FEEDBACK_OP.SET: {}, FEEDBACK_OP.ADD: {}})
+            for key, value in op['values'].items():
+                if op['op'] == FEEDBACK_OP.SET:
+                    column_ops[FEEDBACK_OP.SET][key] = value
+                    # apply 的时候先 set 再 add，之前的 add 会被这次 set 覆盖，不能留到 set 之后再加
+                    column_ops[FEEDBACK_OP.ADD].pop(key, None)
+                else:
+                    column_ops[FEEDBACK_OP.ADD][key] = column_ops[FEEDBACK_OP.ADD].get(key, 0) + value
+                touched.setdefault((op['df'], op['column'], key), []).append((source, op['op'], value))
+    conflicts = []
+    for (df_name, column, key), changes in touched.items():
+        if len({source for source, _, _ in changes}) < 2:
+            continue
+        set_values = [value for _, op, value in changes if op == FEEDBACK_OP.SET]
+        has_add = any(op == FEEDBACK_OP.ADD for _, op, _ in changes)
+        try:
+            different_sets = len(set_values) > 1 and any(v != set_values[0] for v in set_values[1:])
+        except Exception:
+            different_sets = True
+        if different_sets or (len(set_values) and has_add):
+            conflicts.append({'df': df_name, 'column': column, 'key': key, 'changes': changes})
+    return merged, conflicts
+
+
+def apply_feedback_ops(dfs: Dict[str, pd.DataFrame], merged: dict) -> Dict[str, pd.DataFrame]:
+    """
+    把合并后的操作写到 df 里，原地修改，每个 (df, 列) 只做一次向量化的赋值
+    :return: 修改过的 df
+    """
+    changed = {}
+    for (df_name, column), column_ops in merged.items():
+        df = dfs[df_name]
+        if column not in df.columns:
+            raise ValueError(f'{df_name} 没有 {column} 列')
+        keys = df[KEY_COLUMNS[df_name]]
+        if len(values := column_ops[FEEDBACK_OP.SET]):
+            mask = keys.isin(values.keys())
+            if mask.any():
+                # 值可能是 list，不能直接用 map(dict)
+                df.loc[mask, column] = pd.Series([values[k] for k in keys[mask]], index=df.index[mask])
+                changed[df_name] = df
+        if len(deltas := column_ops[FEEDBACK_OP.ADD]):
+            mask = keys.isin(deltas.keys())
+            if mask.any():
+                df.loc[mask, column] = df.loc[mask, column] + keys[mask].map(deltas)
+                changed[df_name] = df
+    return changed
@@ -2,9 +2,11 @@
 
 import datetime
 import time
+from typing import Any, Dict
 
 from .base_types import TickData
 from .base_processor import BaseProcessor
+from .feedback_ops import set_op, add_op
 
 
 class FeedBacker(BaseProcessor):
@@ -16,8 +18,10 @@ class FeedBacker(BaseProcessor):
         super(FeedBacker, self).__init__(**kwargs)
 
     def user_tick_process(self):
-        self.extra_data = {}
+        self.extra_data = {'feedback_ops': []}
+        self.perf_counter()
         self.process_modifier()
+        self.extra_data['process_modifier_ms'] = self.perf_counter()
         self.set_tick_data(TickData(
             seq=int(datetime.datetime.now().timestamp() * 1000),
             valid=self.valid,
@@ -25,5 +29,20 @@ class FeedBacker(BaseProcessor):
         ))
         time.sleep(self.interval / 1000)
 
+    def set_column(self, column: str, values: Dict[Any, Any], df='task_df'):
+        """
+        修改意见: 把 df 的 column 列在 key 上的值改成 value，values 为 {key: value}
+        """
+        self.extra_data['feedback_ops'].append(set_op(column, values, df))
+
+    def adjust_column(self, column: str, deltas: Dict[Any, Any], df='task_df'):
+        """
+        修改意见: 给 df 的 column 列在 key 上的值加上 delta，deltas 为 {key: delta}，比如调整优先级
+        """
+        self.extra_data['feedback_ops'].append(add_op(column, deltas, df))
+
     def process_modifier(self):
+        """
+        用 set_column / adjust_column 提交修改意见，key 见 feedback_ops.KEY_COLUMNS
+        """
         raise NotImplementedError
@@ -1,3 +1,7 @@
+import time
+from typing import Optional
+
+import numpy as np
 import pandas as pd
 import ujson
 from sqlalchemy.engine import Connection
@@ -8,7 +12,7 @@ from db import redis_conn, MarsDB
 from .base_processor import BaseProcessor
 from .base_types import ASSIGN_RESULT, MATCH_RESULT
 from roman_parliament import register_parliament, add_archive_for_senators
-from roman_parliament.archive_triggers.launcher_task_trigger import LAUNCHER_COUNT
+from roman_parliament.archive_triggers.launcher_task_trigger import LAUNCHER_COUNT, SIGNAL_DECIDED_KEY, SIGNAL_LATENCY_KEY, SIGNAL_DECIDED_EXPIRE
 from logm import logger
 
 
@@ -17,6 +21,7 @@ def modify_task_df_safely(task_df, task_id, **kwargs):
     修改 task_df 的方法，用来撮合完成时分配资源，用来解决目标字段是 list 时无法正确 .loc 的问题
     task_id 就是 index
     kwargs 为 {'字段名': '预期字段值'}
+    每次调用都会复制整列，要改很多任务的话用 TaskDfMutations / Matcher.update_task
     """
     for k, v in kwargs.items():
         tmp_series = task_df[k].copy()
@@ -25,6 +30,51 @@ def modify_task_df_safely(task_df, task_id, **kwargs):
     return task_df
 
 
+class TaskDfMutations(object):
+    """
+    撮合过程中对 task_df 的修改先记下来，最后每列只复制一次写回去
+    和 modify_task_df_safely 一样能写 list 这种值，task_id 就是 index
+    """
+
+    def __init__(self):
+        # task_id -> {字段名: 字段值}，后面的修改覆盖前面的
+        self.updates = {}
+
+    def __len__(self):
+        return len(self.updates)
+
+    def set(self, task_id, **kwargs):
+        self.updates.setdefault(task_id, {}).update(kwargs)
+
+    def commit(self, task_df: pd.DataFrame) -> pd.DataFrame:
+        if len(self.updates) == 0:
+            return task_df
+        columns = {k for update in self.updates.values() for k in update}
+        if len(missing_columns := columns - set(task_df.columns)):
+            raise KeyError(f'task_df 没有这些字段: {missing_columns}')
+        positions = task_df.index.get_indexer(list(self.updates.keys()))
+        if (positions < 0).any():
+            raise KeyError(f'task_df 里没有这些任务: {[k for k, p in zip(self.updates.keys(), positions) if p < 0]}')
+        for column in columns:
+            column_positions, values = [], []
+            for position, update in zip(positions, self.updates.values()):
+                if column in update:
+                    column_positions.append(position)
+                    values.append(update[column])
+            if task_df[column].dtype != object and all(pd.api.types.is_scalar(v) for v in values):
+                tmp_series = task_df[column].copy()
+                tmp_series.iloc[column_positions] = values
+            else:
+                # 值是 list 等的时候不能直接 .loc / .iloc，先转成 object 的 ndarray 一个个放进去
+                tmp_values = task_df[column].to_numpy(dtype=object, copy=True)
+                for position, value in zip(column_positions, values):
+                    tmp_values[position] = value
+                tmp_series = pd.Series(tmp_values, index=task_df.index, dtype=object)
+            task_df[column] = tmp_series
+        self.updates = {}
+        return task_df
+
+
 class InsertTaskTimeout(Exception):
     """上次插入任务超时了"""
     pass
@@ -36,17 +86,28 @@ class Matcher(BaseProcessor):
     """
     re_signal_where = ''
 
-    def __init__(self, **kwargs):
+    def __init__(self, partition: Optional[dict] = None, **kwargs):
+        # 分片模式下的 Matcher 只撮合，由 PartitionMerger 合并之后统一写库、发信号
+        self.partition = partition
         self.tasks_to_start_df = pd.DataFrame(columns=['id', 'task_type'])
         self.tasks_to_stop_df = pd.DataFrame(columns=['id', 'task_type'])
         self.tasks_to_suspend_df = pd.DataFrame(columns=['id', 'task_type'])
+        # 这个 tick 要发的 redis 信号，(方法名, args, kwargs)，在 send_signal 里用一个 pipeline 发出去
+        self.pending_signals = []
+        self.decided_at = time.time()
+        # process_match 里通过 update_task 记下的修改，结束时统一写回 task_df
+        self.task_df_mutations = TaskDfMutations()
         super(Matcher, self).__init__(**kwargs)
 
     def user_tick_process(self):
         # match
+        self.task_df_mutations = TaskDfMutations()
         self.process_match()
+        self.commit_task_updates()
+        self.pending_signals = []
+        self.decided_at = time.time()
         # apply_db & send_signal
-        if self.valid:
+        if self.valid and self.partition is None:
             try:
                 with MarsDB() as conn:
                     self.apply_db(conn)
@@ -64,6 +125,21 @@ class Matcher(BaseProcessor):
     def process_match(self):
         raise NotImplementedError
 
+    def update_task(self, task_id, **kwargs):
+        """
+        记录对某个任务的修改，比如 assigned_nodes、assigned_gpus、cpu、memory、match_result，process_match 结束后统一写回
+        task_id 就是 task_df 的 index
+        """
+        self.task_df_mutations.set(task_id, **kwargs)
+
+    def commit_task_updates(self):
+        if len(self.task_df_mutations) == 0:
+            return
+        self.perf_counter()
+        self.update_metric('task_df_mutations', len(self.task_df_mutations))
+        self.task_df = self.task_df_mutations.commit(self.task_df)
+        self.update_metric('commit_task_updates', self.perf_counter())
+
     def apply_db(self, conn: Connection):
         """
         这里做要操作数据库的操作
@@ -112,29 +188,63 @@ class Matcher(BaseProcessor):
             conn.execute(f'''
             update "unfinished_task_ng" set "queue_status" = %s where "id" = %s and "queue_status" = %s
             ''', (QUE_STATUS.FINISHED, task.id, QUE_STATUS.QUEUED))
-            redis_conn.set(f'ban:{task.user_name}:{task.nb_name}:{task.chain_id}', 1)  # 防止重启
-            redis_conn.lpush(f'{CONF.manager.stop_channel}:suspend:{task.id}', ujson.dumps({'stop_code': STOP_CODE.STOP}))
+            self.queue_signal('set', f'ban:{task.user_name}:{task.nb_name}:{task.chain_id}', 1)  # 防止重启
+            self.queue_signal('lpush', f'{CONF.manager.stop_channel}:suspend:{task.id}', ujson.dumps({'stop_code': STOP_CODE.STOP}))
 
     def suspend_db_task(self, conn: Connection):
         pass
 
+    def queue_signal(self, method, *args, **kwargs):
+        """
+        攒一个 redis 操作，send_signal 的时候和其他信号一起发
+        """
+        self.pending_signals.append((method, args, kwargs))
+
+    def flush_signals(self):
+        """
+        用一个 pipeline 把这个 tick 攒下来的信号一起发出去，顺便取走 launcher 写回的延迟
+        """
+        latency_key = f'{SIGNAL_LATENCY_KEY}:{self.name}'
+        # 用事务保证取延迟和清空之间 launcher 写进来的不会丢
+        pipe = redis_conn.pipeline()
+        for method, args, kwargs in self.pending_signals:
+            getattr(pipe, method)(*args, **kwargs)
+        pipe.lrange(latency_key, 0, -1)
+        pipe.delete(latency_key)
+        results = pipe.execute(raise_on_error=False)
+        signal_results = results[:len(self.pending_signals)]
+        if len(errors := [r for r in signal_results if isinstance(r, Exception)]):
+            self.error(f'有 {len(errors)} 个信号没有发出去: {errors[:3]}')
+        self.update_metric('signal_redis_ops', len(self.pending_signals))
+        self.update_metric('signal_errors', len(errors))
+        self.pending_signals = []
+        if not isinstance(latencies := results[-2], Exception) and len(latencies):
+            latencies = np.array(latencies, dtype=float)
+            self.update_metric('signal_pickup_count', len(latencies))
+            self.update_metric('signal_pickup_latency_ms_avg', float(latencies.mean()))
+            self.update_metric('signal_pickup_latency_ms_max', float(latencies.max()))
+
     def send_signal(self):
         """
-        发送起停信号
+        发送起停信号，所有 redis 操作走一个 pipeline，起任务的消息只广播一次
         """
-        try:
-            for tid in self.tasks_to_suspend_df.id.to_list():
-                redis_conn.lpush(
-                    f'{CONF.manager.stop_channel}:suspend:{tid}',
-                    ujson.dumps({'stop_code': STOP_CODE.INTERRUPT})
-                )
-        except Exception as e:
-            logger.exception(e)
+        self.perf_counter()
+        for tid in self.tasks_to_suspend_df.id.to_list():
+            self.queue_signal(
+                'lpush',
+                f'{CONF.manager.stop_channel}:suspend:{tid}',
+                ujson.dumps({'stop_code': STOP_CODE.INTERRUPT})
+            )
+        start_task_id_list = {}
         try:
             start_task_id_list = {
                 task_id: task_id % LAUNCHER_COUNT
                 for task_id in self.tasks_to_start_df.id.to_list()
             }
+            # launcher 收到之后用来算延迟，重发的信号不算
+            decision = ujson.dumps({'matcher': self.name, 'decided_at': self.decided_at})
+            for task_id in start_task_id_list:
+                self.queue_signal('set', f'{SIGNAL_DECIDED_KEY}:{task_id}', decision, ex=SIGNAL_DECIDED_EXPIRE)
             if self.seq % (CONF.scheduler.re_signal * 1000) == 0 and len(self.re_signal_where) > 0:
                 not_started_tasks = {
                     k: v
@@ -155,8 +265,19 @@ class Matcher(BaseProcessor):
                     if delay_seconds > CONF.scheduler.send_fetion:
                         msg = f'任务 {task_id} 过了 {delay_seconds} 秒都没有起来，请检查'
                         self.f_error(msg)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'match send_signal exception error, {e}')
+        # 先把 decided_at 写进去，再广播起任务的消息
+        try:
+            self.flush_signals()
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'match flush_signals exception error, {e}')
+        try:
             if len(start_task_id_list) > 0:
                 add_archive_for_senators(trigger_name='LauncherTaskTrigger', data=start_task_id_list)
         except Exception as e:
             logger.exception(e)
             logger.error(f'match send_signal exception error, {e}')
+        self.update_metric('send_signal', self.perf_counter())
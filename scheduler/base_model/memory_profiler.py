@@ -0,0 +1,170 @@
+"""
+调度组件的内存诊断，默认关闭，在 CONF.scheduler.memory_profile 里打开
+    - 每隔 check_every 个 tick 读一次 /proc/self/statm 看 RSS，没超过阈值时只有这一点开销
+    - RSS 第一次超过阈值: 开始 tracemalloc，记下基准快照，写一份 TickData 里各个 df 的大小
+    - 之后每超过一个阈值: 和基准快照对比，写出增长最多的分配位置，同时把快照 dump 下来，离线用 tracemalloc.Snapshot.load 分析
+    - 超过最后一个阈值之后停掉 tracemalloc，不影响后面的性能
+    - tracemalloc 打开之后最多持续 max_trace_ticks 个 tick，RSS 停在两个阈值之间不再涨时也会对比一次然后停掉；
+      开始的时候已经没有更多阈值了 (一次涨过了所有阈值，或者只配了一个阈值)，过 compare_after_ticks 个 tick 对比一次然后停掉
+"""
+
+
+import os
+import pickle
+import time
+import tracemalloc
+from typing import List, Optional
+
+import pandas as pd
+import ujson
+
+from conf import CONF
+from .base_types import TickData
+
+
+MEMORY_PROFILE_CONFIG = CONF.scheduler.get('memory_profile', {})
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def current_rss() -> int:
+    """
+    比 psutil 轻，每个 tick 调用也没关系
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def df_memory(df: pd.DataFrame) -> dict:
+    if not isinstance(df, pd.DataFrame):
+        return {}
+    usage = df.memory_usage(deep=True)
+    return {
+        'rows': len(df),
+        'bytes': int(usage.sum()),
+        # 最大的几列，一般是 config_json、assigned_nodes 这种 object 列
+        'top_columns': {k: int(v) for k, v in usage.sort_values(ascending=False).head(5).items()},
+    }
+
+
+def tick_data_memory(tick_data: TickData) -> dict:
+    extra_data = {}
+    for k, v in (tick_data.extra_data or {}).items():
+        try:
+            extra_data[k] = len(pickle.dumps(v))
+        except Exception:
+            extra_data[k] = -1
+    return {
+        'task_df': df_memory(tick_data.task_df),
+        'resource_df': df_memory(tick_data.resource_df),
+        'user_df': df_memory(tick_data.user_df),
+        # extra_data 里的东西不一定是 df，用 pickle 之后的大小估计
+        'extra_data_pickled_bytes': extra_data,
+    }
+
+
+class MemoryProfiler(object):
+    def __init__(
+            self,
+            name: str,
+            enabled: bool = MEMORY_PROFILE_CONFIG.get('enabled', False),
+            rss_thresholds_mb: List[int] = MEMORY_PROFILE_CONFIG.get('rss_thresholds_mb', [4096, 8192, 16384]),
+            output_dir: str = MEMORY_PROFILE_CONFIG.get('output_dir', '/tmp/scheduler_memory_profile'),
+            check_every: int = MEMORY_PROFILE_CONFIG.get('check_every', 10),
+            top: int = MEMORY_PROFILE_CONFIG.get('top', 30),
+            frames: int = MEMORY_PROFILE_CONFIG.get('frames', 10),
+            compare_after_ticks: int = MEMORY_PROFILE_CONFIG.get('compare_after_ticks', 100),
+            max_trace_ticks: int = MEMORY_PROFILE_CONFIG.get('max_trace_ticks', 3000),
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.thresholds = sorted(int(mb) << 20 for mb in rss_thresholds_mb)
+        self.output_dir = os.path.join(output_dir, name)
+        self.check_every = max(check_every, 1)
+        self.top = top
+        self.frames = frames
+        self.compare_after_ticks = max(compare_after_ticks, 1)
+        self.max_trace_ticks = max(max_trace_ticks, 1)
+        self.ticks = 0
+        # 在 trace 的时候，到这个 tick 还没有写对比报告的话就写一份然后停掉
+        self.trace_until = 0
+        self.next_threshold = 0
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.reports = 0
+
+    def check(self, tick_data: TickData) -> Optional[str]:
+        """
+        :return: 这次写了报告的话返回报告路径
+        """
+        if not self.enabled:
+            return None
+        tracing = self.baseline is not None
+        if not tracing and self.next_threshold >= len(self.thresholds):
+            return None
+        self.ticks += 1
+        if tracing and self.ticks >= self.trace_until:
+            return self.write_report(tick_data, current_rss(), None)
+        if self.ticks % self.check_every != 0 or self.next_threshold >= len(self.thresholds):
+            return None
+        rss = current_rss()
+        if rss < self.thresholds[self.next_threshold]:
+            return None
+        threshold = self.thresholds[self.next_threshold]
+        # 一次涨过了好几个阈值，只写一份
+        while self.next_threshold < len(self.thresholds) and rss >= self.thresholds[self.next_threshold]:
+            self.next_threshold += 1
+        return self.write_report(tick_data, rss, threshold)
+
+    def write_report(self, tick_data: TickData, rss: int, threshold: Optional[int]) -> str:
+        """
+        threshold: 超过的阈值，None 表示 trace 到时间了，对比完就停掉
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f'{int(time.time())}_{os.getpid()}_{rss >> 20}mb')
+        report = {
+            'module': self.name,
+            'pid': os.getpid(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'seq': tick_data.seq,
+            'rss': rss,
+            'threshold': threshold,
+            'tick_data': tick_data_memory(tick_data),
+        }
+        if self.baseline is None:
+            # 之前没有在 trace，这次只能开始记录，下一个阈值才有分配位置
+            tracemalloc.start(self.frames)
+            self.baseline = tracemalloc.take_snapshot()
+            report['tracemalloc'] = 'started'
+            no_more_threshold = self.next_threshold >= len(self.thresholds)
+            self.trace_until = self.ticks + (self.compare_after_ticks if no_more_threshold else self.max_trace_ticks)
+        else:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            traced, peak = tracemalloc.get_traced_memory()
+            report['tracemalloc'] = {'traced': traced, 'peak': peak}
+            report['top_growth'] = [
+                {
+                    'site': str(stat.traceback[0]),
+                    'traceback': stat.traceback.format()[-self.frames * 2:],
+                    'size': stat.size,
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                }
+                for stat in snapshot.compare_to(self.baseline, 'traceback')[:self.top]
+            ]
+            report['top_sites'] = [
+                {'site': str(stat.traceback[0]), 'size': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:self.top]
+            ]
+            snapshot.dump(f'{prefix}.tracemalloc')
+            report['snapshot'] = f'{prefix}.tracemalloc'
+            if threshold is None or self.next_threshold >= len(self.thresholds):
+                tracemalloc.stop()
+                self.baseline = None
+        with open(f'{prefix}.json', 'w') as f:
+            f.write(ujson.dumps(report, indent=2, ensure_ascii=False))
+        self.reports += 1
+        return f'{prefix}.json'
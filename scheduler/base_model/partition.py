@@ -0,0 +1,118 @@
+"""
+按资源分组拆分 assign / match，多个进程并行
+    - 每个分片的 Assigner 只拿到自己分组的 task_df / resource_df，user_df 不拆，分片的 Matcher 只撮合不写库
+    - PartitionMerger 等所有分片都出了新结果之后合并，再统一写库、发信号，下游看到的和不拆分时一样
+    - 分组按 crc32 分到分片上；quota 跨分组计算的分组 (比如共享 quota 的一组分组) 需要配在同一个 group_sets 里，保证在同一个分片
+"""
+
+
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .base_types import TickData
+from .matcher import Matcher
+
+
+class Partition(object):
+    def __init__(self, shard: int, num_shards: int, group_sets: Optional[List[List[str]]] = None):
+        assert 0 <= shard < num_shards, f'shard 必须在 [0, {num_shards}) 之间'
+        self.shard = shard
+        self.num_shards = num_shards
+        # 同一个 group set 里的分组都跟着第一个分组走
+        self.group_leader = {group: group_set[0] for group_set in (group_sets or []) for group in group_set}
+        self._shard_of: Dict[str, int] = {}
+
+    def shard_of(self, group) -> int:
+        if (shard := self._shard_of.get(group)) is None:
+            leader = self.group_leader.get(group, group)
+            shard = self._shard_of[group] = zlib.crc32(str(leader).encode()) % self.num_shards
+        return shard
+
+    def mask(self, groups: pd.Series) -> pd.Series:
+        return groups.map(self.shard_of) == self.shard
+
+    def filter(self, tick_data: TickData) -> TickData:
+        """
+        只留下这个分片的任务和节点，user_df 不拆，跨分组的 quota 仍然能看到全部配置
+        """
+        tick_data.task_df = tick_data.task_df[self.mask(tick_data.task_df.group)]
+        tick_data.resource_df = tick_data.resource_df[self.mask(tick_data.resource_df.group)]
+        tick_data.extra_data = {**tick_data.extra_data, 'partition': {'shard': self.shard, 'num_shards': self.num_shards}}
+        return tick_data
+
+
+class PartitionMerger(Matcher):
+    """
+    合并各分片 Matcher 的结果，再写库、发信号；上游是各个分片的 Matcher
+    """
+
+    def __init__(self, re_signal_where='', **kwargs):
+        self.re_signal_where = re_signal_where
+        super(PartitionMerger, self).__init__(**kwargs)
+
+    def process_match(self):
+        # 每个分片都要有新的结果才合并，避免同一个分片的结果写两次库
+        shard_results = [self.waiting_for_upstream_data(upstream) for upstream in self.upstreams]
+        self.perf_counter()
+        self.set_tick_data(TickData(
+            seq=max(t.seq for t in shard_results),
+            valid=all(t.valid for t in shard_results),
+            resource_df=pd.concat([t.resource_df for t in shard_results]).drop_duplicates(subset=['name']),
+            task_df=pd.concat([t.task_df for t in shard_results]).drop_duplicates(subset=['id']),
+            user_df=shard_results[0].user_df,
+            extra_data={k: v for t in shard_results for k, v in t.extra_data.items() if k != 'partition'},
+        ))
+        self.update_metric('partition_merge', self.perf_counter())
+        # 各分片处理到的 tick 不一定一样，分组之间互不影响，差几个 tick 没关系，这里记一下
+        self.update_metric('partition_seq_skew', max(t.seq for t in shard_results) - min(t.seq for t in shard_results))
+
+
+def expand_module(suffix, name, cls, kwargs, partitions: Dict[str, dict]) -> List[Tuple[str, type, dict]]:
+    """
+    配置里的一个组件展开成实际要创建的组件 [(module_name, cls, kwargs)]，scheduler.py 和模拟器共用
+    分片的 assigner / matcher 展开成 num_shards 个 {name}#{shard}_{suffix}；分片的 matcher 最后再加一个用原来名字的 PartitionMerger，下游不用改
+    """
+    if suffix not in ('assigner', 'matcher') or name not in partitions:
+        return [(f'{name}_{suffix}', cls, kwargs)]
+    num_shards = partitions[name]['num_shards']
+    modules = [
+        (f'{name}#{shard}_{suffix}', cls, {**kwargs, 'partition': {
+            'shard': shard, 'num_shards': num_shards, 'group_sets': partitions[name].get('group_sets', [])
+        }})
+        for shard in range(num_shards)
+    ]
+    if suffix == 'matcher':
+        modules.append((f'{name}_{suffix}', PartitionMerger, {'re_signal_where': cls.re_signal_where}))
+    return modules
+
+
+def merger_upstreams(name, partitions: Dict[str, dict]) -> List[Tuple[str, str]]:
+    """
+    分片的 matcher 合并时的上游 [(upstream_name, module_name)]
+    """
+    return [(f'shard{shard}', f'{name}#{shard}_matcher') for shard in range(partitions[name]['num_shards'])]
+
+
+def expand_edge(dot_upstream, dot_downstream, upstream_name, partitions: Dict[str, dict]) -> List[Tuple[str, str, str]]:
+    """
+    relations 里的一条边展开成 [(upstream module_name, downstream module_name, upstream_name)]
+        - 分片的 assigner 展开为所有分片；分片的 matcher 作为上游时是合并之后的 matcher，作为下游时是所有分片
+        - 分片的 assigner -> 分片的 matcher 一一对应，多个分片汇到同一个下游时用 upstream_name#分片 区分
+    """
+    def expand(dot_name, as_upstream):
+        suffix, name = dot_name.split('.')
+        if suffix in ('assigner', 'matcher') and name in partitions and not (suffix == 'matcher' and as_upstream):
+            return [f'{name}#{shard}_{suffix}' for shard in range(partitions[name]['num_shards'])]
+        return [f'{name}_{suffix}']
+
+    upstreams, downstreams = expand(dot_upstream, as_upstream=True), expand(dot_downstream, as_upstream=False)
+    if len(upstreams) > 1 and len(upstreams) == len(downstreams):
+        pairs = list(zip(upstreams, downstreams))
+    else:
+        pairs = [(upstream, downstream) for upstream in upstreams for downstream in downstreams]
+    return [
+        (upstream, downstream, f'{upstream_name}#{shard}' if len(upstreams) > len(downstreams) else upstream_name)
+        for shard, (upstream, downstream) in enumerate(pairs)
+    ]
@@ -0,0 +1,194 @@
+"""
+训练任务的节点分配器，按分组、leaf 交换机维护空闲 / 工作中的节点
+    - 拓扑索引 (分组 -> leaf -> 节点) 跨 tick 保留，节点的分组、leaf、spine 没变化时不重建
+    - 每个 tick 开始时 reset，按当前可用的节点、在跑的任务重新标记 free / working
+    - 放置策略可以按分组选择:
+        random: 随机选节点，和之前的行为一致
+        best_fit: 尽量少跨 leaf；单个 leaf 放得下就选放得下的最小的 leaf，放不下时优先在同一个 spine 下凑，留下完整的大块给大任务
+"""
+
+
+import random
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+
+
+UNKNOWN_LEAF = '__unknown__'
+
+
+def random_placement(pool: Dict[str, Set[str]], n: int, spine_of: Dict[str, str], preferred_leaves: Set[str]) -> List[str]:
+    return random.sample(sorted(chain(*pool.values())), n)
+
+
+def best_fit_placement(pool: Dict[str, Set[str]], n: int, spine_of: Dict[str, str], preferred_leaves: Set[str]) -> List[str]:
+    counts = {leaf: len(nodes) for leaf, nodes in pool.items() if len(nodes)}
+    plan: Dict[str, int] = {}
+    # 任务已经占了的 leaf 先用掉，不增加跨的 leaf 数
+    for leaf in sorted(preferred_leaves & counts.keys(), key=lambda l: -counts[l]):
+        if n == 0:
+            break
+        plan[leaf] = min(counts.pop(leaf), n)
+        n -= plan[leaf]
+    if n > 0:
+        # 单个 spine 放得下的话只在放得下的最小的 spine 里选
+        spine_totals = {}
+        for leaf, count in counts.items():
+            spine_totals[spine_of.get(leaf)] = spine_totals.get(spine_of.get(leaf), 0) + count
+        fit_spines = [spine for spine, total in spine_totals.items() if total >= n]
+        if len(fit_spines):
+            spine = min(fit_spines, key=lambda s: (spine_totals[s], str(s)))
+            counts = {leaf: count for leaf, count in counts.items() if spine_of.get(leaf) == spine}
+    while n > 0:
+        fit_leaves = [leaf for leaf, count in counts.items() if count >= n]
+        if len(fit_leaves):
+            # 放得下的最小的 leaf
+            leaf = min(fit_leaves, key=lambda l: (counts[l], l))
+        else:
+            # 都放不下就先占满最大的 leaf，这样跨的 leaf 数最少
+            leaf = max(counts, key=lambda l: (counts[l], l))
+        plan[leaf] = min(counts.pop(leaf), n)
+        n -= plan[leaf]
+    return list(chain(*(sorted(pool[leaf])[:count] for leaf, count in plan.items())))
+
+
+PLACEMENT_POLICIES: Dict[str, Callable] = {
+    'random': random_placement,
+    'best_fit': best_fit_placement,
+}
+
+
+class GroupNodes(object):
+    """
+    一个分组里的节点，free 是空闲的节点，working 是在跑任务的节点 (可以被优先级更高的任务抢占)
+    """
+
+    def __init__(self, leaves: Dict[str, List[str]], spine_of: Dict[str, str], placement: Callable):
+        self.leaves = leaves
+        self.spine_of = spine_of
+        self.leaf_of = {node: leaf for leaf, nodes in leaves.items() for node in nodes}
+        self.placement = placement
+        self.free: Dict[str, Set[str]] = {leaf: set() for leaf in leaves}
+        self.working: Dict[str, Set[str]] = {leaf: set() for leaf in leaves}
+        self.n_free = 0
+        self.n_working = 0
+
+    def reset(self, available: Set[str]):
+        for leaf, nodes in self.leaves.items():
+            self.free[leaf] = available.intersection(nodes)
+            self.working[leaf] = set()
+        self.n_free = sum(len(nodes) for nodes in self.free.values())
+        self.n_working = 0
+
+    def mark_working(self, nodes: Iterable[str]):
+        for node in nodes:
+            if (leaf := self.leaf_of.get(node)) is not None and node in self.free[leaf]:
+                self.free[leaf].remove(node)
+                self.working[leaf].add(node)
+                self.n_free -= 1
+                self.n_working += 1
+
+    def take_working(self, nodes: Iterable[str]) -> Set[str]:
+        """
+        把任务自己在跑的节点从 working 里拿走，返回拿到的节点
+        """
+        taken = set()
+        for node in set(nodes):
+            if (leaf := self.leaf_of.get(node)) is not None and node in self.working[leaf]:
+                self.working[leaf].remove(node)
+                taken.add(node)
+        self.n_working -= len(taken)
+        return taken
+
+    def release(self, nodes: Iterable[str]):
+        for node in nodes:
+            leaf = self.leaf_of[node]
+            if node not in self.free[leaf]:
+                self.free[leaf].add(node)
+                self.n_free += 1
+
+    def _take(self, pool: Dict[str, Set[str]], n: int, preferred_leaves: Set[str]) -> List[str]:
+        nodes = self.placement(pool, n, self.spine_of, preferred_leaves)
+        for node in nodes:
+            pool[self.leaf_of[node]].remove(node)
+        return nodes
+
+    def allocate(self, n: int) -> Optional[List[str]]:
+        """
+        先用空闲节点，不够的话用上全部空闲节点，再从 working 里抢占剩下的，都不够返回 None
+        """
+        if n <= 0:
+            return []
+        if self.n_free >= n:
+            nodes = self._take(self.free, n, set())
+            self.n_free -= n
+            return nodes
+        if self.n_free + self.n_working >= n:
+            nodes = list(chain(*self.free.values()))
+            preferred_leaves = {leaf for leaf, free in self.free.items() if len(free)}
+            self.free = {leaf: set() for leaf in self.leaves}
+            nodes += self._take(self.working, n - self.n_free, preferred_leaves)
+            self.n_working -= n - self.n_free
+            self.n_free = 0
+            return nodes
+        return None
+
+    def fragmentation(self) -> Optional[float]:
+        """
+        1 - 最大的空闲 leaf 的节点数 / 空闲节点数，没有空闲节点时返回 None
+        """
+        if self.n_free == 0:
+            return None
+        return 1 - max(len(nodes) for nodes in self.free.values()) / self.n_free
+
+
+class NodeAllocator(object):
+    def __init__(self, default_policy='random', group_policies: Optional[Dict[str, str]] = None):
+        for policy in [default_policy, *(group_policies or {}).values()]:
+            if policy not in PLACEMENT_POLICIES:
+                raise ValueError(f'不支持的放置策略: {policy}, 可选 {list(PLACEMENT_POLICIES)}')
+        self.default_policy = default_policy
+        self.group_policies = group_policies or {}
+        self.groups: Dict[str, GroupNodes] = {}
+        self._topology_hash = None
+
+    def policy(self, group) -> str:
+        return self.group_policies.get(group, self.default_policy)
+
+    def _build(self, resource_df: pd.DataFrame):
+        groups = {}
+        spines = {}
+        for name, group, leaf, spine in zip(resource_df.name, resource_df.group, resource_df.leaf, resource_df.spine):
+            leaf = leaf if isinstance(leaf, str) and leaf else UNKNOWN_LEAF
+            groups.setdefault(group, {}).setdefault(leaf, []).append(name)
+            spines.setdefault(group, {})[leaf] = spine if isinstance(spine, str) else None
+        self.groups = {
+            group: GroupNodes(leaves, spines[group], PLACEMENT_POLICIES[self.policy(group)])
+            for group, leaves in groups.items()
+        }
+
+    def reset(self, resource_df: pd.DataFrame, available: Set[str]):
+        """
+        resource_df: 所有节点，用来维护拓扑索引
+        available: 这个 tick 可以用的节点
+        """
+        topology_hash = int(pd.util.hash_pandas_object(resource_df[['name', 'group', 'leaf', 'spine']].astype(str), index=False).sum())
+        if topology_hash != self._topology_hash:
+            self._build(resource_df)
+            self._topology_hash = topology_hash
+        for group_nodes in self.groups.values():
+            group_nodes.reset(available)
+
+    def group(self, group) -> GroupNodes:
+        if (group_nodes := self.groups.get(group)) is None:
+            group_nodes = self.groups[group] = GroupNodes({}, {}, PLACEMENT_POLICIES[self.policy(group)])
+        return group_nodes
+
+    def fragmentation(self) -> float:
+        """
+        各分组 fragmentation 按空闲节点数加权平均
+        """
+        values = [(f, g.n_free) for g in self.groups.values() if (f := g.fragmentation()) is not None]
+        total = sum(n for _, n in values)
+        return sum(f * n for f, n in values) / total if total else 0
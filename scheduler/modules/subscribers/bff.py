@@ -193,17 +193,14 @@ class ProcessUnitUsedQuota(ProcessUnitMeta):
     当前所有用户已用节点 quota 的统计
     """
     def process_tick_data(self, tick_data: TickData):
-        task_df = tick_data.task_df.copy()
-        task_df = task_df[((task_df.queue_status == 'queued') | (task_df.queue_status == 'scheduled')) & (task_df.task_type == 'training')]
-        if len(task_df) == 0:
-            result = {}
-        else:
+        task_df = tick_data.task_df
+        task_df = task_df[task_df.queue_status.isin(['queued', 'scheduled']) & (task_df.task_type == 'training')]
+        result = defaultdict(dict)
+        if len(task_df) > 0:
             priority_map = {v: k for k, v in TASK_PRIORITY.items()}
-            task_df['group-priority'] = task_df.group + '-' + task_df.priority.apply(lambda x: priority_map.get(x, 'UNKNOWN'))
-            task_df = task_df[['user_name', 'group-priority', 'nodes']]
-            res_df = task_df.groupby(['user_name', 'group-priority']).sum()
-            result = defaultdict(dict)
-            for (user_name, group_priority), nodes in res_df.to_dict()['nodes'].items():
+            group_priority = task_df.group + '-' + task_df.priority.map(priority_map).fillna('UNKNOWN')
+            res_series = task_df.nodes.groupby([task_df.user_name, group_priority]).sum()
+            for (user_name, group_priority), nodes in zip(res_series.index, res_series.tolist()):
                 result[user_name][group_priority] = nodes
         result = {'timestamp': int(time.time()), 'data': result}
         redis_conn.set(self.get_redis_key(), ujson.dumps(result))
@@ -1,13 +1,12 @@
 
 
-import ujson
-import datetime
 import pandas as pd
 
 from db import redis_conn, MarsDB
 from base_model.base_task import BaseTask
 from conf.flags import QUE_STATUS, TASK_PRIORITY
 from server_model.task_runtime_config import TaskRuntimeConfig
+from server_model.task_lifecycle import TaskLifecycleLog
 from server_model.task_impl import DbOperationImpl
 from scheduler.base_model import Subscriber, ASSIGN_RESULT, MATCH_RESULT, TickData
 
@@ -23,6 +22,7 @@ class MatcherLogger(Subscriber):
         super(MatcherLogger, self).__init__(**kwargs)
         self.last_tick_data = TickData()
         self.runtime_config = TaskRuntimeConfig(task=BaseTask())
+        self.lifecycle_log = TaskLifecycleLog()
 
     def process_subscribe(self):
         self.set_tick_data(self.waiting_for_upstream_data())
@@ -56,8 +56,7 @@ class MatcherLogger(Subscriber):
         for _, row in res_to_print.iterrows():
             if row.match_result in {MATCH_RESULT.STARTUP, MATCH_RESULT.SUSPEND, MATCH_RESULT.STOP}:
                 self.info(fmt_log(row))
-            redis_conn.append(f'lifecycle:{row.id}:scheduler', f'{ujson.dumps([str(datetime.datetime.fromtimestamp(tick_data.seq / 1000)), tick_data.seq, row.assign_result, row.match_result, row.scheduler_msg], ensure_ascii=False)}\n')
-            redis_conn.expire(f'lifecycle:{row.id}:scheduler', 60 * 60 * 24 * 30)
+            self.lifecycle_log.add(row.id, tick_data.seq, row.assign_result, row.match_result, row.scheduler_msg)
             if row.assign_result == ASSIGN_RESULT.NODE_ERROR and row.queue_status != QUE_STATUS.QUEUED:
                 if 'NotReady' in tick_data.resource_df[tick_data.resource_df.name.isin(row.assigned_nodes)].status.to_list():
                     redis_conn.lpush('node_error_task_channel', row.id)
@@ -67,6 +66,10 @@ class MatcherLogger(Subscriber):
                 if row.user_name != 'lwf':
                     self.f_warning(row.scheduler_msg, task=BaseTask(**row))
                 task.set_restart_log(rule='节点异常', reason=row.scheduler_msg, result='智能重启成功')
+        # 一个 tick 的生命周期记录走一次 pipeline 写入
+        self.perf_counter()
+        self.update_metric('lifecycle_log_rows', self.lifecycle_log.flush())
+        self.update_metric('lifecycle_log_flush', self.perf_counter())
         # 这里打印调度认为结束了的任务
         for _, row in last_tick_data.task_df[~last_tick_data.task_df.index.isin(tick_data.task_df.index)].iterrows():
             row.scheduler_msg = "任务结束了"
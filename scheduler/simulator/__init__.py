@@ -0,0 +1,4 @@
+
+
+from .simulator import Simulator
+from .workload import DEFAULT_WORKLOAD
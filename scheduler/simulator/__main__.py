@@ -0,0 +1,33 @@
+"""
+python -m scheduler.simulator --scale 1 2 10 --minutes 30
+按倍数放大默认的合成集群，用当前 CONF.scheduler 的配置跑模拟，输出每个规模的报告
+"""
+
+
+import argparse
+
+import ujson
+
+from .simulator import Simulator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='调度模拟器')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1.0], help='集群规模的倍数，可以给多个')
+    parser.add_argument('--minutes', type=float, default=30, help='统计的模拟时长 (分钟)')
+    parser.add_argument('--warmup', type=float, default=10, help='预热的模拟时长 (分钟)，不计入统计')
+    parser.add_argument('--relations', nargs='+', default=['training'], help='模拟 CONF.scheduler.relations 里的哪些流程')
+    parser.add_argument('--workload', type=str, default=None, help='覆盖默认负载配置的 json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partition', type=str, default=None, help='覆盖 CONF.scheduler.partition 的 json，比如 {"training": {"num_shards": 4}}')
+    args = parser.parse_args()
+    for scale in args.scale:
+        simulator = Simulator(
+            workload=ujson.loads(args.workload) if args.workload else None,
+            scale=scale,
+            relations=args.relations,
+            seed=args.seed,
+            partitions=ujson.loads(args.partition) if args.partition else None
+        )
+        report = simulator.run(args.minutes, warmup_minutes=args.warmup)
+        print(ujson.dumps({'scale': scale, **report}, indent=2, ensure_ascii=False))
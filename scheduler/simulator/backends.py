@@ -0,0 +1,123 @@
+"""
+模拟器里替代数据库、k8s、共享内存的实现
+    - LocalConnection: 进程内的 ProcessConnection，所有组件在同一个进程里按顺序跑
+    - SimGetDfs: Beater 的 get_dfs_module，从模拟器的状态生成 task_df / user_df / resource_df
+    - SimBeaterMixin / SimFeedBackerMixin / SimMatcherMixin: 去掉等待真实时间、写库和发信号，撮合结果交给模拟器
+"""
+
+
+from typing import TYPE_CHECKING, Callable
+
+import pandas as pd
+
+from conf.flags import QUE_STATUS
+from scheduler.base_model import ASSIGN_RESULT, MATCH_RESULT, TickData, TaskDfMutations
+from scheduler.base_model.connection import Header
+
+if TYPE_CHECKING:
+    from .simulator import Simulator
+
+
+# 模拟器自己用的字段，不放进 task_df
+SIM_ONLY_FIELDS = ('created_at', 'queued_at', 'remaining', 'started_at')
+
+
+class LocalConnection(object):
+    def __init__(self, init_obj=None, dumps: Callable = TickData.dumps, loads: Callable = TickData.loads):
+        self.dumps = dumps
+        self.loads = loads
+        self.seq = 0
+        # 和 ProcessConnection 一样存序列化之后的数据，每次 get 拿到的都是新的对象
+        self.data = dumps(TickData() if init_obj is None else init_obj)
+
+    @property
+    def header(self) -> Header:
+        return Header(seq=self.seq, frames=[])
+
+    def get(self):
+        return self.loads(self.data)
+
+    def put(self, obj, seq=0):
+        self.data = self.dumps(obj)
+        self.seq = seq
+
+    def stats(self) -> dict:
+        return {}
+
+
+class SimGetDfs(object):
+    def __init__(self, simulator: 'Simulator'):
+        self.simulator = simulator
+
+    def get_task_df(self):
+        now = self.simulator.now
+        records = []
+        for task in self.simulator.tasks.values():
+            record = {k: v for k, v in task.items() if k not in SIM_ONLY_FIELDS}
+            record['running_seconds'] = now - task['started_at'] if task['queue_status'] == QUE_STATUS.SCHEDULED else 0
+            record['created_seconds'] = now - task['created_at']
+            record['custom_rank'] = float(task['first_id'])
+            record['current_schedule_zone'] = None
+            records.append(record)
+        if len(records) == 0:
+            task_df = TickData().task_df.copy()
+        else:
+            task_df = pd.DataFrame.from_records(records)
+        task_df['assign_result'] = ASSIGN_RESULT.NOT_SURE
+        task_df['match_result'] = MATCH_RESULT.NOT_SURE
+        task_df['scheduler_msg'] = ''
+        task_df.index = task_df.id
+        task_df.sort_index(inplace=True)
+        task_df['memory'] = None
+        task_df['cpu'] = None
+        task_df['assigned_gpus'] = None
+        return task_df
+
+    def get_user_df(self):
+        return self.simulator.user_df.copy()
+
+    def get_resource_df(self, loop=None):
+        resource_df = self.simulator.resource_df.copy()
+        busy_nodes = self.simulator.node_task
+        # 没有任务的节点 working 是 None，组件里是用 is None 判断的
+        resource_df['working'] = pd.Series([
+            self.simulator.tasks[busy_nodes[name]]['task_type'] if name in busy_nodes else None
+            for name in resource_df.name
+        ], index=resource_df.index, dtype=object)
+        return resource_df
+
+
+class SimBeaterMixin(object):
+    simulator: 'Simulator' = None
+
+    def user_tick_process(self):
+        # 不等真实时间，也不记录优先级到数据库
+        self.get_tick_data(int(self.simulator.now * 1000))
+        self.feedback_modify()
+
+
+class SimFeedBackerMixin(object):
+    simulator: 'Simulator' = None
+
+    def user_tick_process(self):
+        # 由模拟器按 interval 调度，不 sleep
+        interval, self.interval = self.interval, 0
+        try:
+            super(SimFeedBackerMixin, self).user_tick_process()
+        finally:
+            self.interval = interval
+
+
+class SimMatcherMixin(object):
+    simulator: 'Simulator' = None
+
+    def user_tick_process(self):
+        self.task_df_mutations = TaskDfMutations()
+        self.process_match()
+        self.commit_task_updates()
+        if self.valid and getattr(self, 'partition', None) is None:
+            self.simulator.apply_match(self.name, self.task_df, self.user_df)
+
+
+def sim_class(cls, mixin, simulator: 'Simulator'):
+    return type(f'Sim{cls.__name__}', (mixin, cls), {'simulator': simulator})
@@ -0,0 +1,116 @@
+"""
+jupyter 撮合 (match_jupyter_task.match_task) 的性能基准，默认 5k 节点、20k 任务:
+    python -m scheduler.simulator.bench_jupyter_match --nodes 5000 --tasks 20000
+和另一份实现对比耗时，同时检查两边的结果完全一致，比如改动之前的版本:
+    git show <rev>:scheduler/modules/matchers/match_jupyter_task.py > /tmp/match_jupyter_task_old.py
+    python -m scheduler.simulator.bench_jupyter_match --compare /tmp/match_jupyter_task_old.py
+"""
+
+
+import argparse
+import importlib.util
+import random
+import time
+
+import pandas as pd
+
+from conf import CONF
+from conf.flags import QUE_STATUS, USER_ROLE
+from scheduler.base_model import MATCH_RESULT, ASSIGN_RESULT
+from scheduler.modules.matchers.match_jupyter_task import match_task
+from scheduler.modules.matchers.resource_ledger import ResourceLedger
+
+
+SHARED_GROUP = f'{CONF.jupyter.shared_node_group_prefix}_a'
+MIG_GROUP = f'{CONF.jupyter.mig_node_group_prefix}_b'
+
+
+def generate(n_nodes, n_tasks, seed):
+    """
+    :return: resource_df, task_df, extra_data; 一半共享分组、一半独占分组，两个用户有自己的 dedicated 分组
+    """
+    rng = random.Random(seed)
+    groups = [SHARED_GROUP, MIG_GROUP, 'jd_a', 'jd_b', 'u1_dedicated', 'u2_dedicated']
+    nodes = []
+    for i in range(n_nodes):
+        group = rng.choice(groups)
+        nodes.append({
+            'name': f'n{i}',
+            'group': group,
+            'origin_group': rng.choice(['x_jd_a', 'x_jd_b', None]) if group.endswith('_dedicated') else group,
+            'nodes': rng.choice([1, 1, 1, 0]),
+            'status': rng.choice(['Ready'] * 9 + ['NotReady']),
+            'working': rng.choice([None, 'jupyter', 'training']),
+            'memory': rng.choice([256, 512, 1024]) << 30,
+            'cpu': rng.choice([64, 128]),
+            'gpu_num': 8,
+            'active': True,
+        })
+    resource_df = pd.DataFrame(nodes)
+    names = resource_df.name.to_list()
+    tasks = []
+    for task_id in range(1, n_tasks + 1):
+        group = rng.choice([SHARED_GROUP, MIG_GROUP, 'jd_a', 'jd_b'])
+        queue_status = rng.choice([QUE_STATUS.QUEUED, QUE_STATUS.SCHEDULED])
+        tasks.append({
+            'id': task_id,
+            'group': group,
+            'user_name': rng.choice(['u1', 'u2', 'u3']),
+            'user_role': rng.choice([USER_ROLE.EXTERNAL, USER_ROLE.INTERNAL]),
+            'queue_status': queue_status,
+            'assign_result': rng.choice([ASSIGN_RESULT.CAN_RUN] * 4 + [ASSIGN_RESULT.CAN_NOT_RUN]),
+            'match_result': MATCH_RESULT.NOT_SURE,
+            'scheduler_msg': '',
+            'config_json': {'schema': {'resource': {'memory': rng.choice([0, 4, 16, 64]), 'cpu': rng.choice([0, 4])}}},
+            'assigned_nodes': [rng.choice(names)] if queue_status == QUE_STATUS.SCHEDULED else [],
+            'memory': None,
+            'cpu': None,
+            'assigned_gpus': rng.randrange(8) if group == MIG_GROUP else None,
+        })
+    task_df = pd.DataFrame(tasks)
+    task_df.index = task_df.id
+    for column in ['memory', 'cpu', 'assigned_gpus']:
+        task_df[column] = task_df[column].astype(object).where(task_df[column].notna(), None)
+    return resource_df, task_df, {'bg_task_node_set': set(rng.sample(names, n_nodes // 10))}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='jupyter 撮合的性能基准')
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--tasks', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', type=str, default=None, help='另一份 match_jupyter_task.py，对比耗时和结果')
+    args = parser.parse_args()
+
+    resource_df, task_df, extra_data = generate(args.nodes, args.tasks, args.seed)
+    cost, (result_resource_df, result_task_df) = min(
+        (timed(match_task, resource_df.copy(), task_df.copy(), extra_data) for _ in range(args.repeat)), key=lambda r: r[0])
+    print(f'{args.nodes} nodes, {args.tasks} tasks, startup {(result_task_df.match_result == MATCH_RESULT.STARTUP).sum()}')
+    print(f'match_task: {cost:.3f}s')
+
+    # least_loaded 是分组内的 numpy 扫描，单独看一下每次调用的代价
+    ledger = ResourceLedger(resource_df)
+    calls = [(SHARED_GROUP, memory << 30) for memory in (0, 4, 16, 64)] * 2500
+    cost, _ = timed(lambda: [ledger.least_loaded(group, memory) for group, memory in calls])
+    print(f'least_loaded: {cost / len(calls) * 1e6:.1f}us per call, group size {len(ledger.group_members(SHARED_GROUP))}')
+
+    if args.compare is not None:
+        spec = importlib.util.spec_from_file_location('match_jupyter_task_compare', args.compare)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        cost, (compare_resource_df, compare_task_df) = timed(module.match_task, resource_df.copy(), task_df.copy(), extra_data)
+        print(f'{args.compare}: {cost:.3f}s')
+        pd.testing.assert_frame_equal(result_resource_df, compare_resource_df, check_dtype=False)
+        pd.testing.assert_frame_equal(result_task_df, compare_task_df, check_dtype=False)
+        print('results are identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+分片 assign / match 的基准，在多个分组的合成集群上分别跑不分片和分片的模拟:
+    python -m scheduler.simulator.bench_partition --groups 16 --scale 4 --num-shards 4
+模拟器在一个进程里依次跑所有组件，分片模式下实际部署时各个分片在不同进程里并行，所以分片模式额外给出关键路径的耗时:
+    不分片的组件耗时之和 + 每个 pipeline 里最慢的分片 (assigner#i + matcher#i)，需要至少 num_shards 个核才能达到
+两次模拟的负载和随机数种子一样，各分组之间互不影响时调度结果 (启动、打断的任务数) 也应该一样
+"""
+
+
+import argparse
+import re
+from collections import defaultdict
+
+import numpy as np
+import ujson
+
+from .simulator import Simulator, percentiles
+
+
+SHARD_PATTERN = re.compile(r'^(?P<name>.+)#(?P<shard>\d+)_(?P<suffix>assigner|matcher)$')
+
+
+def critical_path(simulator: Simulator) -> list:
+    """
+    每个 tick 的关键路径耗时 (ms)：分片的组件按 (pipeline, 分片) 求和之后取最慢的分片，其他组件直接相加
+    """
+    ticks = len(simulator.tick_latencies)
+    serial = np.zeros(ticks)
+    shards = defaultdict(lambda: np.zeros(ticks))
+    for name, latencies in simulator.module_latencies.items():
+        if len(latencies) != ticks:
+            continue    # feedbacker 不是每个 tick 都跑，耗时也不在关键路径上
+        if (match := SHARD_PATTERN.match(name)) is not None:
+            shards[(match.group('name'), int(match.group('shard')))] += latencies
+        else:
+            serial += latencies
+    pipelines = defaultdict(list)
+    for (name, _), latencies in shards.items():
+        pipelines[name].append(latencies)
+    return (serial + sum((np.max(latencies, axis=0) for latencies in pipelines.values()), np.zeros(ticks))).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片 assign / match 的基准')
+    parser.add_argument('--groups', type=int, default=16, help='分组数，节点平均分到各个分组')
+    parser.add_argument('--nodes-per-group', type=int, default=64)
+    parser.add_argument('--scale', type=float, default=4.0)
+    parser.add_argument('--num-shards', type=int, default=4)
+    parser.add_argument('--relation', type=str, default='training', help='模拟的流程，同名的 assigner / matcher 分片')
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workload = {'groups': {f'jd_g{i:02d}': args.nodes_per_group for i in range(args.groups)}}
+    results, nodes = {}, 0
+    for num_shards in (1, args.num_shards):
+        partitions = {} if num_shards == 1 else {args.relation: {'num_shards': num_shards}}
+        simulator = Simulator(workload=workload, scale=args.scale, relations=[args.relation], seed=args.seed, partitions=partitions)
+        report = simulator.run(args.minutes, warmup_minutes=args.warmup)
+        nodes = report['nodes']
+        results[num_shards] = {
+            'tasks': report['tasks'],
+            'tick_latency_ms': report['tick_latency_ms'],
+            'critical_path_ms': percentiles(critical_path(simulator)),
+            'module_latency_ms': {name: values.get('p50') for name, values in report['module_latency_ms'].items()},
+        }
+    print(ujson.dumps({'nodes': nodes, 'results': results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
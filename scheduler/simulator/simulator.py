@@ -0,0 +1,239 @@
+"""
+调度的离散事件模拟器，用来评估集群扩大之后调度的性能
+    - 按 CONF.scheduler 里的配置创建真实的 Beater / FeedBacker / Assigner / Matcher，数据库、k8s、共享内存换成模拟的实现
+    - 模拟时间按 Beater 的 interval 前进，不等真实时间；每个 tick 依次跑各个组件，统计真实耗时
+    - 撮合结果直接改模拟器的状态: 启动的任务占用节点，到时间后结束；被打断的任务带着剩余时长重新排队
+"""
+
+
+import heapq
+import importlib
+import pickle
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from conf import CONF
+from conf.flags import QUE_STATUS
+from logm import logger
+from scheduler.base_model import MATCH_RESULT, expand_module, expand_edge, merger_upstreams
+from .backends import LocalConnection, SimGetDfs, SimBeaterMixin, SimFeedBackerMixin, SimMatcherMixin, sim_class
+from .workload import DEFAULT_WORKLOAD, scale_workload, generate_resource_df, generate_user_df, TaskGenerator
+
+
+# 按这个顺序跑，上游先跑；subscriber 只写 redis / 数据库，不参与模拟
+MODULE_ORDER = ['feedbacker', 'beater', 'assigner', 'matcher']
+SIM_MIXINS = {'beater': SimBeaterMixin, 'feedbacker': SimFeedBackerMixin, 'matcher': SimMatcherMixin}
+
+
+def import_from_str(s):
+    module, attr = s.rsplit('.', 1)
+    return getattr(importlib.import_module(module), attr)
+
+
+def percentiles(values: Iterable[float]) -> Dict[str, float]:
+    values = np.asarray(list(values), dtype=float)
+    if len(values) == 0:
+        return {}
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p90': round(float(np.percentile(values, 90)), 3),
+        'p99': round(float(np.percentile(values, 99)), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+class Simulator(object):
+    def __init__(self, workload: Optional[dict] = None, scale: float = 1.0, relations: Iterable[str] = ('training', ), seed=0,
+                 partitions: Optional[Dict[str, dict]] = None):
+        """
+        workload: 覆盖 DEFAULT_WORKLOAD 里的配置
+        scale: 集群规模 (节点数、用户数、任务到达速率) 放大的倍数
+        relations: 模拟 CONF.scheduler.relations 里的哪些调度流程
+        partitions: 分片配置，格式和 CONF.scheduler.partition 一样，None 时用 CONF 里的
+        """
+        self.workload = scale_workload({**DEFAULT_WORKLOAD, **(workload or {})}, scale)
+        self.resource_df = generate_resource_df(self.workload)
+        self.user_df = generate_user_df(self.workload)
+        self.generator = TaskGenerator(self.workload, seed=seed)
+        self.now = 0.0
+        self.tasks: Dict[int, dict] = {}
+        # 节点 -> 在上面跑的任务
+        self.node_task: Dict[str, int] = {}
+        # (结束时间, task_id, 启动时间)
+        self._finish_heap = []
+        self.stats = defaultdict(int)
+        self.queue_waits: List[float] = []
+        self.tick_latencies: List[float] = []
+        self.module_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.utilization: List[float] = []
+        self.queue_lengths: List[int] = []
+        self.global_config = {}
+        self.global_config_conn = LocalConnection(init_obj={}, dumps=pickle.dumps, loads=pickle.loads)
+        self.modules: Dict[str, dict] = {}
+        self.tick_interval = 1000
+        self.partitions = CONF.scheduler.get('partition', {}) if partitions is None else partitions
+        self._build_modules(list(relations))
+
+    def _build_modules(self, relations: List[str]):
+        """
+        和 scheduler.py 一样按 partition 配置展开分片，分片的 matcher 各自只撮合，合并之后的 matcher 改模拟器的状态
+        """
+        edges = []
+        dot_names = set()
+        for relation_name in relations:
+            for k, v in CONF.scheduler.relations[relation_name].items():
+                for item in v:
+                    upstream_name, dot_downstream = 'default', item
+                    if item.find('[') > 0:
+                        dot_downstream, upstream_name = item.split('[')[0], item.split('[')[1].split(']')[0]
+                    edges.append((k, dot_downstream, upstream_name))
+                    dot_names |= {k, dot_downstream}
+        for suffix in MODULE_ORDER:
+            for name, config in CONF.scheduler.get(suffix, {}).items():
+                if f'{suffix}.{name}' not in dot_names:
+                    continue
+                kwargs = dict(config.get('kwargs', {}))
+                if suffix == 'beater':
+                    kwargs['get_dfs_module'] = SimGetDfs(self)
+                    self.tick_interval = kwargs.get('interval', self.tick_interval)
+                for module_name, cls, module_kwargs in expand_module(suffix, name, import_from_str(config['class']), kwargs, self.partitions):
+                    if suffix in SIM_MIXINS:
+                        cls = sim_class(cls, SIM_MIXINS[suffix], self)
+                    conn = LocalConnection()
+                    self.modules[module_name] = {
+                        'suffix': suffix,
+                        'conn': conn,
+                        'instance': cls(name=module_name, conn=conn, global_config_conn=self.global_config_conn, **module_kwargs),
+                        'next_run': 0,
+                    }
+                if suffix == 'matcher' and name in self.partitions:
+                    for upstream_name, shard_name in merger_upstreams(name, self.partitions):
+                        self.modules[f'{name}_{suffix}']['instance'].add_upstream(upstream_name, self.modules[shard_name]['conn'])
+        for dot_upstream, dot_downstream, upstream_name in edges:
+            for upstream, downstream, edge_name in expand_edge(dot_upstream, dot_downstream, upstream_name, self.partitions):
+                if upstream in self.modules and downstream in self.modules:
+                    self.modules[downstream]['instance'].add_upstream(edge_name, self.modules[upstream]['conn'])
+
+    def _sync_global_config(self, instance):
+        """
+        和 Monitor 一样，组件注册的 global config 没有设置过的用默认值
+        """
+        registered = instance.tick_data.extra_data.get('registered_global_config', {})
+        if any(k not in self.global_config for k in registered):
+            self.global_config = {**registered, **self.global_config}
+            self.global_config_conn.put(self.global_config)
+
+    def _finish_tasks(self):
+        while self._finish_heap and self._finish_heap[0][0] <= self.now:
+            _, task_id, started_at = heapq.heappop(self._finish_heap)
+            task = self.tasks.get(task_id)
+            # 中间被打断过的话，这条记录已经失效了
+            if task is None or task['queue_status'] != QUE_STATUS.SCHEDULED or task['started_at'] != started_at:
+                continue
+            for node in task['assigned_nodes']:
+                self.node_task.pop(node, None)
+            self.tasks.pop(task_id)
+            self.stats['finished'] += 1
+
+    def apply_match(self, matcher_name, task_df: pd.DataFrame, user_df: pd.DataFrame):
+        """
+        代替 Matcher 的 apply_db / send_signal
+        """
+        inactive_users = set(user_df[~user_df.active].user_name)
+        task_df = task_df.copy()
+        task_df.loc[task_df.user_name.isin(inactive_users), 'match_result'] = MATCH_RESULT.STOP
+        # 先打断，让出来的节点给这次启动的任务
+        for task_id in task_df[task_df.match_result == MATCH_RESULT.SUSPEND].id:
+            task = self.tasks.get(task_id)
+            if task is None or task['queue_status'] != QUE_STATUS.SCHEDULED:
+                continue
+            for node in task['assigned_nodes']:
+                self.node_task.pop(node, None)
+            task.update(queue_status=QUE_STATUS.QUEUED, assigned_nodes=[], queued_at=self.now,
+                        remaining=max(task['remaining'] - (self.now - task['started_at']), 0))
+            self.stats['suspended'] += 1
+        for task_id in task_df[task_df.match_result == MATCH_RESULT.STOP].id:
+            if (task := self.tasks.get(task_id)) is not None and task['queue_status'] == QUE_STATUS.QUEUED:
+                self.tasks.pop(task_id)
+                self.stats['stopped'] += 1
+        start_df = task_df[task_df.match_result == MATCH_RESULT.STARTUP]
+        for task_id, assigned_nodes in zip(start_df.id, start_df.assigned_nodes):
+            task = self.tasks.get(task_id)
+            if task is None or task['queue_status'] != QUE_STATUS.QUEUED:
+                # 真实环境里 start_db_task 会抛 InsertTaskTimeout
+                self.stats['stale_start'] += 1
+                continue
+            assigned_nodes = list(assigned_nodes)
+            if len(set(assigned_nodes)) != task['nodes'] or any(node in self.node_task for node in assigned_nodes):
+                # 节点数不对或者节点已经被占了，说明撮合有问题
+                self.stats['conflict'] += 1
+                logger.warning(f'[{matcher_name}] 任务 {task_id} 分配的节点有问题: {assigned_nodes}')
+                continue
+            for node in assigned_nodes:
+                self.node_task[node] = task_id
+            task.update(queue_status=QUE_STATUS.SCHEDULED, assigned_nodes=assigned_nodes, started_at=self.now)
+            heapq.heappush(self._finish_heap, (self.now + task['remaining'], task_id, self.now))
+            self.queue_waits.append(self.now - task['queued_at'])
+            self.stats['started'] += 1
+
+    def step(self):
+        tick_seconds = self.tick_interval / 1000
+        self.now += tick_seconds
+        self._finish_tasks()
+        for task in self.generator.arrivals(self.now - tick_seconds, tick_seconds):
+            self.tasks[task['id']] = task
+            self.stats['arrived'] += 1
+        tick_start = time.perf_counter()
+        for name, module in self.modules.items():
+            instance = module['instance']
+            if module['suffix'] == 'feedbacker':
+                if self.now * 1000 < module['next_run']:
+                    continue
+                module['next_run'] = self.now * 1000 + instance.interval
+            start = time.perf_counter()
+            instance.tick_process()
+            self.module_latencies[name].append((time.perf_counter() - start) * 1000)
+            self._sync_global_config(instance)
+        self.tick_latencies.append((time.perf_counter() - tick_start) * 1000)
+        self.utilization.append(len(self.node_task) / max(len(self.resource_df), 1))
+        self.queue_lengths.append(sum(task['queue_status'] == QUE_STATUS.QUEUED for task in self.tasks.values()))
+
+    def run(self, minutes: float, warmup_minutes: float = 0):
+        """
+        warmup_minutes: 先空跑这么久，让集群里有在跑的任务，这段时间不计入统计
+        """
+        for _ in range(int(warmup_minutes * 60 * 1000 / self.tick_interval)):
+            self.step()
+        self.reset_stats()
+        wall_start = time.time()
+        for _ in range(int(minutes * 60 * 1000 / self.tick_interval)):
+            self.step()
+        self.stats['wall_seconds'] = time.time() - wall_start
+        self.stats['sim_seconds'] = minutes * 60
+        return self.report()
+
+    def reset_stats(self):
+        self.stats = defaultdict(int)
+        self.queue_waits, self.tick_latencies, self.utilization, self.queue_lengths = [], [], [], []
+        self.module_latencies = defaultdict(list)
+
+    def report(self) -> dict:
+        sim_minutes = self.stats['sim_seconds'] / 60 if self.stats['sim_seconds'] else 0
+        return {
+            'nodes': len(self.resource_df),
+            'users': self.workload['users'],
+            'arrival_per_minute': self.workload['arrival_per_minute'],
+            'sim_minutes': sim_minutes,
+            'speedup': round(self.stats['sim_seconds'] / self.stats['wall_seconds'], 2) if self.stats['wall_seconds'] else None,
+            'tasks': {k: v for k, v in self.stats.items() if k not in ('sim_seconds', 'wall_seconds')},
+            'throughput_per_minute': round(self.stats['started'] / sim_minutes, 3) if sim_minutes else 0,
+            'tick_latency_ms': percentiles(self.tick_latencies),
+            'module_latency_ms': {name: percentiles(values) for name, values in self.module_latencies.items()},
+            'queue_wait_seconds': percentiles(self.queue_waits),
+            'queue_length': round(float(np.mean(self.queue_lengths)), 1) if self.queue_lengths else 0,
+            'utilization': round(float(np.mean(self.utilization)), 4) if self.utilization else 0,
+        }
@@ -0,0 +1,149 @@
+"""
+模拟器用的合成集群和任务负载
+    - 节点: 按分组生成，带 leaf / spine 拓扑
+    - 用户: 每个用户在每个分组、每个优先级上有 quota
+    - 任务: 泊松到达，节点数、优先级按给定的分布抽样，运行时长服从对数正态分布
+"""
+
+
+import copy
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from conf.flags import TASK_TYPE, QUE_STATUS, USER_ROLE, TASK_PRIORITY
+
+
+DEFAULT_WORKLOAD = {
+    # 分组 -> 节点数
+    'groups': {'jd_a100': 512, 'jd_a800': 256},
+    'nodes_per_leaf': 16,
+    'leaves_per_spine': 8,
+    'gpu_num': 8,
+    'cpu': 128,
+    'memory_gb': 1024,
+    'users': 100,
+    # 每个用户在每个分组、每个优先级上的 quota 占分组节点数的比例
+    'quota_ratio': 0.25,
+    'arrival_per_minute': 10,
+    # 节点数 -> 权重
+    'task_nodes': {1: 50, 2: 20, 4: 15, 8: 10, 32: 5},
+    # 运行时长的中位数和对数正态分布的 sigma
+    'duration_median_minutes': 60,
+    'duration_sigma': 1.0,
+    # 优先级 -> 权重
+    'priority': {TASK_PRIORITY.HIGH.value: 10, TASK_PRIORITY.ABOVE_NORMAL.value: 30, TASK_PRIORITY.NORMAL.value: 40, TASK_PRIORITY.AUTO.value: 20},
+}
+
+
+def scale_workload(workload: dict, scale: float) -> dict:
+    """
+    按比例放大集群: 节点数、用户数、任务到达速率一起放大
+    """
+    workload = copy.deepcopy(workload)
+    workload['groups'] = {group: max(int(n * scale), 1) for group, n in workload['groups'].items()}
+    workload['users'] = max(int(workload['users'] * scale), 1)
+    workload['arrival_per_minute'] = workload['arrival_per_minute'] * scale
+    return workload
+
+
+def generate_resource_df(workload: dict) -> pd.DataFrame:
+    rows = []
+    for group, n_nodes in workload['groups'].items():
+        for i in range(n_nodes):
+            leaf = i // workload['nodes_per_leaf']
+            rows.append({
+                'name': f'{group}-{i:05d}',
+                'group': group,
+                'origin_group': group,
+                'mars_group': group,
+                'leaf': f'{group}-leaf{leaf}',
+                'spine': f'{group}-spine{leaf // workload["leaves_per_spine"]}',
+                'nodes': 1,
+                'gpu_num': workload['gpu_num'],
+                'cpu': workload['cpu'],
+                'memory': workload['memory_gb'] << 30,
+                'status': 'Ready',
+                'working': None,
+                'working_user_role': None,
+                'schedule_zone': None,
+                'flag': None,
+                'active': True,
+                'allocated': False,
+            })
+    return pd.DataFrame(rows)
+
+
+def generate_user_df(workload: dict) -> pd.DataFrame:
+    rows = []
+    for i in range(workload['users']):
+        for group, n_nodes in workload['groups'].items():
+            for priority in workload['priority']:
+                if priority == TASK_PRIORITY.AUTO.value:
+                    continue
+                rows.append({
+                    'user_name': f'user{i:04d}',
+                    'resource': 'node',
+                    'group': group,
+                    'quota': max(int(n_nodes * workload['quota_ratio']), 1),
+                    'role': USER_ROLE.INTERNAL,
+                    'priority': priority,
+                    'active': True,
+                })
+    return pd.DataFrame(rows)
+
+
+class TaskGenerator(object):
+    def __init__(self, workload: dict, seed=0):
+        self.workload = workload
+        self.rng = np.random.default_rng(seed)
+        self.next_id = 1
+        self.groups = list(workload['groups'])
+        group_sizes = np.array([workload['groups'][g] for g in self.groups], dtype=float)
+        self.group_weights = group_sizes / group_sizes.sum()
+        self.node_choices, node_weights = zip(*workload['task_nodes'].items())
+        self.node_weights = np.array(node_weights, dtype=float) / sum(node_weights)
+        self.priority_choices, priority_weights = zip(*workload['priority'].items())
+        self.priority_weights = np.array(priority_weights, dtype=float) / sum(priority_weights)
+
+    def arrivals(self, now: float, seconds: float) -> List[Dict]:
+        """
+        生成 seconds 秒内到达的任务，now 为模拟时间 (秒)
+        """
+        n = self.rng.poisson(self.workload['arrival_per_minute'] * seconds / 60)
+        tasks = []
+        for _ in range(n):
+            group = self.rng.choice(self.groups, p=self.group_weights)
+            nodes = min(int(self.rng.choice(self.node_choices, p=self.node_weights)), self.workload['groups'][group])
+            duration = float(self.rng.lognormal(np.log(self.workload['duration_median_minutes'] * 60), self.workload['duration_sigma']))
+            task_id = self.next_id
+            self.next_id += 1
+            tasks.append({
+                'id': task_id,
+                'nb_name': f'sim-{task_id}',
+                'user_name': f'user{int(self.rng.integers(self.workload["users"])):04d}',
+                'code_file': 'sim.py',
+                'group': group,
+                'nodes': nodes,
+                'assigned_nodes': [],
+                'backend': 'sim',
+                'task_type': TASK_TYPE.TRAINING_TASK,
+                'queue_status': QUE_STATUS.QUEUED,
+                'priority': int(self.rng.choice(self.priority_choices, p=self.priority_weights)),
+                'first_id': task_id,
+                'chain_id': f'sim-{task_id}',
+                'config_json': {'schema': {'resource': {}}},
+                'user_role': USER_ROLE.INTERNAL,
+                'worker_status': 'queued',
+                'schedule_zone': None,
+                'client_group': None,
+                'is_spot_jupyter': False,
+                'assigned_numa': None,
+                'runtime_config_json': {},
+                # 下面是模拟器自己用的
+                'created_at': now,
+                'queued_at': now,
+                'remaining': duration,
+            })
+        return tasks
@@ -10,6 +10,11 @@ from conf.flags import EXP_STATUS
 from db import MarsDB
 
 
+POD_NG_COLUMNS = ', '.join(f'"{c}"' for c in [
+    'task_id', 'pod_id', 'job_id', 'status', 'exit_code', 'node', 'assigned_gpus', 'memory', 'cpu', 'role',
+    'created_at', 'begin_at', 'end_at',
+])
+
 class Pod(BasePod):
     def __init__(self, task_id, pod_id, job_id, status, node, role, assigned_gpus, created_at=None, begin_at=None,
                  end_at=None, memory=0, cpu=0, exit_code='nan',
@@ -71,12 +76,18 @@ class Pod(BasePod):
         self.update_user_last_activity()
 
     @classmethod
-    def where(cls, where, args):
+    def where(cls, where, args, statement_name=None):
         items = []
         sql = f''' 
             select * from pod_ng where {where};
         '''
-        result = MarsDB().execute(sql, args)
+        if statement_name is not None:
+            # prepared statement 的结果列在 prepare 时就定了，写明列名，pod_ng 加列也不会让缓存的 plan 失效
+            sql = f'select {POD_NG_COLUMNS} from pod_ng where {where};'
+            MarsDB.register_statement(statement_name, sql)
+            result = MarsDB().execute_prepared(statement_name, args)
+        else:
+            result = MarsDB().execute(sql, args)
         for r in result:
             item = cls(**r)
             items.append(item)
@@ -84,11 +95,11 @@ class Pod(BasePod):
 
     @classmethod
     def find_pods(cls, task_id):
-        return cls.where('"task_id" = %s order by "job_id"', (task_id, ))
+        return cls.where('"task_id" = %s order by "job_id"', (task_id, ), statement_name='pod_by_task_id')
 
     @classmethod
     def find_pods_by_pod_id(cls, pod_id):
-        return cls.where('"pod_id" = %s', (pod_id, ))
+        return cls.where('"pod_id" = %s', (pod_id, ), statement_name='pod_by_pod_id')
 
     @classmethod
     def find_pods_by_job(cls, job_id):
@@ -101,12 +112,18 @@ class Pod(BasePod):
         ''', ())
 
     @classmethod
-    async def a_where(cls, where, args):
+    async def a_where(cls, where, args, statement_name=None):
         items = []
         sql = f''' 
             select * from pod_ng where {where};
         '''
-        result = await MarsDB().a_execute(sql, args)
+        if statement_name is not None:
+            # prepared statement 的结果列在 prepare 时就定了，写明列名，pod_ng 加列也不会让缓存的 plan 失效
+            sql = f'select {POD_NG_COLUMNS} from pod_ng where {where};'
+            MarsDB.register_statement(statement_name, sql)
+            result = await MarsDB().a_execute_prepared(statement_name, args)
+        else:
+            result = await MarsDB().a_execute(sql, args)
         for r in result:
             item = cls(**r)
             items.append(item)
@@ -114,11 +131,11 @@ class Pod(BasePod):
 
     @classmethod
     async def aio_find_pods(cls, task_id):
-        return await cls.a_where('"task_id" = %s order by "job_id"', (task_id, ))
+        return await cls.a_where('"task_id" = %s order by "job_id"', (task_id, ), statement_name='pod_by_task_id')
 
     @classmethod
     async def aio_find_pods_by_pod_id(cls, pod_id):
-        return await cls.a_where('"pod_id" = %s', (pod_id, ))
+        return await cls.a_where('"pod_id" = %s', (pod_id, ), statement_name='pod_by_pod_id')
 
     @classmethod
     def empty_pod(cls, *args, **kwargs):
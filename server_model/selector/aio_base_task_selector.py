@@ -6,9 +6,16 @@ from base_model.training_task import BaseTask
 from db import MarsDB
 
 
+TASK_NG_COLUMNS = [
+    'id', 'nb_name', 'user_name', 'code_file', 'workspace', 'config_json', 'group', 'nodes', 'assigned_nodes',
+    'restart_count', 'whole_life_state', 'first_id', 'backend', 'task_type', 'queue_status', 'notes', 'priority',
+    'chain_id', 'stop_code', 'suspend_code', 'mount_code', 'suspend_updated_at', 'begin_at', 'end_at', 'created_at',
+    'worker_status', 'last_task',
+]
+
 class AioBaseTaskSelector(TaskSelector):
     @classmethod
-    async def where(cls, impl_cls, where: str, args: Tuple, limit: int, order_desc: bool = True) -> list:
+    async def where(cls, impl_cls, where: str, args: Tuple, limit: int, order_desc: bool = True, statement_name: str = None) -> list:
         """
         @note: 我只拿 1000 条实验
 
@@ -17,12 +24,16 @@ class AioBaseTaskSelector(TaskSelector):
         @param impl_cls:
         @param limit:
         @param order_desc:
+        @param statement_name: 热点查询的语句名，指定后使用 MarsDB 的具名语句执行
         @return:
         """
+        # prepared statement 的结果列在 prepare 时就定了，写明列名，task_ng 加列也不会让缓存的 plan 失效
+        outer_columns, inner_columns = ('"t".*', '"task_ng".*') if statement_name is None else (
+            ', '.join(f'"t"."{c}"' for c in TASK_NG_COLUMNS), ', '.join(f'"task_ng"."{c}"' for c in TASK_NG_COLUMNS))
         sql = f'''
-            select "t".*, coalesce("tt"."tags", '{{}}')::varchar[] as "tags"
+            select {outer_columns}, coalesce("tt"."tags", '{{}}')::varchar[] as "tags"
             from (
-                select "task_ng".*
+                select {inner_columns}
                 from "task_ng"
                 where {where}
                 group by "task_ng"."id"
@@ -36,7 +47,12 @@ class AioBaseTaskSelector(TaskSelector):
             ) "tt" on "tt"."chain_id" = "t"."chain_id"
         '''
         # note: 因为我们的内存足够大，所以目前来说 filter 以及 page 操作都可以把个人用户的数据筛选出来再做
-        results = await MarsDB().a_execute(sql, args)
+        if statement_name is not None:
+            statement_name = f'{statement_name}_{limit}_{"desc" if order_desc else "asc"}'
+            MarsDB.register_statement(statement_name, sql)
+            results = await MarsDB().a_execute_prepared(statement_name, args)
+        else:
+            results = await MarsDB().a_execute(sql, args)
         tasks = []
         for result in results:
             tasks.append(BaseTask(impl_cls, **result))
@@ -51,11 +67,11 @@ class AioBaseTaskSelector(TaskSelector):
         user_name = kwargs.get('user_name', None)
 
         if id is not None:
-            result = await cls.where(impl_cls, '"id" = %s', (int(id), ), limit=1)
+            result = await cls.where(impl_cls, '"id" = %s', (int(id), ), limit=1, statement_name='task_by_id')
         elif chain_id is not None:
-            result = await cls.where(impl_cls, '"chain_id" = %s', (chain_id, ), limit=1)
+            result = await cls.where(impl_cls, '"chain_id" = %s', (chain_id, ), limit=1, statement_name='task_by_chain_id')
         else:
-            result = await cls.where(impl_cls, '"nb_name" = %s and "user_name" = %s', (nb_name, user_name), limit=1)
+            result = await cls.where(impl_cls, '"nb_name" = %s and "user_name" = %s', (nb_name, user_name), limit=1, statement_name='task_by_nb_name')
         if len(result) > 0:
             return result[0]
         else:
@@ -72,21 +88,38 @@ class AioBaseTaskSelector(TaskSelector):
         assert order_desc is not None, '必须指定 order_desc'
 
         if queue_status is not None:
-            return await cls.where(impl_cls, '"queue_status" = %s', (queue_status, ), limit=limit, order_desc=order_desc)
+            return await cls.where(impl_cls, '"queue_status" = %s', (queue_status, ), limit=limit, order_desc=order_desc, statement_name='task_list_by_queue_status')
         elif user_name is not None:
-            return await cls.where(impl_cls, '"user_name" = %s', (user_name, ), limit=limit, order_desc=order_desc)
+            return await cls.where(impl_cls, '"user_name" = %s', (user_name, ), limit=limit, order_desc=order_desc, statement_name='task_list_by_user_name')
         elif chain_id is not None:
-            return await cls.where(impl_cls, '"chain_id" = %s', (chain_id, ), limit=limit, order_desc=order_desc)
+            return await cls.where(impl_cls, '"chain_id" = %s', (chain_id, ), limit=limit, order_desc=order_desc, statement_name='task_list_by_chain_id')
         else:
             raise NotImplementedError
 
     @classmethod
     async def get_error_info(cls, id, *args, **kwargs) -> Optional[BaseTask]:  # 只在获取log时用到，不会用到同步的db
-        sql = f'''
-            select *
+        sql = '''
+            select "id", "error_info"
             from "task_error_info"
-            where "id" = {id};
+            where "id" = %s;
         '''
-        results = await MarsDB().a_execute(sql)
+        MarsDB.register_statement('task_error_info_by_id', sql)
+        results = await MarsDB().a_execute_prepared('task_error_info_by_id', (int(id), ))
         results = results.first()
         return results.error_info if results else ""
+
+    @classmethod
+    async def get_error_info_list(cls, ids: List[int]) -> dict:
+        """
+        一次查出多个任务的 error info
+        @return: {id: error_info}
+        """
+        if len(ids) == 0:
+            return {}
+        sql = f'''
+            select "id", "error_info"
+            from "task_error_info"
+            where "id" in ({','.join(str(int(i)) for i in ids)});
+        '''
+        results = await MarsDB().a_execute(sql)
+        return {r.id: r.error_info for r in results}
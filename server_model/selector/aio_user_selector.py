@@ -9,10 +9,14 @@ from server_model.user_data import UserTable, UserAccessTokenTable
 
 class AioUserSelector:
     @classmethod
-    def __df_to_users(cls, df, with_token=True):
+    def __records_to_users(cls, records, with_token=True):
         # 不需要 token 时需要指定 access token 形式的 dummy token, 否则会耗时查数据库拿 access token
         overwrite_token = {} if with_token else {'token': 'ACCESS-dummy'}
-        return [User(**{**row, **overwrite_token}) for row in df.to_dict('records')]
+        return [User(**{**row, **overwrite_token}) for row in records]
+
+    @classmethod
+    def __df_to_users(cls, df, with_token=True):
+        return cls.__records_to_users(df.to_dict('records'), with_token=with_token)
 
     @classmethod
     async def find_all(cls, max_num_limit=None, with_token=False, **kwargs) -> List[User]:
@@ -20,10 +24,17 @@ class AioUserSelector:
             with_token: 是否需要获取 token, 如果需要的话需对每个用户查数据库拿 access token, 速度较慢
             支持筛选的 columns: check {UserTable.columns}
         """
-        df = await UserTable.async_df
+        snapshot = await UserTable.async_snapshot
+        df = snapshot.df
         assert all(field in df.columns for field in kwargs.keys()), \
             f'查找用户的筛选条件不存在: {[k for k in kwargs if k not in df.columns]}'
 
+        if len(kwargs) == 1:
+            # 单个条件直接走 snapshot 的索引, 不用过滤整个 df
+            (field, value), = kwargs.items()
+            records = snapshot.records(field, value)
+            records = records if max_num_limit is None else records[:max_num_limit]
+            return cls.__records_to_users(records, with_token=with_token)
         for field, value in kwargs.items():
             df = df[df.get(field) == value]
         df = df if max_num_limit is None else df[:max_num_limit]
@@ -44,19 +55,18 @@ class AioUserSelector:
         # access token 的方式，查用户再更新准入范围
         if token.startswith('ACCESS-'):
             access_token = token
-            df = await UserAccessTokenTable.async_df
-            __filter = (df.access_token == access_token)
+            user_access = (await UserAccessTokenTable.async_snapshot).records('access_token', access_token)
             if not allow_expired:
-                __filter = __filter & (df.expire_at > datetime.datetime.now()) & df.active
-            user_access = df[__filter]
+                now = datetime.datetime.now()
+                user_access = [r for r in user_access if r['expire_at'] > now and r['active']]
             if len(user_access) == 1:
-                user_access = user_access.iloc[0]
-                users = await cls.find_all(max_num_limit=1, user_name=user_access.access_user_name)
+                user_access = user_access[0]
+                users = await cls.find_all(max_num_limit=1, user_name=user_access['access_user_name'])
                 if len(users) > 0:
                     user = users[0]
-                    user.access.access_scope = user_access.access_scope
-                    user.access.from_user_name = user_access.from_user_name
-                    user.access.expire_at = user_access.expire_at
+                    user.access.access_scope = user_access['access_scope']
+                    user.access.from_user_name = user_access['from_user_name']
+                    user.access.expire_at = user_access['expire_at']
                     user.token = access_token
                     return user
             return None
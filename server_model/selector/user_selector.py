@@ -19,39 +19,30 @@ class UserSelector:
         # access token 的方式，查用户再更新准入范围
         if token.startswith('ACCESS-'):
             access_token = token
-            df = UserAccessTokenTable.df
-            __filter = (df.access_token == access_token)
+            user_access = UserAccessTokenTable.snapshot.records('access_token', access_token)
             if not allow_expired:
-                __filter = __filter & (df.expire_at > datetime.datetime.now()) & df.active
-            user_access = df[__filter]
+                now = datetime.datetime.now()
+                user_access = [r for r in user_access if r['expire_at'] > now and r['active']]
             if len(user_access) == 1:
-                user_access = user_access.iloc[0]
-                user = cls.from_user_name(user_name=user_access.access_user_name)
+                user_access = user_access[0]
+                user = cls.from_user_name(user_name=user_access['access_user_name'])
                 if user is not None:
-                    user.access.access_scope = user_access.access_scope
-                    user.access.from_user_name = user_access.from_user_name
-                    user.access.expire_at = user_access.expire_at
+                    user.access.access_scope = user_access['access_scope']
+                    user.access.from_user_name = user_access['from_user_name']
+                    user.access.expire_at = user_access['expire_at']
                     user.token = access_token
                     return user
             return None
         # 原初 token 的方式
         else:
-            df = UserTable.df
-            df = df[df.token == token]
-            if len(df) > 0:
-                return cls.__df_to_users(df[:1])[0]
-            else:
-                return None
+            row = UserTable.snapshot.first('token', token)
+            return User(**row) if row is not None else None
 
     @classmethod
     def from_user_name(cls, user_name):
-        df = UserTable.df
-        df = df[df.user_name == user_name]
-        if len(df) > 0:
-            return cls.__df_to_users(df[:1])[0]
-        else:
-            return None
+        row = UserTable.snapshot.first('user_name', user_name)
+        return User(**row) if row is not None else None
 
     @classmethod
     def fetch_all(cls, with_token=False):
-        return cls.__df_to_users(UserTable.df, with_token=with_token)
+        return cls.__df_to_users(UserTable.snapshot.df, with_token=with_token)
@@ -0,0 +1,116 @@
+"""
+任务在调度器中的生命周期记录
+每个任务一个 redis stream: lifecycle:{id}:scheduler_stream，用 MAXLEN 控制长度，避免无限增长
+写入端（scheduler 的 matcher_logger）一个 tick 只走一次 pipeline；读取端按时间范围查询
+"""
+
+
+import datetime
+from typing import List, Iterable, Optional
+
+from conf import CONF
+from db import redis_conn, a_redis
+
+
+LIFECYCLE_STREAM_MAXLEN = CONF.try_get('scheduler.lifecycle_log.maxlen', default=2000)
+LIFECYCLE_EXPIRE_SECONDS = CONF.try_get('scheduler.lifecycle_log.expire_seconds', default=60 * 60 * 24 * 30)
+LIFECYCLE_FIELDS = ['seq', 'assign_result', 'match_result', 'scheduler_msg']
+
+
+def lifecycle_key(task_id) -> str:
+    return f'lifecycle:{task_id}:scheduler_stream'
+
+
+def _to_stream_id(ts: Optional[float], default: str) -> str:
+    """
+    stream id 的前半部分是毫秒时间戳，可以直接用来做时间范围查询
+    """
+    if ts is None:
+        return default
+    if isinstance(ts, datetime.datetime):
+        ts = ts.timestamp()
+    return str(int(ts * 1000))
+
+
+def _decode_entries(entries) -> List[dict]:
+    records = []
+    for stream_id, fields in entries:
+        record = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in fields.items()}
+        seq = int(record.get('seq', 0))
+        records.append({
+            'id': stream_id.decode() if isinstance(stream_id, bytes) else stream_id,
+            'time': str(datetime.datetime.fromtimestamp(seq / 1000)),
+            'seq': seq,
+            'assign_result': record.get('assign_result'),
+            'match_result': record.get('match_result'),
+            'scheduler_msg': record.get('scheduler_msg'),
+        })
+    return records
+
+
+class TaskLifecycleLog(object):
+    """
+    批量写入：add 只是暂存在内存里，flush 时用一个 pipeline 写完这一个 tick 的所有记录
+    """
+
+    def __init__(self, maxlen: int = LIFECYCLE_STREAM_MAXLEN, expire_seconds: int = LIFECYCLE_EXPIRE_SECONDS):
+        self.maxlen = maxlen
+        self.expire_seconds = expire_seconds
+        self.__buffer = []
+
+    def add(self, task_id, seq, assign_result, match_result, scheduler_msg):
+        self.__buffer.append((task_id, {
+            'seq': int(seq),
+            'assign_result': str(assign_result),
+            'match_result': str(match_result),
+            'scheduler_msg': str(scheduler_msg),
+        }))
+
+    def __len__(self):
+        return len(self.__buffer)
+
+    def flush(self) -> int:
+        """
+        把暂存的记录一次性写入 redis，返回写入的条数
+        """
+        if not self.__buffer:
+            return 0
+        buffer, self.__buffer = self.__buffer, []
+        pipe = redis_conn.pipeline(transaction=False)
+        for task_id, fields in buffer:
+            key = lifecycle_key(task_id)
+            pipe.xadd(key, fields, maxlen=self.maxlen, approximate=True)
+            pipe.expire(key, self.expire_seconds)
+        pipe.execute(raise_on_error=False)
+        return len(buffer)
+
+    @staticmethod
+    def query(task_id, start: Optional[float] = None, end: Optional[float] = None, count: Optional[int] = None) -> List[dict]:
+        """
+        按时间范围查询某个任务的调度记录
+        :param start: 开始时间，timestamp (秒) 或 datetime，不传则从头开始
+        :param end: 结束时间，timestamp (秒) 或 datetime，不传则到最新
+        :param count: 最多返回的条数
+        """
+        entries = redis_conn.xrange(lifecycle_key(task_id), min=_to_stream_id(start, '-'), max=_to_stream_id(end, '+'), count=count)
+        return _decode_entries(entries)
+
+    @staticmethod
+    async def a_query(task_id, start: Optional[float] = None, end: Optional[float] = None, count: Optional[int] = None) -> List[dict]:
+        entries = await a_redis.xrange(lifecycle_key(task_id), min=_to_stream_id(start, '-'), max=_to_stream_id(end, '+'), count=count)
+        return _decode_entries(entries)
+
+    @staticmethod
+    async def a_query_chain(task_ids: Iterable[int], start: Optional[float] = None, end: Optional[float] = None, count: Optional[int] = None) -> List[dict]:
+        """
+        一次 pipeline 查询 chain 里所有任务的调度记录
+        """
+        task_ids = list(task_ids)
+        async with a_redis.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.xrange(lifecycle_key(task_id), min=_to_stream_id(start, '-'), max=_to_stream_id(end, '+'), count=count)
+            results = await pipe.execute()
+        records = []
+        for task_id, entries in zip(task_ids, results):
+            records += [{'task_id': task_id, **r} for r in _decode_entries(entries)]
+        return records
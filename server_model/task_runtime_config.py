@@ -27,6 +27,21 @@ class TaskRuntimeConfig(object):
         on conflict ("{column}", "source") do update set "config_json" = {'"task_runtime_config"."config_json" || ' if update else ''} excluded."config_json";
         """, (self.task.chain_id if chain else self.task.id, ujson.dumps(config_json), source)
 
+    @classmethod
+    def get_multi_insert_sql(cls, source, config_jsons: dict, chain=False, update=False):
+        """
+        多个任务一条 sql 写进去，config_jsons 为 {task_id / chain_id: config_json}
+        """
+        column = 'chain_id' if chain else 'task_id'
+        params = ()
+        for key, config_json in config_jsons.items():
+            params += (key, ujson.dumps(config_json), source)
+        return f"""
+        insert into "task_runtime_config" ("{column}", "config_json", "source")
+        values {', '.join(['(%s, %s, %s)'] * len(config_jsons))}
+        on conflict ("{column}", "source") do update set "config_json" = {'"task_runtime_config"."config_json" || ' if update else ''} excluded."config_json";
+        """, params
+
     def insert(self, source, config_json, chain=False, update=False, *args, **kwargs):
         with MarsDB() as conn:
             conn.execute(*self.get_insert_sql(source, config_json, chain, update, args, kwargs))
@@ -1,19 +1,27 @@
 
 
 from abc import ABC
+
+from monitor.task_perf_store import TaskPerfStore
 from server_model.training_task_impl.additional_property_impl import AdditionalPropertyImpl
+from utils.implement import asyncwrap
 
 
 class DashboardApiImpl(AdditionalPropertyImpl, ABC):
     async def get_latest_point(self):
+        task = self.task
+        latest = await asyncwrap(TaskPerfStore.latest)(task.id, len(task.assigned_nodes))
         return {
-                'gpu_util': -1,
-                'ib_recv': -1,
-                'ib_trans': -1
+                'gpu_util': latest.get('gpu', -1),
+                'ib_recv': latest.get('ib_recv', -1),
+                'ib_trans': latest.get('ib_trans', -1)
             }
 
     async def get_chain_time_series(self, query_type: str, rank: int, *args, **kwargs):
         '''
         获取整条chain的数据
         '''
-        return None
+        task = self.task
+        data_interval = kwargs.get('data_interval', '5min')
+        return await asyncwrap(TaskPerfStore.query)(task.id_list, rank, query_type, data_interval,
+                                                    start=kwargs.get('start'), end=kwargs.get('end'))
@@ -1,16 +1,26 @@
+import asyncio
 import json
+import os
 from abc import ABC
 
 from conf import CONF
-from conf.flags import STOP_CODE, CHAIN_STATUS, TASK_OP_CODE
+from conf.flags import STOP_CODE, CHAIN_STATUS, TASK_OP_CODE, QUE_STATUS
 from db import a_redis as redis, MarsDB
 from utils import get_task_node_idx_log
+from utils.log_search_index import LogSearchIndex
+from utils.log_tail import LogTailFollower, POLL_INTERVAL
 from server_model.pod import Pod
 from server_model.training_task_impl.additional_property_impl import \
     AdditionalPropertyImpl
 from server_model.selector import AioBaseTaskSelector
 
 
+SYS_LOG_CONCURRENCY = CONF.try_get('experiment.log.sys_log.concurrency', default=16)
+SYS_LOG_CACHE_SECONDS = CONF.try_get('experiment.log.sys_log.cache_seconds', default=60 * 60 * 24)
+# 日志推送时多久没有新日志就推送一次任务状态
+LOG_STREAM_HEARTBEAT = CONF.try_get('experiment.log.stream.heartbeat', default=10)
+
+
 class TaskApiImpl(AdditionalPropertyImpl, ABC):
     async def log(self, rank: int, last_seen=None, service=None, **kwargs):
         """
@@ -45,16 +55,7 @@ class TaskApiImpl(AdditionalPropertyImpl, ABC):
                 if not rst_last_seen or res['last_seen']['timestamp'] > rst_last_seen['timestamp']:
                     rst_last_seen = res['last_seen']
             if task_id == task_id_list[-1]:
-                try:
-                    error_msg = await AioBaseTaskSelector.get_error_info(id=task_id)
-                except:
-                    error_msg = ""
-                try:
-                    pod_id = f'{task.user.user_name}-{task_id}-{rank}'
-                    exit_code = (await Pod.aio_find_pods_by_pod_id(pod_id))[0].exit_code
-                except:
-                    exit_code = ""
-                stop_code = (await AioBaseTaskSelector.find_one(None, id=task_id)).stop_code
+                error_msg, exit_code, stop_code = await self.log_status(task_id, rank)
         if rst_last_seen is not None:
             rst_last_seen['id'] = current_seen_id
         return {
@@ -68,27 +69,120 @@ class TaskApiImpl(AdditionalPropertyImpl, ABC):
             "last_seen": rst_last_seen
         }
 
+    async def log_status(self, task_id, rank):
+        """
+        @return: (error_msg, exit_code, stop_code)
+        """
+        try:
+            error_msg = await AioBaseTaskSelector.get_error_info(id=task_id)
+        except:
+            error_msg = ""
+        try:
+            pod_id = f'{self.task.user.user_name}-{task_id}-{rank}'
+            exit_code = (await Pod.aio_find_pods_by_pod_id(pod_id))[0].exit_code
+        except:
+            exit_code = ""
+        stop_code = (await AioBaseTaskSelector.find_one(None, id=task_id)).stop_code
+        return error_msg, exit_code, stop_code
+
+    async def log_stream(self, rank: int, last_seen=None):
+        """
+        推送任务链的日志, yield (event, data):
+            - ('log', ...): 第一条和 log() 的返回一样, 之后是 tail follower 读到的新日志, 只有 data 和 last_seen
+            - ('status', ...): LOG_STREAM_HEARTBEAT 秒没有新日志时推送一次 stop_code / exit_code / error_msg;
+                               chain 有了新的任务或者任务结束了, 推送最后一次 status 之后结束, 由客户端决定是否重连
+        """
+        task = self.task
+        task_id = sorted(task.id_list)[-1]
+        path = os.path.join(task.user.config.log_dir(), str(task_id))
+        subscription = None
+        finishing = False
+        try:
+            while True:
+                if subscription is None or subscription.lagged:
+                    if subscription is not None:
+                        subscription.close()
+                    # 先订阅再读已有的日志, 两者重复的部分按时间戳去掉
+                    subscription = await LogTailFollower.subscribe(path, rank, suffix_filter=f'#{rank}', max_line_length=CONF.experiment.log.max_line_length)
+                    res = await self.log(rank, last_seen=last_seen)
+                    last_seen = res['last_seen'] or last_seen
+                    dedup_timestamp = (last_seen or {}).get('timestamp')
+                    yield 'log', res
+                if (chunk := await subscription.get(POLL_INTERVAL * 2 if finishing else LOG_STREAM_HEARTBEAT)) is not None:
+                    lines = chunk['lines']
+                    if dedup_timestamp is not None:
+                        newer = [i for i, ts in enumerate(chunk['timestamps']) if ts is not None and ts > dedup_timestamp]
+                        lines = lines[newer[0]:] if newer else []
+                        dedup_timestamp = None if newer else dedup_timestamp
+                    if chunk['last_seen'] is not None:
+                        last_seen = {**chunk['last_seen'], 'id': task_id}
+                    if lines:
+                        yield 'log', {'data': '\n'.join(lines), 'last_seen': last_seen}
+                    continue
+                if subscription.lagged:
+                    continue
+                error_msg, exit_code, stop_code = await self.log_status(task_id, rank)
+                latest_task = await AioBaseTaskSelector.find_one(None, chain_id=task.chain_id)
+                done = latest_task.id != task_id or latest_task.queue_status == QUE_STATUS.FINISHED
+                if done and not finishing:
+                    # 再等一轮, 把最后写入的日志推送完
+                    finishing = True
+                    continue
+                yield 'status', {'stop_code': stop_code, 'exit_code': exit_code, 'error_msg': error_msg, 'last_seen': last_seen, 'end': done}
+                if done:
+                    return
+        finally:
+            if subscription is not None:
+                subscription.close()
+
     async def sys_log(self):
         """
         获取任务链的系统报错日志
+        所有任务的 error info 一次查出来，oom log 并发读取；chain 结束之后结果不会再变，缓存到 redis
         :return:
         """
         task = self.task
         task_id_list = sorted(task.id_list)
+        cache_key = f'sys_log:{task.chain_id}:{task_id_list[-1]}'
+        finished = task.chain_status == CHAIN_STATUS.FINISHED
+        if finished and (cached := await redis.get(cache_key)) is not None:
+            return {
+                "success": 1,
+                "data": cached.decode()
+            }
+        try:
+            error_infos = await AioBaseTaskSelector.get_error_info_list(task_id_list)
+        except:
+            error_infos = None
+        semaphore = asyncio.Semaphore(SYS_LOG_CONCURRENCY)
+
+        async def get_oom_log(task_id, rank):
+            async with semaphore:
+                res = await get_task_node_idx_log(task_id, task.user, rank, suffix_filter='.oom_log', max_line_length=CONF.experiment.log.max_line_length)
+                return res['data']
+
+        async def get_task_sys_log(task_id):
+            if error_infos is None:
+                return '', Exception('获取 error info 失败')
+            data = f"{(error_infos.get(task_id) or '').strip()}\n"
+            try:
+                oom_logs = await asyncio.gather(*[get_oom_log(task_id, rank) for rank in range(len(task.assigned_nodes))])
+            except Exception as e:
+                return data, e
+            for oom_log in oom_logs:
+                if oom_log != "还没产生日志" and oom_log != "":
+                    data += f"oom log:\n{oom_log}"
+            return data, None
+
+        task_sys_logs = await asyncio.gather(*[get_task_sys_log(task_id) for task_id in task_id_list])
         data = '=' * 20 + '\n'
-        for task_id in task_id_list:
+        for task_id, task_sys_log in zip(task_id_list, task_sys_logs):
             shown_id = f"{task_id} (current)" if task_id == task_id_list[-1] else f"{task_id}"
             data += f"id: {shown_id}\n{'-' * 10}\nsyslog:\n"
-            try:
-                sys_msg = await AioBaseTaskSelector.get_error_info(id=task_id)
-                data += f"{sys_msg.strip()}\n"
-                for rank in range(len(task.assigned_nodes)):
-                    res = await get_task_node_idx_log(task_id, task.user, rank, suffix_filter='.oom_log', max_line_length=CONF.experiment.log.max_line_length)
-                    if res['data'] != "还没产生日志" and res['data'] != "":
-                        data += f"oom log:\n{res['data']}"
-                data += f"\n{'=' * 20}\n"
-            except:
-                data += f"\n{'=' * 20}\n"
+            data += task_sys_log[0]
+            data += f"\n{'=' * 20}\n"
+        if finished and all(r[1] is None for r in task_sys_logs):
+            await redis.set(cache_key, data, ex=SYS_LOG_CACHE_SECONDS)
         return {
             "success": 1,
             "data": data
@@ -116,23 +210,18 @@ class TaskApiImpl(AdditionalPropertyImpl, ABC):
             print(e)
             return {}
 
-    async def search_in_global(self, content):
+    async def search_in_global(self, content, max_matches=100):
         """
-        全局搜索该任务每个rank包含content的次数
+        全局搜索该任务每个rank包含content的次数，以及匹配到的行的位置
         :return:
         """
         task = self.task
-        task_id_list = sorted(task.id_list)
-        rst = [0] * len(task.assigned_nodes)
-        for task_id in task_id_list:  # 所有任务
-            for rank in range(len(task.assigned_nodes)):  # 所有节点
-                res = await get_task_node_idx_log(task_id, task.user, rank, max_line_length=CONF.experiment.log.max_line_length)
-                if res['data'] != "还没产生日志":
-                    for line in res['data'].split('\n'):  # 所有行
-                        rst[rank] += line[29:].count(content)
+        rst, matches = await LogSearchIndex.search(task.user, task.id_list, len(task.assigned_nodes), content,
+                                                   max_line_length=CONF.experiment.log.max_line_length, max_matches=max_matches)
         return {
             'success': 1,
-            'data': rst
+            'data': rst,
+            'matches': matches
         }
 
     async def stop(self, task_op_code=TASK_OP_CODE.STOP, *args, **kwargs):
@@ -75,8 +75,7 @@ class User(UserExtras, BaseUser):
     @property
     def group_list(self):
         if self._group_list is None:
-            df = UserWithAllGroupsTable.df
-            self._group_list = df[df.user_id == self.user_id].iloc[0].user_groups + [self.user_name]
+            self._group_list = UserWithAllGroupsTable.snapshot.first('user_id', self.user_id)['user_groups'] + [self.user_name]
         return self._group_list
 
     def in_all_groups(self, groups: List[str]):
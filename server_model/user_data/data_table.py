@@ -7,18 +7,37 @@ import pickle
 import threading
 import time
 import uuid
+from collections import deque
 from datetime import datetime
 from itertools import chain
 from threading import Lock
-from typing import Optional, List, Iterable
+from typing import Optional, List, Iterable, Dict, Tuple
 
 import pandas as pd
+from prometheus_client import Histogram
 
 from conf import CONF
-from db import redis_conn
+from db import redis_conn, MarsDB
 from .mq_utils import MessageQueue, MessageType
 from .patchable_dataframe import PatchableDataFrame, PatchConflictException
-from .utils import log_debug, log_info, log_error
+from .snapshot import DataFrameSnapshot, build_hash_index
+from .utils import log_debug, log_info, log_error, is_sync_point
+
+
+DB_TABLE_REFRESH_INTERVAL = CONF.try_get('user_data_roaming.db_table_refresh_interval', default=1.0)
+# 每张表保留最近多少次变动, ComputedTable 增量计算时用
+CHANGE_LOG_SIZE = CONF.try_get('user_data_roaming.change_log_size', default=100)
+# 超过这个时间的 checkpoint 不再用来初始化议会表, 直接从 DB 加载
+CHECKPOINT_MAX_AGE = CONF.try_get('user_data_roaming.checkpoint.max_age', default=600)
+
+USER_DATA_COMPUTE_SECONDS = Histogram(
+    'user_data_compute_seconds', 'ComputedTable 计算耗时', ['table', 'mode'],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+USER_DATA_CHANGE_FANOUT = Histogram(
+    'user_data_change_fanout', '表更新后需要重算的 ComputedTable 个数', ['table'],
+    buckets=(0, 1, 2, 3, 5, 8)
+)
 
 
 class IDataTable:
@@ -28,18 +47,31 @@ class IDataTable:
     table_name = None
     columns = None
     primary_key_columns = None
+    # 需要维护哈希索引的列, 议会表和内存表在数据变动时更新索引, 用于 snapshot 的 O(1) 查询
+    index_columns: List[str] = None
     receiving_patch = False
     dependencies: Optional[List[IDataTable]] = None
     is_computed = False
     lock: Optional[Lock] = None
     timestamp = None
-
-    def __init_subclass__(cls, table_name=None, columns=None, dependencies=None, **kwargs):
+    _snapshot: Optional[DataFrameSnapshot] = None
+    _snapshot_lock: Optional[Lock] = None
+    # 依赖这张表的 ComputedTable
+    dependents: Optional[List[IDataTable]] = None
+    # 最近的变动 [(timestamp, (to_del, to_add) 或 None)], None 表示整个 df 被替换了
+    _change_log: Optional[deque] = None
+
+    def __init_subclass__(cls, table_name=None, columns=None, dependencies=None, index_columns=None, **kwargs):
         cls.table_name = table_name
         cls.columns = columns
+        cls.index_columns = index_columns or []
         cls.dependencies = [] if dependencies is None else dependencies
         cls.lock = Lock()
         cls.timestamp = time.time()
+        cls._snapshot = None
+        cls._snapshot_lock = Lock()
+        cls.dependents = []
+        cls._change_log = deque(maxlen=CHANGE_LOG_SIZE)
 
     @classmethod
     def get_df_no_copy(cls):
@@ -57,6 +89,28 @@ class IDataTable:
     def get_df(cls) -> pd.DataFrame:
         return cls.get_df_no_copy().copy()
 
+    @classmethod
+    def _get_indexed_df(cls):
+        """
+        返回 (df, {column: 哈希索引}), 两者需要是对应的
+        """
+        return cls.get_df_no_copy(), {}
+
+    @classmethod
+    def get_snapshot(cls) -> DataFrameSnapshot:
+        """
+        各种表更新 df 时都是整个替换 _df, 不会原地修改, 所以 df 对象没变就可以复用上一个 snapshot
+        """
+        df, _ = cls._get_indexed_df()
+        if (snapshot := cls._snapshot) is not None and snapshot.source is df:
+            return snapshot
+        with cls._snapshot_lock:
+            # 拿到锁之后重新取一次, 避免用旧的 df 覆盖了别的线程刚生成的新 snapshot
+            df, indexes = cls._get_indexed_df()
+            if cls._snapshot is None or cls._snapshot.source is not df:
+                cls._snapshot = DataFrameSnapshot(df, version=0 if cls._snapshot is None else cls._snapshot.version + 1, indexes=indexes)
+            return cls._snapshot
+
     @classmethod
     def reload(cls):
         raise NotImplementedError
@@ -74,7 +128,7 @@ class IDataTable:
         pass
 
     @classmethod
-    def pull_diff_from_db(cls):
+    def pull_diff_from_db(cls, force=False):
         raise NotImplementedError
 
     @classmethod
@@ -82,42 +136,110 @@ class IDataTable:
         pass
 
     @classmethod
-    def update_timestamp(cls, timestamp=None):
+    def update_timestamp(cls, timestamp=None, change: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None):
+        """
+        change: 增量更新时传入 (to_del, to_add), 不传表示整个 df 被替换
+        """
         cls.timestamp = timestamp or time.time()
+        cls._change_log.append((cls.timestamp, change))
+        USER_DATA_CHANGE_FANOUT.labels(cls.table_name).observe(len(cls.dependents))
         cls.update_hook()
 
+    @classmethod
+    def get_changes_since(cls, timestamp) -> Optional[List[Tuple[pd.DataFrame, pd.DataFrame]]]:
+        """
+        返回 timestamp 之后的所有增量变动, 中间有整表替换或者变动记录已经被挤掉时返回 None
+        """
+        change_log = list(cls._change_log)
+        if len(change_log) == cls._change_log.maxlen and change_log[0][0] > timestamp:
+            return None
+        changes = [change for ts, change in change_log if ts > timestamp]
+        return None if any(change is None for change in changes) else changes
+
     @classmethod
     def initialized(cls):
         raise NotImplementedError
 
 
-class RoamingSqlTable(IDataTable):
+class SqlVersionMixin:
+    """
+    基于 SQL 的表查询数据版本号, 用来判断数据有没有变化, 不用每次都把整张表拉回来
+    """
+    @classmethod
+    def version_sql(cls):
+        """
+        查询数据版本的 SQL, 只返回一个值, 数据有变化时结果必须变化.
+        默认对 sql() 的结果逐行算 md5 后排序聚合, 与行的顺序无关, 只需要传回一个值; 子类可以重写成更轻量的查询, 比如 max("updated_at")
+        """
+        columns = ', '.join(f'"t"."{column}"' for column in cls.columns)
+        return f'''
+            select count(*) || ':' || coalesce(md5(string_agg("row_hash", ',' order by "row_hash")), '') as "version"
+            from (select md5(row({columns})::text) as "row_hash" from ({cls.sql().strip().rstrip(';')}) as "t") as "r"
+        '''
+
+    @classmethod
+    def _get_version(cls):
+        try:
+            return MarsDB(overwrite_use_db='primary').execute(cls.version_sql()).scalar()
+        except Exception as e:
+            log_error(f'查询 DB Table [{cls.table_name}] 的版本失败, 回退到全量比较', e, fetion_interval=600)
+            return None
+
+    @classmethod
+    async def _async_get_version(cls):
+        try:
+            return (await MarsDB(overwrite_use_db='primary').a_execute(cls.version_sql())).scalar()
+        except Exception as e:
+            log_error(f'查询 DB Table [{cls.table_name}] 的版本失败, 回退到全量比较', e, fetion_interval=600)
+            return None
+
+
+class RoamingSqlTable(SqlVersionMixin, IDataTable):
     """
     使用议会时, 基于 SQL 的表, 继承此类后重写 sql() 方法
     """
     _df: Optional[PatchableDataFrame] = None
     _patch_buffer = None
     _patch_buffer_lock = None
+    # 最近一次成功应用的 patch 的时间戳, 写 checkpoint 时用
+    _last_patch_timestamp = 0
+    # sync point 上次 pull_diff_from_db 时 DB 里的数据版本, 版本没变时跳过 diff (force 时不跳过)
+    _db_version = None
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         cls._df = None
         cls._patch_buffer = []
         cls._patch_buffer_lock = threading.Lock()
+        cls._last_patch_timestamp = 0
+        cls._db_version = None
 
     @classmethod
     def get_df_no_copy(cls):
         return cls._df.df
 
+    @classmethod
+    def get_df(cls) -> pd.DataFrame:
+        # 内部的 index label 是稳定的, 不连续, 对外统一成 RangeIndex
+        return cls.get_df_no_copy().reset_index(drop=True)
+
+    @classmethod
+    def _get_indexed_df(cls):
+        with cls.lock:
+            return cls._df.df, cls._df.indexes
+
     @classmethod
     def sql(cls):
         raise NotImplementedError
 
     @classmethod
     def _replace_with_newer_df(cls, new_df):
+        new_df.build_indexes(cls.index_columns)
         with cls.lock:
             if cls._df is None or new_df.timestamp > cls._df.timestamp:
                 cls._df = new_df
+            # df 整个被替换了, 下次 pull_diff_from_db 不能再按版本跳过
+            cls._db_version = None
         cls.update_timestamp()
 
     @classmethod
@@ -132,7 +254,8 @@ class RoamingSqlTable(IDataTable):
             except PatchConflictException as e:
                 e.table_name = cls.table_name
                 raise e
-        cls.update_timestamp()
+            cls._last_patch_timestamp = max(cls._last_patch_timestamp, patch['timestamp'])
+        cls.update_timestamp(change=(to_del.df, to_add.df))
         log_debug(f'应用 patch 成功: table [{cls.table_name}]')
 
     @classmethod
@@ -190,10 +313,19 @@ class RoamingSqlTable(IDataTable):
         await cls._async_apply_patches_on_err_reload()
 
     @classmethod
-    def pull_diff_from_db(cls):
+    def pull_diff_from_db(cls, force=False):
+        """
+        :param force: 不按版本跳过, 一定和 DB 比一次. 版本只反映 DB 的变化, 本地 df 和 DB 不一致
+                      (比如广播了 patch 但是 DB 写入回滚了) 时版本不会变, 要靠定时的 force diff 修复
+        """
         cls._apply_patches_on_err_reload()
+        # 先查版本再加载数据, 中间数据有变化的话下次版本还会不一样, 不会漏掉
+        version = cls._get_version()
+        if not force and version is not None and version == cls._db_version:
+            return None
         db_df = PatchableDataFrame.load_from_db(sql=cls.sql())
         df_diff = cls._df.diff(db_df)
+        cls._db_version = version
         return {'table_name': cls.table_name, 'diff': df_diff, 'timestamp': db_df.timestamp} if df_diff is not None else None
 
     @classmethod
@@ -214,9 +346,47 @@ class RoamingSqlTable(IDataTable):
         except Exception as e:
             log_error(f'Async Reload table {cls.table_name} failed!', e)
 
+    @classmethod
+    def write_checkpoint(cls, expire=CHECKPOINT_MAX_AGE):
+        """
+        只在 sync point 的 sync 线程里调用, 和 pull_diff_from_db 串行, 保证 mq_index 之前的 patch 都已经在 df 里了
+        """
+        mq_index = MessageQueue.current_index()
+        cls._apply_patches_on_err_reload()
+        with cls.lock:
+            df, timestamp = cls._df.df, max(cls._df.timestamp, cls._last_patch_timestamp)
+        return MessageQueue.write_checkpoint(cls.table_name, df, timestamp, mq_index, expire=expire)
+
+    @classmethod
+    def load_checkpoint(cls) -> bool:
+        """
+        从 checkpoint 加上之后的 patch 恢复 df, 不需要查 DB; checkpoint 过期或者 patch 不连续时返回 False
+        恢复出来的 df 的 timestamp 是覆盖到的最新的 patch 时间戳, 议会线程重复收到这些 patch 时会当作过期 patch 忽略
+        """
+        try:
+            if (checkpoint := MessageQueue.read_checkpoint(cls.table_name)) is None \
+                    or time.time() - checkpoint['created_at'] > CHECKPOINT_MAX_AGE:
+                return False
+            patches = MessageQueue.read_patches(checkpoint['mq_index'], MessageQueue.current_index(), cls.table_name)
+            if patches is None:
+                return False
+            new_df = PatchableDataFrame(df=checkpoint['df'], timestamp=checkpoint['timestamp'])
+            for patch in sorted(patches, key=lambda p: p['timestamp']):
+                if patch['timestamp'] > new_df.timestamp:
+                    new_df.apply_patch(*patch['diff'])
+                    new_df.timestamp = patch['timestamp']
+        except Exception as e:
+            log_error(f'从 checkpoint 加载 table {cls.table_name} 失败, 从 DB 加载', e)
+            return False
+        cls._replace_with_newer_df(new_df)
+        log_debug(f'从 checkpoint 加载 table [{cls.table_name}], 补了 {len(patches)} 个 patch')
+        return True
+
     @classmethod
     def initialize(cls):
-        cls.reload()
+        # sync point 是数据的源头, 总是从 DB 加载
+        if is_sync_point() or not cls.load_checkpoint():
+            cls.reload()
         cls.receiving_patch = True
 
     @classmethod
@@ -224,14 +394,19 @@ class RoamingSqlTable(IDataTable):
         return cls._df is not None
 
 
-class DBSqlTable(IDataTable):
+class DBSqlTable(SqlVersionMixin, IDataTable):
     """
     完全使用 DB 数据时, 基于 SQL 的表, 继承此类后重写 sql() 方法
+    获取 df 时先用 version_sql() 查数据版本, 版本变了才重新加载整张表; 两次检查之间至少间隔 DB_TABLE_REFRESH_INTERVAL 秒
     """
     _df : Optional[pd.DataFrame] = None
+    _version = None
+    _last_checked = 0
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
+        cls._version = None
+        cls._last_checked = 0
 
     @classmethod
     def get_df_no_copy(cls):
@@ -246,36 +421,58 @@ class DBSqlTable(IDataTable):
         pass        # DB 表无需 reload, 每次都会加载最新的
 
     @classmethod
-    def pull_diff_from_db(cls):
+    def pull_diff_from_db(cls, force=False):
         pass        # DB 表不同步 diff
 
     @classmethod
     def _is_df_changed(cls, current_df):
         """
-        注意此处是简单逐行比较的，DB 数据没变化不一定返回 False，因为没有 Order by 时 select 不保证顺序稳定.
-        但数据变化时一定会返回 True, 不会导致 ComputedTable 更新滞后.
+        只在查不到版本号时使用. 比较的是行的多重集合, 和行的顺序无关
         """
         if len(cls._df) != len(current_df):
             return True
-        return (cls._df.fillna(value=0) != current_df.fillna(value=0)).any().any()
+        if list(cls._df.columns) != list(current_df.columns):
+            return True
+        row_hashes = lambda df: pd.util.hash_pandas_object(PatchableDataFrame(df=df).df_indexing, index=False).sort_values().values
+        return not (row_hashes(cls._df) == row_hashes(current_df)).all()
 
     @classmethod
-    def _update_df_if_changed(cls, new_df):
-        if cls._df is None or cls._is_df_changed(current_df=new_df):
+    def _update_df_if_changed(cls, new_df, version=None):
+        if cls._df is None or (cls._is_df_changed(current_df=new_df) if version is None else version != cls._version):
             cls._df = new_df
             cls.update_timestamp()
             log_debug(f'更新了 DB Table [{cls.table_name}]')
+        cls._version = version
+
+    @classmethod
+    def _need_check(cls):
+        now = time.time()
+        if cls._df is not None and now - cls._last_checked < DB_TABLE_REFRESH_INTERVAL:
+            return False
+        cls._last_checked = now
+        return True
 
     @classmethod
     def before_get_df_hook(cls):
+        if not cls._need_check():
+            return
+        # 先查版本再加载数据, 中间数据有变化的话下次检查会再加载一次, 不会漏掉
+        version = cls._get_version()
+        if cls._df is not None and version is not None and version == cls._version:
+            return
         new_df = PatchableDataFrame.load_from_db(sql=cls.sql(), get_raw_df=True).drop(['query_timestamp'], axis='columns')
-        cls._update_df_if_changed(new_df)
+        cls._update_df_if_changed(new_df, version)
 
     @classmethod
     async def async_before_get_df_hook(cls):
+        if not cls._need_check():
+            return
+        version = await cls._async_get_version()
+        if cls._df is not None and version is not None and version == cls._version:
+            return
         new_df = await PatchableDataFrame.async_load_from_db(cls.sql(), columns=cls.columns, get_raw_df=True)
         new_df = new_df.drop(['query_timestamp'], axis='columns')
-        cls._update_df_if_changed(new_df)
+        cls._update_df_if_changed(new_df, version)
 
     @classmethod
     def initialized(cls):
@@ -304,23 +501,39 @@ class RoamingBaseTable(BaseTable, RoamingSqlTable):
 class ComputedTable(IDataTable):
     """
     本地计算得到的表, 继承此类后重写 compute() 方法
+    依赖表更新后, 第一次 get df 时重新计算; 同一时间只有一个线程在算, 其他线程等它算完直接用结果
+    如果重写了 compute_delta(), 依赖表只有增量 patch 时会用它来增量更新
     """
     _df: Optional[pd.DataFrame] = None
     is_computed = True
+    _compute_lock: Optional[Lock] = None
+    # 当前 df 是基于依赖表的哪个 timestamp 算出来的
+    _computed_for: Optional[Dict[str, float]] = None
 
     def __init_subclass__(cls, dependencies=None, **kwargs):
         dependencies = list(set(cls.collect(dependencies))) if dependencies is not None else []
         super().__init_subclass__(dependencies=dependencies, **kwargs)
+        cls._compute_lock = Lock()
+        cls._computed_for = {}
+        for dependant in cls.dependencies:
+            dependant.dependents.append(cls)
 
     @classmethod
     def collect(cls, tables: List[IDataTable]) -> Iterable[IDataTable]:
         """ 递归寻找依赖的所有 SQL 表, 类定义顺序保证了依赖关系一定是 DAG, 不需要判断循环依赖 """
         return chain(*[cls.collect(tb.dependencies) if tb.is_computed else [tb] for tb in tables])
 
+    @classmethod
+    def _is_outdated(cls):
+        return any(dependant.timestamp != cls._computed_for.get(dependant.table_name) for dependant in cls.dependencies)
+
     @classmethod
     def get_df_no_copy(cls):
-        if any(dependant.timestamp > cls.timestamp for dependant in cls.dependencies):
-            cls._recompute()
+        if cls._is_outdated():
+            with cls._compute_lock:
+                # 拿到锁之后再判断一次, 可能别的线程已经算好了
+                if cls._is_outdated():
+                    cls._recompute()
         return cls._df
 
     @classmethod
@@ -331,6 +544,14 @@ class ComputedTable(IDataTable):
         """
         raise NotImplementedError
 
+    @classmethod
+    def compute_delta(cls, df: pd.DataFrame, changes: Dict[str, List[Tuple[pd.DataFrame, pd.DataFrame]]]) -> Optional[pd.DataFrame]:
+        """
+        根据依赖表的增量变动 {table_name: [(to_del, to_add)]} 更新 df, 返回 None 表示不支持, 会回退到 compute().
+        df 是只读的, 不要原地修改; 计算过程中依赖表可能又有了新的变动, 下次会再收到一遍, 所以需要是幂等的, 一般按受影响的 key 重算.
+        """
+        return None
+
     @classmethod
     def before_get_df_hook(cls):
         for dependant in cls.dependencies:
@@ -347,24 +568,50 @@ class ComputedTable(IDataTable):
         pass        # Computed 表无需 reload, get df 时按需计算
 
     @classmethod
-    def pull_diff_from_db(cls):
+    def pull_diff_from_db(cls, force=False):
         pass        # Computed 表不同步 diff
 
+    @classmethod
+    def _compute_delta(cls, computed_for) -> Optional[pd.DataFrame]:
+        if cls._df is None:
+            return None
+        changes = {}
+        for dependant in cls.dependencies:
+            if (last_timestamp := cls._computed_for.get(dependant.table_name)) != computed_for[dependant.table_name]:
+                if last_timestamp is None or (table_changes := dependant.get_changes_since(last_timestamp)) is None:
+                    return None
+                changes[dependant.table_name] = table_changes
+        try:
+            return cls.compute_delta(cls._df, changes)
+        except Exception as e:
+            log_error(f'增量更新 computed view [{cls.table_name}] 失败, 全量重算', e)
+            return None
+
     @classmethod
     def _recompute(cls):
         try:
-            new_df = cls.compute()
+            # 先记下依赖表的 timestamp 再计算, 计算过程中依赖表有更新的话下次会再算一次
+            computed_for = {dependant.table_name: dependant.timestamp for dependant in cls.dependencies}
+            start = time.perf_counter()
+            mode = 'delta'
+            if (new_df := cls._compute_delta(computed_for)) is None:
+                mode = 'full'
+                new_df = cls.compute()
             with cls.lock:
                 cls._df = new_df
+                cls._computed_for = computed_for
             cls.update_timestamp()
-            log_debug(f'更新 computed view [{cls.table_name}] 完成')
+            cost = time.perf_counter() - start
+            USER_DATA_COMPUTE_SECONDS.labels(cls.table_name, mode).observe(cost)
+            log_debug(f'更新 computed view [{cls.table_name}] 完成, mode: {mode}, 耗时 {cost:.3f}s')
         except Exception as e:
             log_error(f'更新 computed view [{cls.table_name}] 失败!', e)
 
     @classmethod
     def initialize(cls):
         cls.before_get_df_hook()
-        cls._recompute()
+        with cls._compute_lock:
+            cls._recompute()
 
     @classmethod
     def initialized(cls):
@@ -378,6 +625,7 @@ class InMemoryTable(IDataTable):
     可以重写 `init_sql` 方法执行 SQL 从 DB 获取初始 dataframe 的内容, 如获取全部 username 等.
     """
     _df: Optional[pd.DataFrame] = None
+    _indexes: dict = None
     primary_key_columns = None
     data_birth_time: datetime = None
     patch_buffer: list = []
@@ -388,6 +636,7 @@ class InMemoryTable(IDataTable):
         super().__init_subclass__(dependencies=dependencies, **kwargs)
         cls.primary_key_columns = primary_key_columns
         cls.patch_buffer = []
+        cls._indexes = {}
         assert len(absent:= [col for col in cls.primary_key_columns if col not in cls.columns]) == 0, \
             f'{cls.__name__} 表的主键列 {absent} 不存在于 columns 中!'
 
@@ -395,6 +644,18 @@ class InMemoryTable(IDataTable):
     def get_df_no_copy(cls):
         return cls._df
 
+    @classmethod
+    def _get_indexed_df(cls):
+        with cls.lock:
+            return cls._df, cls._indexes
+
+    @classmethod
+    def _set_df(cls, df):
+        # 内存表的 patch 是按主键合并的, 行号会整体变化, 索引直接重建
+        indexes = {column: build_hash_index(df[column]) for column in cls.index_columns}
+        with cls.lock:
+            cls._df, cls._indexes = df, indexes
+
     @classmethod
     def init_sql(cls) -> Optional[str]:
         pass
@@ -412,16 +673,17 @@ class InMemoryTable(IDataTable):
             df = cls._df.set_index(cls.primary_key_columns)
             df = to_add.combine_first(df)                 # 修改或增加行
             df = df.drop(delete_index, errors='ignore')   # 删除行, 数据不一定是一致的, 找不到要删的 index 不报错
-            cls._df = df.reset_index()
+            df = df.reset_index()
+            cls._df, cls._indexes = df, {column: build_hash_index(df[column]) for column in cls.index_columns}
         cls.update_timestamp(patch.get('timestamp', time.time()))
 
     @classmethod
     def init_from_scratch(cls):
         try:
             if (sql := cls.init_sql()) is not None:
-                cls._df = PatchableDataFrame.load_from_db(sql=sql, get_raw_df=True).drop(['query_timestamp'], axis='columns')
+                cls._set_df(PatchableDataFrame.load_from_db(sql=sql, get_raw_df=True).drop(['query_timestamp'], axis='columns'))
             else:
-                cls._df = pd.DataFrame(columns=cls.columns)
+                cls._set_df(pd.DataFrame(columns=cls.columns))
             cls.data_birth_time = datetime.now()
         except Exception as e:
             log_error(f'initialized in-mem table {cls.__name__} failed', exception=e)
@@ -442,7 +704,7 @@ class InMemoryTable(IDataTable):
             cls.init_from_scratch()
         else:
             init_data = pickle.loads(init_data[1])
-            cls._df = init_data.get('data')
+            cls._set_df(init_data.get('data'))
             cls.data_birth_time = init_data.get('birth_time')
             cls.update_timestamp(init_data.get('timestamp'))
             log_info(f'从 {init_data.get("from")} 获取到了 {cls.table_name} 表的初始化数据, ' +
@@ -465,5 +727,5 @@ class InMemoryTable(IDataTable):
         pass
 
     @classmethod
-    def pull_diff_from_db(cls):
+    def pull_diff_from_db(cls, force=False):
         pass
@@ -2,11 +2,13 @@ import pickle
 import time
 import uuid
 from threading import Thread
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 from conf import CONF
+from db import redis_conn
 from roman_parliament.backends.message_queue import RedisMulticastMQ
 from .utils import log_debug, log_info, log_error
+from .wire_format import encode_patches, decode_patches, encode_checkpoint, decode_checkpoint
 
 if TYPE_CHECKING:
     from .user_data import UserData
@@ -14,6 +16,9 @@ if TYPE_CHECKING:
 
 class MessageType:
     PATCH = 'patch'
+    # 紧凑编码的 patch, 收到后解码成 PATCH 处理; 不认识这个类型的老版本进程会直接忽略,
+    # 所以发送端默认不用, 等所有进程都升级到能解码的版本之后再打开 user_data_roaming.compact_patch
+    COMPACT_PATCH = 'cpatch'
     SYNC = 'sync'
     RELOAD = 'reload'
     IN_MEM_REQUEST = 'in_mem_req'
@@ -22,16 +27,63 @@ class MessageType:
 class MessageQueue:
     origin_id = str(uuid.uuid4())
     channel = CONF.user_data_roaming.message_queue_channel
+    expire = 3600
+    compact_patch = CONF.try_get('user_data_roaming.compact_patch', default=False)
+
+    @classmethod
+    def schemas(cls):
+        from .table_config import TABLES
+        return {table_name: table.columns for table_name, table in TABLES.items()}
+
+    @classmethod
+    def decode(cls, data) -> dict:
+        msg = pickle.loads(data)
+        if msg.get('type') == MessageType.COMPACT_PATCH:
+            msg['type'], msg['data'] = MessageType.PATCH, decode_patches(msg['data'], cls.schemas())
+        return msg
 
     @classmethod
     def listen(cls):
         for data in RedisMulticastMQ.listen_channel(channel=cls.channel):
-            yield pickle.loads(data)
+            yield cls.decode(data)
 
     @classmethod
     def send(cls, type, data):
+        if type == MessageType.PATCH and cls.compact_patch:
+            type, data = MessageType.COMPACT_PATCH, encode_patches(data, cls.schemas())
         msg = {'type': type, 'data': data, 'origin': cls.origin_id}
-        RedisMulticastMQ.send_channel(data=pickle.dumps(msg), channel=cls.channel, expire=3600)
+        RedisMulticastMQ.send_channel(data=pickle.dumps(msg), channel=cls.channel, expire=cls.expire)
+
+    @classmethod
+    def current_index(cls) -> int:
+        index = redis_conn.get(f'{cls.channel}_index')
+        return 0 if index is None else int(index)
+
+    @classmethod
+    def read_patches(cls, start, end, table_name) -> Optional[list]:
+        """
+        读取 [start, end) 之间某张表的 patch, 有消息已经过期时返回 None
+        """
+        patches = []
+        for index in range(start, end):
+            if (data := redis_conn.get(f'{cls.channel}:{index}')) is None:
+                return None
+            msg = cls.decode(data)
+            if msg.get('type') == MessageType.PATCH:
+                patches += [patch for patch in msg['data'] if patch['table_name'] == table_name]
+        return patches
+
+    @classmethod
+    def write_checkpoint(cls, table_name, df, timestamp, mq_index, expire):
+        data = encode_checkpoint(table_name, df, cls.schemas().get(table_name), timestamp, mq_index, created_at=time.time())
+        redis_conn.set(f'{cls.channel}:checkpoint:{table_name}', data, ex=expire)
+        return len(data)
+
+    @classmethod
+    def read_checkpoint(cls, table_name) -> Optional[dict]:
+        if (data := redis_conn.get(f'{cls.channel}:checkpoint:{table_name}')) is None:
+            return None
+        return decode_checkpoint(data, cls.schemas().get(table_name))
 
 
 class WatchThread(Thread):
@@ -4,6 +4,7 @@ import pandas as pd
 import sqlalchemy
 
 from db import MarsDB
+from .snapshot import build_hash_index, update_hash_index
 
 
 class PatchConflictException(Exception):
@@ -19,9 +20,12 @@ class PatchableDataFrame(object):
                         用于防止从数据库拉取最新数据后再收到的过时 patch 被应用.
             df_indexing: - list, dict 等 unhashable 类型不能用于比较 diff, 因此转为 string 来比较;
                          - 而逆向转换很难做, 也费时间, 所以同时保留原始的 df 和转换后的 df_indexing
+            indexes: build_indexes 之后维护的列值 -> index label 的哈希索引, apply_patch 时增量更新;
+                     为了让 label 稳定, apply_patch 不会 reset_index, 新加的行用新的 label
         """
         self.df = df
         self.timestamp = timestamp
+        self.indexes = {}
         if df_indexing is None:
             self.df_indexing = df.copy()
             obj_columns = df.columns[df.dtypes == object]
@@ -50,6 +54,10 @@ class PatchableDataFrame(object):
         df = pd.DataFrame(result, columns=columns + ['query_timestamp'])
         return df if get_raw_df else cls.from_df(df)
 
+    def build_indexes(self, columns):
+        self.indexes = {column: build_hash_index(self.df[column]) for column in columns or []}
+        return self
+
     def index_select(self, indices):
         return PatchableDataFrame(df=self.df.loc[indices].copy(),
                                   df_indexing=self.df_indexing.loc[indices].copy(),
@@ -76,10 +84,19 @@ class PatchableDataFrame(object):
         try:
             # remove rows to delete && add new rows
             keep_indices = merge_w_to_del[merge_w_to_del._merge == 'left_only']['index'].dropna().astype(int)
+            del_indices = merge_w_to_del[merge_w_to_del._merge == 'both']['index'].dropna().astype(int)
+            start = self.df.index.max() + 1 if len(self.df) > 0 else 0
+            new_indices = pd.RangeIndex(start, start + len(to_add.df))
+            to_add_df = to_add.df.set_axis(new_indices, axis='index')
+            indexes = {
+                column: update_hash_index(index, self.df.loc[del_indices, column], to_add_df[column])
+                for column, index in self.indexes.items()
+            }
             df = self.df.loc[keep_indices].copy()
-            self.df = pd.concat([df, to_add.df]).reset_index(drop=True)
             df_indexing = self.df_indexing.loc[keep_indices].copy()
-            self.df_indexing = pd.concat([df_indexing, to_add.df_indexing]).reset_index(drop=True)
+            self.df = pd.concat([df, to_add_df])
+            self.df_indexing = pd.concat([df_indexing, to_add.df_indexing.set_axis(new_indices, axis='index')])
+            self.indexes = indexes
         except Exception as e:
             # 可能是表字段改变等 corner case, raise 后直接从数据库重新拉数据
             raise PatchConflictException(f'添加/删除 rows 时出错: {e}') from e
@@ -6,6 +6,7 @@ import pandas as pd
 
 from .data_table import IDataTable
 from .data_table import RoamingBaseTable, DBBaseTable, RoamingSqlTable, DBSqlTable
+from .snapshot import DataFrameSnapshot
 
 
 """
@@ -38,24 +39,31 @@ def spawn_private_table(public_cls, enable_parliament):
     public_cls.private_table = private_cls
     # noinspection PyUnresolvedReferences
     public_cls.get_df = public_cls.private_table.get_df
+    # noinspection PyUnresolvedReferences
+    public_cls.get_snapshot = public_cls.private_table.get_snapshot
 
 
 class PublicDataTable:
     # 外部访问的接口, 在 ./table_injections.py 中定义并设置, 否则会有循环依赖问题, 这里仅设置类型方便代码补全
     df: Optional[pd.DataFrame] = None
     async_df: Optional[Awaitable[pd.DataFrame]] = None
+    # 只读快照, 不复制数据, 只读的场景 (特别是按列值查单行) 优先用这个
+    snapshot: Optional[DataFrameSnapshot] = None
+    async_snapshot: Optional[Awaitable[DataFrameSnapshot]] = None
     modify: Optional[Callable[[], ContextManager[Tuple[pd.DataFrame, Callable[[pd.DataFrame], None]]]]] = None
 
     # private table 的一些属性或方法, 外部代码可能会引用
     table_name: str = None
     columns: List[str] = None
     private_key_columns: List[str] = None
+    index_columns: List[str] = None
 
     # private table 相关
     table_cls: Optional[Type[IDataTable]] = None
     init_kwargs: Dict = None
     private_table: Optional[Type[IDataTable]] = None
     get_df: Callable[[], pd.DataFrame] = None
+    get_snapshot: Callable[[], DataFrameSnapshot] = None
 
     def __init_subclass__(cls, table_cls=None, **kwargs):
         cls.table_cls = table_cls
@@ -63,3 +71,4 @@ class PublicDataTable:
         cls.table_name = kwargs.get('table_name')
         cls.columns = kwargs.get('columns')
         cls.private_key_columns = kwargs.get('private_key_columns')
+        cls.index_columns = kwargs.get('index_columns')
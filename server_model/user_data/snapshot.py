@@ -0,0 +1,107 @@
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+HashIndex = Dict[Any, Tuple]
+
+
+def build_hash_index(series: pd.Series) -> HashIndex:
+    """
+    列值 -> 所在行的 index label
+    """
+    index = {}
+    for label, value in zip(series.index.tolist(), series.tolist()):
+        index.setdefault(value, []).append(label)
+    return {value: tuple(labels) for value, labels in index.items()}
+
+
+def update_hash_index(index: HashIndex, removed: pd.Series, added: pd.Series) -> HashIndex:
+    """
+    返回更新后的新索引, 不修改原来的索引 (旧的 snapshot 可能还在用)
+    """
+    index = dict(index)
+    for label, value in zip(removed.index.tolist(), removed.tolist()):
+        if (labels := tuple(l for l in index.get(value, ()) if l != label)):
+            index[value] = labels
+        else:
+            index.pop(value, None)
+    for label, value in zip(added.index.tolist(), added.tolist()):
+        index[value] = index.get(value, ()) + (label, )
+    return index
+
+
+def freeze_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    返回 df 的一个只读浅拷贝, 原地修改 (df.loc[...] = x 之类) 会直接报错, 传进来的 df 本身不受影响
+    浅拷贝的 block 和 df 共用同一个 ndarray 对象, 所以要换成各自的 view 再设只读, 不能直接改 df 的数组 (表自己还要写)
+    pandas 没有公开的接口, 这里用到了 df._mgr.blocks 和 block.values, 按 pandas 1.4 (requirements.txt) 的实现写的,
+    pandas 2 / 3 里这两个属性也还在; 开了 copy-on-write 的版本里原地修改本来就不会影响 snapshot
+    注意 object 列里的 list / dict 本身仍然是可变的, 不要去改
+    """
+    frozen = df.copy(deep=False)
+    for block in frozen._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values = block.values.view()
+            block.values.flags.writeable = False
+    return frozen
+
+
+class DataFrameSnapshot(object):
+    """
+    某个版本的表数据的只读快照, df 被替换时 (reload / patch / recompute) 才会生成新的 snapshot, 旧的 snapshot 不受影响
+        - df: 浅拷贝, 不复制数据, 可以随意加列 / 过滤, 但不能原地修改数据
+        - copy(): 需要修改数据时显式深拷贝
+        - select / records / first: 按列值查行, 表声明了 index_columns 的列直接用表维护的索引, 其他列在第一次查询时建立索引
+    """
+
+    def __init__(self, df: pd.DataFrame, version: int, indexes: Optional[Dict[str, HashIndex]] = None):
+        self.source = df
+        self.version = version
+        self._df = freeze_df(df)
+        # 表维护的索引存的是 index label, 这里临时建立的索引存的是行号
+        self._label_indexes: Dict[str, HashIndex] = dict(indexes or {})
+        self._position_indexes: Dict[str, HashIndex] = {}
+
+    @property
+    def df(self) -> pd.DataFrame:
+        df = self._df.copy(deep=False)
+        # 议会表内部的 index label 是稳定的, 不连续, 对外统一成 RangeIndex
+        df.index = pd.RangeIndex(len(df))
+        return df
+
+    def copy(self) -> pd.DataFrame:
+        return self.df.copy()
+
+    def __len__(self):
+        return len(self._df)
+
+    def _get_index(self, column) -> Tuple[HashIndex, bool]:
+        if (index := self._label_indexes.get(column)) is not None:
+            return index, True
+        if (index := self._position_indexes.get(column)) is None:
+            index = build_hash_index(pd.Series(self._df[column].values))
+            self._position_indexes[column] = index
+        return index, False
+
+    def select(self, column, values: Iterable) -> pd.DataFrame:
+        """
+        返回 column 在 values 里的行, 返回的是拷贝
+        """
+        index, by_label = self._get_index(column)
+        keys = sorted(key for value in set(values) for key in index.get(value, ()))
+        return (self._df.loc[keys] if by_label else self._df.iloc[keys]).reset_index(drop=True)
+
+    def records(self, column, value) -> List[dict]:
+        """
+        返回 column == value 的所有行, 格式和 df.to_dict('records') 一致
+        """
+        if not self._get_index(column)[0].get(value):
+            return []
+        return self.select(column, [value]).to_dict('records')
+
+    def first(self, column, value) -> Optional[dict]:
+        records = self.records(column, value)
+        return records[0] if records else None
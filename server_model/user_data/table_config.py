@@ -2,6 +2,7 @@
 
 import inspect
 import time
+from itertools import chain
 from typing import Dict, Type, List
 
 import pandas as pd
@@ -25,6 +26,7 @@ class UserTable(PublicDataTable,
     table_name='user',
     # 注意用户表未将 last activity 加入议会, 这一列更新太频繁, 而且只有一个时效性要求很低的 API 用到, 可以直接查从库
     columns=["user_id", "user_name", "token", "role", "active", "shared_group", "nick_name"],
+    index_columns=["user_name", "token"],
 ):
     pass
 
@@ -33,6 +35,7 @@ class UserAccessTokenTable(PublicDataTable,
     table_cls=AutoTable.AutoBaseTable,
     table_name='user_access_token',
     columns=["from_user_name", "access_user_name", "access_token", "access_scope", "expire_at", "created_at", "updated_at", "created_by", "deleted_by", "active"],
+    index_columns=["access_token"],
 ):
     pass
 
@@ -41,6 +44,7 @@ class QuotaTable(PublicDataTable,
     table_cls=AutoTable.AutoSqlTable,
     table_name='quota',
     columns=["user_name", "resource", "quota", "expire_time"],
+    index_columns=["user_name"],
 ):
     _sql = r'''
             select
@@ -139,6 +143,16 @@ class UserWithAllGroupsTable(PublicDataTable,
         user_df, user_group_df = UserTable.get_df(), UserAllGroupsTable.get_df()
         return pd.merge(user_df, user_group_df, how='left', on='user_name')
 
+    @classmethod
+    def compute_delta(cls, df, changes):
+        # 只重算变动涉及的用户
+        user_names = list(set(chain(*[
+            [*to_del.user_name, *to_add.user_name] for table_changes in changes.values() for to_del, to_add in table_changes
+        ])))
+        user_df, user_group_df = UserTable.get_snapshot().df, UserAllGroupsTable.get_snapshot().df
+        changed_df = pd.merge(user_df[user_df.user_name.isin(user_names)], user_group_df[user_group_df.user_name.isin(user_names)], how='left', on='user_name')
+        return pd.concat([df[~df.user_name.isin(user_names)], changed_df], ignore_index=True)
+
     @classmethod
     @sync_point_only
     def update_hook(cls):
@@ -152,13 +166,29 @@ class UserAllQuotaTable(PublicDataTable,
     dependencies=[QuotaTable, UserAllGroupsTable],
 ):
     @classmethod
-    def compute(cls):
-        quota_df, user_group_df = QuotaTable.get_df(), UserAllGroupsTable.get_df()
-        user_group_df.user_groups += user_group_df.user_name.apply(lambda x: [x])
+    def merge_quota(cls, quota_df, user_group_df):
+        user_group_df = user_group_df.assign(user_groups=user_group_df.user_groups + user_group_df.user_name.apply(lambda x: [x]))
         merged_df = user_group_df.explode('user_groups') \
             .merge(quota_df, how='inner', left_on='user_groups', right_on='user_name', suffixes=('', '_quota'))
         return merged_df.rename({'user_groups': 'hit_group'}, axis='columns').drop(['user_name_quota'], axis='columns')
 
+    @classmethod
+    def compute(cls):
+        return cls.merge_quota(QuotaTable.get_df(), UserAllGroupsTable.get_df())
+
+    @classmethod
+    def compute_delta(cls, df, changes):
+        # 用户的组变了: 重算这个用户的所有行; 某个用户 / 组的 quota 变了: 重算 hit_group 是它的行
+        user_names = list(set(chain(*[[*to_del.user_name, *to_add.user_name] for to_del, to_add in changes.get(UserAllGroupsTable.table_name, [])])))
+        quota_names = list(set(chain(*[[*to_del.user_name, *to_add.user_name] for to_del, to_add in changes.get(QuotaTable.table_name, [])])))
+        quota_df, user_group_df = QuotaTable.get_snapshot().df, UserAllGroupsTable.get_snapshot().df
+        changed_users = user_group_df.user_name.isin(user_names)
+        return pd.concat([
+            df[~df.user_name.isin(user_names) & ~df.hit_group.isin(quota_names)],
+            cls.merge_quota(quota_df, user_group_df[changed_users]),
+            cls.merge_quota(quota_df[quota_df.user_name.isin(quota_names)], user_group_df[~changed_users]),
+        ], ignore_index=True)
+
     @classmethod
     @sync_point_only
     def update_hook(cls):
@@ -27,6 +27,16 @@ class AsyncDfDescriptor:
         return get_user_data_instance().async_get_df(obj_type.table_name)
 
 
+class SnapshotDescriptor:
+    def __get__(self, obj, obj_type):
+        return get_user_data_instance().get_snapshot(obj_type.table_name)
+
+
+class AsyncSnapshotDescriptor:
+    def __get__(self, obj, obj_type):
+        return get_user_data_instance().async_get_snapshot(obj_type.table_name)
+
+
 class DiffRecorder:
     def __init__(self, table_cls: Type[PublicDataTable]):
         self.cls = table_cls.private_table
@@ -61,4 +71,6 @@ def modify(cls: Type[PublicDataTable]):
 
 PublicDataTable.df = DfDescriptor()
 PublicDataTable.async_df = AsyncDfDescriptor()
+PublicDataTable.snapshot = SnapshotDescriptor()
+PublicDataTable.async_snapshot = AsyncSnapshotDescriptor()
 PublicDataTable.modify = modify
@@ -4,21 +4,28 @@ import os
 import pickle
 import threading
 import time
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
-from typing import Dict, Optional, Type, Union
+from typing import Dict, Optional, Tuple, Type, Union
 
 import ujson
+from prometheus_client import Gauge, Histogram
 
 from conf import CONF
 from db import redis_conn
-from .data_table import IDataTable, InMemoryTable
+from .data_table import IDataTable, InMemoryTable, RoamingSqlTable
 from .table_config import TABLES, UserTable
 from .mq_utils import MessageQueue, MessageType
 from .utils import log_debug, log_info, log_error, log_warning, acquired_lock_file, sync_point_only
 
 
+USER_DATA_SYNC_PENDING_TABLES = Gauge('user_data_sync_pending_tables', 'sync point 等待同步的表的个数')
+USER_DATA_SYNC_LATENCY = Histogram(
+    'user_data_sync_latency_seconds', 'sync point 从收到同步请求到同步完成的耗时', ['trigger'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+
+
 class UserDataBase(object):
     def __init__(self):
         self._subscribed_tables = []
@@ -46,6 +53,20 @@ class UserDataBase(object):
         self._subscribe_if_not(table_name)
         return self._async_get_df(table_name)
 
+    def _get_snapshot(self, table_name):
+        raise NotImplementedError
+
+    async def _async_get_snapshot(self, table_name):
+        raise NotImplementedError
+
+    def get_snapshot(self, table_name):
+        self._subscribe_if_not(table_name)
+        return self._get_snapshot(table_name)
+
+    def async_get_snapshot(self, table_name):
+        self._subscribe_if_not(table_name)
+        return self._async_get_snapshot(table_name)
+
     def _subscribe_single_table(self, table_name):
         if table_name not in self._subscribed_tables:
             self._subscribed_tables.append(table_name)
@@ -88,6 +109,14 @@ class DBUserData(UserDataBase):
         await TABLES[table_name].async_before_get_df_hook()
         return TABLES[table_name].get_df()
 
+    def _get_snapshot(self, table_name):
+        TABLES[table_name].before_get_df_hook()
+        return TABLES[table_name].get_snapshot()
+
+    async def _async_get_snapshot(self, table_name):
+        await TABLES[table_name].async_before_get_df_hook()
+        return TABLES[table_name].get_snapshot()
+
     def _subscribe_single_table(self, table_name):
         if issubclass(TABLES[table_name], InMemoryTable):
             raise Exception(f'当前进程中 UserData 不接入议会, 无法读写纯议会内存表 [{table_name}]')
@@ -108,10 +137,24 @@ class UserData(UserDataBase):
     def init_sync_point(self):
         log_info('初始化 Sync point')
         self._sync_thread = ThreadPoolExecutor(max_workers=1)   # 串行执行 sync 操作
-        self._last_sync_signal_ts = defaultdict(lambda: 0)
-        self._throttling_cnt = defaultdict(lambda : 0)
+        # 等待同步的表: table_name -> (第一次收到请求的时间, trigger)
+        self._pending_sync: Dict[str, tuple] = {}
+        self._last_sync_signal_time = 0
+        self._sync_cond = threading.Condition()
+        self._sync_throttling_time = CONF.user_data_roaming.get('sync_throttling_time', 0.1)
+        # 一直有新的 sync 信号时, 最多推迟这么多次 throttling_time 就必须同步
         self._max_throttling_time = CONF.user_data_roaming.get('max_num_throttling', 5)
+        # 定时全量同步的间隔, 连续没有变化时翻倍, 直到 max_sync_interval; 有变化或者收到 sync 信号时恢复
+        self._base_sync_interval = CONF.user_data_roaming.get('sync_interval', 1.0)
+        self._max_sync_interval = CONF.user_data_roaming.get('max_sync_interval', 10.0)
+        self._sync_interval = self._base_sync_interval
+        self._last_full_sync = 0
+        # 定时同步至少每 max_sync_interval 做一次不按版本跳过的 diff, 修复本地 df 和 DB 的不一致
+        self._last_forced_sync = 0
+        self._force_sync_tables = set()
         self._pending_reload = None
+        self._checkpoint_interval = CONF.try_get('user_data_roaming.checkpoint.interval', default=60)
+        self._last_checkpoint = 0
         while len(self._tables) != len(TABLES):
             log_warning('未成功订阅所有表, 阻塞等待并重试订阅.')     # 可能 DB 还没起来, sync point 必须订阅全部的表才能启动
             self.subscribe_tables(list(TABLES.keys()))
@@ -119,22 +162,41 @@ class UserData(UserDataBase):
         self.user_last_activity_in_ns = {user: time.time_ns() for user in UserTable.df.user_name.tolist()}
         self.shared_group_last_activity_in_ns = {group: time.time_ns() for group in set(UserTable.df.shared_group.tolist())}
         Thread(target=self._sync_timer, daemon=True).start()
+        Thread(target=self._sync_scheduler, daemon=True).start()
         Thread(target=self._redis_dumper, daemon=True).start()
         Thread(target=self._last_activity_modifier, daemon=True).start()
         self.signal_reload("SyncPoint 重启")
 
     def _sync_timer(self):
         while True:
-            time.sleep(CONF.user_data_roaming.get('sync_interval', 1.0))
+            time.sleep(self._base_sync_interval)
             try:
-                self.sync_from_db()
+                if time.time() - self._last_full_sync >= self._sync_interval:
+                    self._last_full_sync = time.time()
+                    force = self._last_full_sync - self._last_forced_sync >= self._max_sync_interval
+                    if force:
+                        self._last_forced_sync = self._last_full_sync
+                    self.sync_from_db(trigger='timer', force=force)
                 if self._pending_reload is not None:
                     self.signal_reload(self._pending_reload)
                     self._pending_reload = None
+                if time.time() - self._last_checkpoint > self._checkpoint_interval:
+                    self._last_checkpoint = time.time()
+                    self._sync_thread.submit(self._write_checkpoints).add_done_callback(self._sync_callback)
             except Exception as e:  # 兜底, 这个线程不能挂, 否则议会可能丢数据
                 log_error('Sync from db 出错', e, fetion_interval=60)
                 time.sleep(1)
 
+    def _write_checkpoints(self):
+        """ 在 sync 线程中执行, 给新启动的进程初始化议会表用 """
+        for table in self._tables.values():
+            if issubclass(table, RoamingSqlTable):
+                try:
+                    size = table.write_checkpoint()
+                    log_debug(f'写入 table [{table.table_name}] 的 checkpoint, {size} bytes')
+                except Exception as e:
+                    log_error(f'写入 table [{table.table_name}] 的 checkpoint 失败', e, fetion_interval=600)
+
     def _last_activity_modifier(self):
         while True:
             try:
@@ -153,6 +215,14 @@ class UserData(UserDataBase):
 
     def _redis_dumper(self):
         """ 仅在 sync point 进程中开线程执行 """
+        # 上次写入 redis 的内容, 没有变化时不重复写
+        dumped = {}
+
+        def set_if_changed(key, result):
+            if dumped.get(key) != (value := ujson.dumps(result)):
+                redis_conn.set(key, value)
+                dumped[key] = value
+
         while True:
             time.sleep(1)
             # 将最近有活动的用户 dump 到 redis 中
@@ -162,22 +232,23 @@ class UserData(UserDataBase):
                     for user_name, time_ns in self.user_last_activity_in_ns.items() if isinstance(user_name, str)
                 ]
                 result.sort(key=lambda x: x['ts'], reverse=True)
-                redis_conn.set('user_last_activity_in_ns', ujson.dumps(result))
+                set_if_changed('user_last_activity_in_ns', result)
                 result = [{**r, 'ts': str(r['ts'])} for r in result]
-                redis_conn.set('user_last_activity_in_ns_str', ujson.dumps(result))
+                set_if_changed('user_last_activity_in_ns_str', result)
                 shared_group_result = [
                     {'ts': int(time_ns), 'shared_group': shared_group}
                     for shared_group, time_ns in self.shared_group_last_activity_in_ns.items()
                 ]
                 shared_group_result.sort(key=lambda x: x['ts'], reverse=True)
-                redis_conn.set('shared_group_last_activity_in_ns', ujson.dumps(shared_group_result))
+                set_if_changed('shared_group_last_activity_in_ns', shared_group_result)
                 shared_group_result = [{**r, 'ts': str(r['ts'])} for r in shared_group_result]
-                redis_conn.set('shared_group_last_activity_in_ns_str', ujson.dumps(shared_group_result))
+                set_if_changed('shared_group_last_activity_in_ns_str', shared_group_result)
                 # 主动更新一下 computed tables, 以便内容有更新时触发其注册的 update_hook, 目前用于 `UserWithAllGroupsTable` 的 update 时间戳更新
                 for table in self._tables.values():
                     if table.is_computed:
                         self._get_df(table.table_name)
             except Exception as e:
+                dumped.clear()
                 log_error(f'dump user last activity failed: {e}', exception=e, fetion_interval=60)
 
     def _get_df(self, table_name):
@@ -188,30 +259,65 @@ class UserData(UserDataBase):
         await self._tables[table_name].async_before_get_df_hook()
         return self._tables[table_name].get_df()
 
-    def _make_patches(self, table_names: set) -> list:
+    def _get_snapshot(self, table_name):
+        self._tables[table_name].before_get_df_hook()
+        return self._tables[table_name].get_snapshot()
+
+    async def _async_get_snapshot(self, table_name):
+        await self._tables[table_name].async_before_get_df_hook()
+        return self._tables[table_name].get_snapshot()
+
+    def _make_patches(self, table_names: set, force_tables: set = frozenset()) -> list:
         patches = []
         for table_name in table_names:
-            self._throttling_cnt[table_name] = 0
-            if (patch := self._tables[table_name].pull_diff_from_db()) is not None:
+            if (patch := self._tables[table_name].pull_diff_from_db(force=table_name in force_tables)) is not None:
                 patches.append(patch)
         return patches
 
-    def _sync_from_db(self, signal_ts, tables_to_sync=None):
-        throttled_tables = set(
-            table for table in tables_to_sync
-            if self._last_sync_signal_ts[table] != signal_ts and self._throttling_cnt[table] < self._max_throttling_time
-        )
-        if len(tables_to_sync:= set(tables_to_sync) - throttled_tables):
-            patches = self._make_patches(table_names=tables_to_sync)
-            if len(patches) > 0:
-                log_info(f'从 DB 同步表 {tables_to_sync}, 有差异的表: {[p["table_name"] for p in patches]}')
-            else:
-                log_debug(f'从 DB 同步表 {tables_to_sync}, 无变化')
-            self.patch(patches, broadcast=True)
-        if len(throttled_tables) > 0:
-            log_debug(f'Sync signals are throttled for table: {throttled_tables}')
-            for table in throttled_tables:
-                self._throttling_cnt[table] += 1
+    def _sync_from_db(self, tables_to_sync, force_tables: set = frozenset()) -> list:
+        patches = self._make_patches(table_names=tables_to_sync, force_tables=force_tables)
+        if len(patches) > 0:
+            log_info(f'从 DB 同步表 {tables_to_sync}, 有差异的表: {[p["table_name"] for p in patches]}')
+        else:
+            log_debug(f'从 DB 同步表 {tables_to_sync}, 无变化')
+        self.patch(patches, broadcast=True)
+        return patches
+
+    def _wait_for_sync_batch(self) -> Tuple[Dict[str, tuple], set]:
+        """
+        合并一段时间内的 sync 请求: 最后一个请求之后 throttling_time 内没有新请求,
+        或者最早的请求已经等了 throttling_time * (max_num_throttling + 1), 就取出所有等待中的表一起同步
+        :return: 等待中的表, 其中需要 force diff 的表
+        """
+        with self._sync_cond:
+            while len(self._pending_sync) == 0:
+                self._sync_cond.wait()
+            max_wait = self._sync_throttling_time * (self._max_throttling_time + 1)
+            while (timeout := min(
+                self._last_sync_signal_time + self._sync_throttling_time,
+                min(first_ts for first_ts, _ in self._pending_sync.values()) + max_wait
+            ) - time.time()) > 0:
+                self._sync_cond.wait(timeout)
+            pending, self._pending_sync = self._pending_sync, {}
+            force_tables, self._force_sync_tables = self._force_sync_tables, set()
+            USER_DATA_SYNC_PENDING_TABLES.set(0)
+            return pending, force_tables
+
+    def _sync_scheduler(self):
+        while True:
+            try:
+                pending, force_tables = self._wait_for_sync_batch()
+                patches = self._sync_thread.submit(self._sync_from_db, tables_to_sync=set(pending), force_tables=force_tables).result()
+                now = time.time()
+                for trigger in set(t for _, t in pending.values()):
+                    USER_DATA_SYNC_LATENCY.labels(trigger).observe(now - min(ts for ts, t in pending.values() if t == trigger))
+                if len(patches) > 0:
+                    self._sync_interval = self._base_sync_interval
+                elif all(t == 'timer' for _, t in pending.values()):
+                    self._sync_interval = min(self._sync_interval * 2, self._max_sync_interval)
+            except Exception as e:  # 兜底, 这个线程不能挂, 否则议会可能丢数据
+                log_error('Sync from db 出错: 执行 sync 出错', e, fetion_interval=60)
+                time.sleep(1)
 
     def _expand_table_list(self, tables: Optional[list]) -> list:
         table_set = set(tables)
@@ -264,17 +370,26 @@ class UserData(UserDataBase):
             log_error('Sync from db 出错: 执行 sync 出错', worker.exception())
 
     @sync_point_only
-    def sync_from_db(self, tables_to_sync=None):
+    def sync_from_db(self, tables_to_sync=None, trigger='signal', force=False):
+        """
+        只是把表加入等待队列, 由 _sync_scheduler 合并之后串行同步
+        :param force: 同步时不按 DB 版本跳过 diff
+        """
         tables_to_sync = self._expand_table_list(tables_to_sync) if tables_to_sync is not None else self._subscribed_tables
-        ts = int(time.time() * 10000)
-        for table in tables_to_sync:
-            self._last_sync_signal_ts[table] = ts
-        # throttling_time 时间内没有其他 sync signal 则处理本次 signal, 否则处理更新的 sync signal
-        threading.Timer(
-            CONF.user_data_roaming.get('sync_throttling_time', 0.1),
-            lambda: self._sync_thread.submit(self._sync_from_db, signal_ts=ts,
-                                             tables_to_sync=tables_to_sync).add_done_callback(self._sync_callback)
-        ).start()
+        now = time.time()
+        with self._sync_cond:
+            for table in tables_to_sync:
+                first_ts, pending_trigger = self._pending_sync.get(table, (now, trigger))
+                # 同时有定时同步和 sync 信号时算作 signal
+                self._pending_sync[table] = (first_ts, 'signal' if 'signal' in (trigger, pending_trigger) else 'timer')
+            if force:
+                self._force_sync_tables.update(tables_to_sync)
+            self._last_sync_signal_time = now
+            if trigger == 'signal':
+                # 有写入了, 定时同步恢复到基础间隔
+                self._sync_interval = self._base_sync_interval
+            USER_DATA_SYNC_PENDING_TABLES.set(len(self._pending_sync))
+            self._sync_cond.notify()
 
     def signal_sync_point(self, changed_tables=None):
         MessageQueue.send(MessageType.SYNC, changed_tables)
@@ -0,0 +1,53 @@
+"""
+用户已用节点 quota 的内存视图
+scheduler 的 bff subscriber (ProcessUnitUsedQuota) 每个 tick 都会把所有用户已用的节点 quota 写到 redis,
+这里在进程内缓存一份, 查询时不用再去 DB 里 select task_ng
+"""
+
+
+import os
+import time
+from typing import Optional
+
+import ujson
+
+from conf import CONF
+from db import a_redis
+from logm import logger
+
+
+class UsedQuotaView(object):
+    # 多久从 redis 刷新一次
+    refresh_interval = CONF.try_get('user_quota.used_quota_view.refresh_interval', default=1.0)
+    # scheduler 的数据超过这个时间没更新，认为 scheduler 没有在工作，回退到查 DB
+    stale_seconds = CONF.try_get('user_quota.used_quota_view.stale_seconds', default=30)
+    redis_key = f"{os.environ.get('BFF_REDIS_PREFIX') or 'bff'}:all_user_used_quota"
+
+    _data = {}
+    _timestamp = 0
+    _fetched_at = 0
+
+    @classmethod
+    async def refresh(cls):
+        cls._fetched_at = time.time()
+        try:
+            raw = await a_redis.get(cls.redis_key)
+            if raw is None:
+                return
+            result = ujson.loads(raw)
+            if result.get('timestamp', 0) > cls._timestamp:
+                cls._data = result.get('data', {})
+                cls._timestamp = result['timestamp']
+        except Exception as e:
+            logger.error(f'刷新 used quota view 失败: {e}')
+
+    @classmethod
+    async def async_get(cls, user_name) -> Optional[dict]:
+        """
+        返回 {group-priority: nodes}, 数据过期时返回 None, 由调用方回退到 DB 查询
+        """
+        if time.time() - cls._fetched_at > cls.refresh_interval:
+            await cls.refresh()
+        if time.time() - cls._timestamp > cls.stale_seconds:
+            return None
+        return cls._data.get(user_name, {})
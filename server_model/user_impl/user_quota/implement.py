@@ -12,6 +12,7 @@ from db import MarsDB
 from logm import ExceptionWithoutErrorLog
 from server_model.user import User
 from server_model.user_data import QuotaTable
+from server_model.user_impl.used_quota_view import UsedQuotaView
 
 
 class UserQuota(UserQuotaExtras, IUserQuota):
@@ -56,13 +57,11 @@ class UserQuota(UserQuotaExtras, IUserQuota):
         return df.groupby('resource').max()
 
     def __get_quota_df(self):
-        df = QuotaTable.df
-        df = df[df.user_name.isin(self.user.group_list)]
+        df = QuotaTable.snapshot.select('user_name', self.user.group_list)
         return self.__process_quota_df(df)
 
     async def __async_get_quota_df(self):
-        df = await QuotaTable.async_df
-        df = df[df.user_name.isin(self.user.group_list)]
+        df = (await QuotaTable.async_snapshot).select('user_name', self.user.group_list)
         return self.__process_quota_df(df)
 
     async def create_quota_df(self):
@@ -73,6 +72,12 @@ class UserQuota(UserQuotaExtras, IUserQuota):
             await self.create_quota_df()
 
     async def async_get_used_quota(self):
+        # 优先使用 scheduler 每个 tick 更新的已用 quota 视图
+        if (used_quota_view := await UsedQuotaView.async_get(self.user.user_name)) is not None:
+            return {k: int(used_quota_view.get(k, 0)) for k in (k.replace('node-', '') for k in self.node_quota)}
+        return await self.async_get_used_quota_from_db()
+
+    async def async_get_used_quota_from_db(self):
         used_quota = {k.replace('node-', ''): 0 for k in self.node_quota}
         ts = await MarsDB().a_execute(f"""
         select "group", "priority", "nodes" from "task_ng"
@@ -0,0 +1,219 @@
+"""
+任务日志的搜索索引
+每个日志文件按行切成 ~64KB 的 block，记录 block 的起始字节和起始行号，以及 block 里所有字节 trigram 的 bitmap
+    - trigram 哈希到 BLOOM_BITS 位，每个 block 一行，所有 block 的 bitmap 拼成一个 (block 数, BLOOM_BITS / 8) 的 uint8 矩阵
+    - 搜索时把 content 的 trigram 哈希成若干位，用 numpy 一次筛出所有位都为 1 的候选 block，只读候选 block 逐行校验
+    - 是子串索引，content 任意位置的子串都能用上，不区分是不是整词；content 不到 3 个字节时退化成扫描所有 block
+    - 索引大小约为日志大小的 BLOOM_BITS / 8 / BLOCK_SIZE（默认 1/8），整个进程的索引按字节数 LRU 淘汰
+日志是追加写入的，每次搜索前只索引新增的部分；文件被截断或者替换时重建
+experiment.log.search_index.enabled 关掉时直接扫描整个文件，结果和索引一致，方便对比，见 utils/log_search_index_bench.py
+"""
+
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from conf import CONF
+from utils.implement import asyncwrap
+from utils.real_time_logs import list_task_node_idx_log_files, cut_log_line
+
+
+SEARCH_INDEX_ENABLED = CONF.try_get('experiment.log.search_index.enabled', default=True)
+BLOCK_SIZE = CONF.try_get('experiment.log.search_index.block_size', default=64 * 1024)
+# 每个 block 的 trigram bitmap 位数，64KB 的日志一般有几千个不同的 trigram，65536 位时误判率很低
+BLOOM_BITS = CONF.try_get('experiment.log.search_index.bloom_bits', default=1 << 16)
+MAX_INDEX_BYTES = CONF.try_get('experiment.log.search_index.max_bytes', default=256 << 20)
+SEARCH_CONCURRENCY = CONF.try_get('experiment.log.search_index.concurrency', default=16)
+# 日志每行前面是 [时间戳]，搜索的时候跳过
+LINE_PREFIX_LENGTH = 29
+BLOOM_BYTES = BLOOM_BITS // 8
+BLOOM_SHIFT = 32 - (BLOOM_BITS.bit_length() - 1)
+# 每个 block 除了 bitmap 之外的开销，(起始字节, 起始行号) 的 tuple 估算
+BLOCK_OVERHEAD = 128
+
+
+def trigram_hashes(data: bytes) -> np.ndarray:
+    """
+    data 里所有字节 trigram 哈希到 [0, BLOOM_BITS) 之后的值，乘法哈希取高位
+    """
+    b = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+    trigrams = (b[:-2] << 16) | (b[1:-1] << 8) | b[2:]
+    return (trigrams * np.uint32(2654435761)) >> np.uint32(BLOOM_SHIFT)
+
+
+def verify_ranges(path, ranges, content: str, max_line_length: int, max_matches: int):
+    """
+    读 ranges 里的每一段逐行校验，计数规则和之前逐行搜索的一样：截断超长的行，跳过时间戳
+    :param ranges: [(起始字节, 起始行号, 结束字节)]，结束字节为 None 表示读到文件末尾
+    :return: (出现次数, [(行号, 行首字节位置)])
+    """
+    needle = content.encode()
+    count, matches = 0, []
+    with open(path, 'rb') as fp:
+        for offset, line_no, end in ranges:
+            fp.seek(offset)
+            data = fp.read() if end is None else fp.read(end - offset)
+            if needle not in data:
+                continue
+            for line in data.split(b'\n'):
+                if needle in line:
+                    c = cut_log_line(line.decode(errors='replace'), max_line_length)[LINE_PREFIX_LENGTH:].count(content)
+                    count += c
+                    if c and len(matches) < max_matches:
+                        matches.append((line_no, offset))
+                offset += len(line) + 1
+                line_no += 1
+    return count, matches
+
+
+def scan_file(path, content: str, max_line_length: int, max_matches: int):
+    """
+    不用索引，整个文件扫一遍
+    """
+    return verify_ranges(path, [(0, 0, None)], content, max_line_length, max_matches)
+
+
+class LogFileIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.reset(None)
+
+    def reset(self, inode):
+        self.inode = inode
+        # 已经索引到的字节位置，总是落在行首，之后不完整的一行留到下次
+        self.indexed_size = 0
+        self.line_count = 0
+        # 每个 block 的 (起始字节, 起始行号)
+        self.blocks = []
+        # 第 i 个 block 的 bitmap 是 bloom[i * BLOOM_BYTES:(i + 1) * BLOOM_BYTES]
+        self.bloom = bytearray()
+
+    @property
+    def nbytes(self):
+        return len(self.bloom) + len(self.blocks) * BLOCK_OVERHEAD
+
+    def add_block(self, block: bytes):
+        bits = np.zeros(BLOOM_BITS, dtype=bool)
+        if len(block) >= 3:
+            bits[trigram_hashes(block)] = True
+        self.bloom += np.packbits(bits, bitorder='little').tobytes()
+        self.blocks.append((self.indexed_size, self.line_count))
+        self.indexed_size += len(block)
+        self.line_count += block.count(b'\n')
+
+    def update(self):
+        stat = os.stat(self.path)
+        if stat.st_ino != self.inode or stat.st_size < self.indexed_size:
+            self.reset(stat.st_ino)
+        if stat.st_size == self.indexed_size:
+            return
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.indexed_size)
+            buffer = b''
+            while data := fp.read(BLOCK_SIZE):
+                buffer += data
+                end = buffer.rfind(b'\n')
+                if end == -1:
+                    # 一行比 block 还长，继续读到行尾
+                    continue
+                self.add_block(buffer[:end + 1])
+                buffer = buffer[end + 1:]
+
+    def candidate_blocks(self, needle: bytes) -> np.ndarray:
+        if len(needle) < 3:
+            return np.arange(len(self.blocks))
+        hashes = np.unique(trigram_hashes(needle))
+        bloom = np.frombuffer(self.bloom, dtype=np.uint8).reshape(len(self.blocks), BLOOM_BYTES)
+        hit = np.all(bloom[:, hashes >> 3] & (1 << (hashes & 7)).astype(np.uint8), axis=1)
+        del bloom  # 释放对 bytearray 的引用，之后才能继续追加
+        return np.flatnonzero(hit)
+
+    def search(self, content: str, max_line_length: int, max_matches: int):
+        """
+        :return: (出现次数, [(行号, 行首字节位置)])，行号从 0 开始
+        """
+        with self.lock:
+            self.update()
+            ranges = []
+            for i in self.candidate_blocks(content.encode()).tolist():
+                end = self.blocks[i + 1][0] if i + 1 < len(self.blocks) else self.indexed_size
+                ranges.append((*self.blocks[i], end))
+            # 最后一段是还没进索引的不完整的行
+            ranges.append((self.indexed_size, self.line_count, None))
+        return verify_ranges(self.path, ranges, content, max_line_length, max_matches)
+
+
+class LogSearchIndex(object):
+    """
+    进程内的索引缓存，按文件 LRU 淘汰，所有文件的索引加起来不超过 MAX_INDEX_BYTES
+    """
+    _indexes = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_file_index(cls, path) -> LogFileIndex:
+        with cls._lock:
+            if path in cls._indexes:
+                cls._indexes.move_to_end(path)
+            else:
+                cls._indexes[path] = LogFileIndex(path)
+            return cls._indexes[path]
+
+    @classmethod
+    def evict(cls):
+        with cls._lock:
+            total = sum(index.nbytes for index in cls._indexes.values())
+            # 至少留下最近用的一个
+            while total > MAX_INDEX_BYTES and len(cls._indexes) > 1:
+                _, index = cls._indexes.popitem(last=False)
+                total -= index.nbytes
+
+    @classmethod
+    def search_file(cls, path, content, max_line_length, max_matches):
+        if not SEARCH_INDEX_ENABLED:
+            return scan_file(path, content, max_line_length, max_matches)
+        result = cls.get_file_index(path).search(content, max_line_length, max_matches)
+        cls.evict()
+        return result
+
+    @classmethod
+    def search_task_node_idx_log(cls, log_dir, task_id, node_idx, content, max_line_length, max_matches):
+        path = os.path.join(log_dir, str(task_id))
+        if not os.path.isdir(path):  # 共享盘里文件还没创建的情况
+            return 0, []
+        count, matches = 0, []
+        for file, _ in list_task_node_idx_log_files(path, node_idx):
+            try:
+                file_count, file_matches = cls.search_file(os.path.join(path, file), content, max_line_length, max_matches - len(matches))
+            except FileNotFoundError:
+                continue
+            count += file_count
+            matches += [{'task_id': task_id, 'rank': node_idx, 'file': file, 'line': line, 'offset': offset} for line, offset in file_matches]
+        return count, matches
+
+    @classmethod
+    async def search(cls, user, task_ids, ranks: int, content: str, max_line_length=4096, max_matches=100):
+        """
+        并发搜索所有任务、所有 rank 的日志
+        :return: (每个 rank 包含 content 的次数, 匹配到的行的位置)
+        """
+        log_dir = user.config.log_dir()
+        semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+        search_one = asyncwrap(cls.search_task_node_idx_log)
+
+        async def _search(task_id, rank):
+            async with semaphore:
+                return await search_one(log_dir, task_id, rank, content, max_line_length, max_matches)
+
+        jobs = [(task_id, rank) for task_id in sorted(task_ids) for rank in range(ranks)]
+        results = await asyncio.gather(*[_search(task_id, rank) for task_id, rank in jobs])
+        counts, matches = [0] * ranks, []
+        for (_, rank), (count, rank_matches) in zip(jobs, results):
+            counts[rank] += count
+            matches += rank_matches[:max_matches - len(matches)]
+        return counts, matches
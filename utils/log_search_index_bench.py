@@ -0,0 +1,114 @@
+"""
+日志搜索索引和直接扫描的对比，用法:
+    python -m utils.log_search_index_bench --files 64 --file-mb 2
+生成一批和训练日志格式一样的文件（每个默认 2MB，和 experiment.log.max_filesize 一致），分别统计
+    - 第一次搜索建索引的时间、索引大小、RSS 增长
+    - 每个 query 用索引和直接扫描的耗时，两者结果必须一致
+文件都在 page cache 里，扫描不用真的读盘，实际在共享盘上索引省掉的读会更多
+"""
+
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from utils.log_search_index import LogFileIndex, scan_file
+
+
+QUERIES = [
+    # 很少出现的报错
+    'CUDA error: an illegal memory access',
+    # 偶尔出现
+    'NCCL WARN',
+    # 只出现在某些 step
+    'step 7777 ',
+    # 每个 block 都有
+    'grad_norm',
+    # 太短用不上索引
+    'lr',
+]
+
+
+def current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def generate(path, size, seed):
+    rng = random.Random(seed)
+    lines, written, step = [], 0, 0
+    while written < size:
+        step += 1
+        ts = f'[2026-10-19 12:{step // 600 % 60:02d}:{step // 10 % 60:02d}.{rng.randrange(1000000):06d}] '
+        line = f'{ts}epoch {step // 10000} step {step} loss {rng.random():.4f} lr {rng.random() * 1e-3:.2e} ' \
+               f'grad_norm {rng.random() * 10:.3f} throughput {rng.random() * 5000:.1f} samples/s'
+        r = rng.random()
+        if r < 0.0001:
+            line = f'{ts}RuntimeError: CUDA error: an illegal memory access was encountered'
+        elif r < 0.002:
+            line = f'{ts}node{rng.randrange(64)}:{rng.randrange(65536)} NCCL WARN Call to ibv_poll_cq failed'
+        lines.append(line)
+        written += len(line) + 1
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def best_of(repeat, func, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--file-mb', type=float, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-line-length', type=int, default=4096)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_search_bench_')
+    try:
+        paths = [os.path.join(tmp_dir, f'rank#{i}') for i in range(args.files)]
+        for i, path in enumerate(paths):
+            generate(path, int(args.file_mb * (1 << 20)), i)
+        total = sum(os.path.getsize(p) for p in paths)
+        # 先都读一遍，扫描和建索引都从 page cache 读
+        for path in paths:
+            with open(path, 'rb') as f:
+                f.read()
+
+        rss = current_rss()
+        start = time.perf_counter()
+        indexes = [LogFileIndex(path) for path in paths]
+        for index in indexes:
+            index.update()
+        build = time.perf_counter() - start
+        index_bytes = sum(index.nbytes for index in indexes)
+        print(f'{args.files} files, {total / (1 << 20):.1f}MB')
+        print(f'build {build:.2f}s, index {index_bytes / (1 << 20):.1f}MB, rss +{(current_rss() - rss) / (1 << 20):.1f}MB')
+        print(f'{"query":<40}{"scan":>10}{"index":>10}{"blocks":>16}{"count":>10}')
+        for query in QUERIES:
+            def search_all(search):
+                return [search(index, query) for index in indexes]
+            scan_cost, scan_result = best_of(
+                args.repeat, search_all, lambda index, q: scan_file(index.path, q, args.max_line_length, 100))
+            index_cost, index_result = best_of(
+                args.repeat, search_all, lambda index, q: index.search(q, args.max_line_length, 100))
+            assert scan_result == index_result, query
+            blocks = sum(len(index.candidate_blocks(query.encode())) for index in indexes)
+            total_blocks = sum(len(index.blocks) for index in indexes)
+            print(f'{query!r:<40}{scan_cost:>9.3f}s{index_cost:>9.3f}s{blocks:>8}/{total_blocks:<7}{sum(c for c, _ in scan_result):>10}')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+任务日志的 tail follower，给日志推送接口用
+同一个进程里，同一个 task / rank 的日志只跟一份，所有正在看这份日志的连接共享读到的新数据，不用每个连接各自轮询、各自重新 list 文件
+装了 inotify_simple 时用 inotify 感知文件变化；共享盘上其他节点的写入不一定有 inotify 事件，所以仍然会低频轮询兜底
+"""
+
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import ciso8601
+
+from conf import CONF
+from logm import logger
+from utils.implement import asyncwrap
+from utils.real_time_logs import list_task_node_idx_log_files, cut_log_line
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+POLL_INTERVAL = CONF.try_get('experiment.log.stream.poll_interval', default=1.0)
+INOTIFY_POLL_INTERVAL = CONF.try_get('experiment.log.stream.inotify_poll_interval', default=5.0)
+RELIST_INTERVAL = CONF.try_get('experiment.log.stream.relist_interval', default=5.0)
+# 收到 inotify 事件之后再等一会儿，把这段时间里的连续写入合并成一次读
+DEBOUNCE_INTERVAL = CONF.try_get('experiment.log.stream.debounce_interval', default=0.15)
+MAX_PENDING_CHUNKS = CONF.try_get('experiment.log.stream.max_pending_chunks', default=256)
+# 每个文件每次最多读这么多，剩下的下一轮再读
+MAX_READ_BYTES = 4 * 1024 * 1024
+
+
+def parse_line_timestamp(line: str):
+    # 和 real_time_logs.get_timestamp_from_line 一致
+    if len(line) <= 28:
+        return None
+    try:
+        return ciso8601.parse_datetime(line[1:27])
+    except Exception:
+        return None
+
+
+class LogSubscription(object):
+    def __init__(self, follower: 'LogTailFollower'):
+        self.follower = follower
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_CHUNKS)
+        # 消费太慢或者 follower 出错时会丢数据，订阅方发现后需要用 last_seen 重新拉一次
+        self.lagged = False
+
+    def put(self, chunk):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout) -> Optional[dict]:
+        """
+        :return: {'lines': [...], 'timestamps': [...], 'last_seen': {...}}，超时返回 None
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.follower.unsubscribe(self)
+
+
+class LogTailFollower(object):
+    _followers: Dict[tuple, 'LogTailFollower'] = {}
+
+    def __init__(self, path, node_idx, suffix_filter, max_line_length):
+        self.key = (path, node_idx, suffix_filter, max_line_length)
+        self.path = path
+        self.node_idx = node_idx
+        self.suffix_filter = suffix_filter
+        self.max_line_length = max_line_length
+        self.subscribers: Set[LogSubscription] = set()
+        # file_name -> [inode, 已经读到的位置]
+        self.files: Dict[str, list] = {}
+        self.last_listed = 0
+        self.ready = asyncio.Event()
+        self.runner: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def subscribe(cls, path, node_idx, suffix_filter=None, max_line_length=4096) -> LogSubscription:
+        """
+        订阅之后写入的日志都会推送给订阅方，订阅之前已有的日志需要订阅方自己读
+        """
+        key = (path, node_idx, suffix_filter, max_line_length)
+        if (follower := cls._followers.get(key)) is None:
+            follower = cls._followers[key] = cls(*key)
+            follower.runner = asyncio.create_task(follower.run())
+        subscription = LogSubscription(follower)
+        follower.subscribers.add(subscription)
+        await follower.ready.wait()
+        return subscription
+
+    def unsubscribe(self, subscription: LogSubscription):
+        self.subscribers.discard(subscription)
+        if len(self.subscribers) == 0:
+            self.stop()
+
+    def stop(self):
+        if self._followers.get(self.key) is self:
+            self._followers.pop(self.key)
+        if self.runner is not None:
+            self.runner.cancel()
+
+    def refresh_files(self, init=False):
+        """
+        init: 第一次 list 时从文件末尾开始跟; 之后新出现的文件从头读
+        """
+        self.last_listed = time.time()
+        try:
+            file_names = [file for file, _ in list_task_node_idx_log_files(self.path, self.node_idx, self.suffix_filter)]
+        except FileNotFoundError:
+            file_names = []
+        files = {}
+        for file in file_names:
+            if file in self.files:
+                files[file] = self.files[file]
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, file))
+            except FileNotFoundError:
+                continue
+            files[file] = [stat.st_ino, stat.st_size if init else 0]
+        self.files = files
+
+    def read_file(self, file) -> Optional[dict]:
+        state = self.files[file]
+        path = os.path.join(self.path, file)
+        try:
+            stat = os.stat(path)
+            if stat.st_ino != state[0] or stat.st_size < state[1]:
+                # 文件被替换或者截断了，从头读
+                state[0], state[1] = stat.st_ino, 0
+            if stat.st_size == state[1]:
+                return None
+            with open(path, 'rb') as fp:
+                fp.seek(state[1])
+                data = fp.read(min(stat.st_size - state[1], MAX_READ_BYTES))
+        except FileNotFoundError:
+            return None
+        end = data.rfind(b'\n')
+        if end == -1 and len(data) < MAX_READ_BYTES:
+            return None     # 不完整的一行，等写完再读
+        data = data if end == -1 else data[:end + 1]
+        start_offset = state[1]
+        state[1] += len(data)
+        lines, timestamps, last_seen, offset = [], [], None, start_offset
+        for raw_line in data.split(b'\n')[:-1] if end != -1 else [data]:
+            line = raw_line.decode(errors='replace')
+            timestamp = parse_line_timestamp(line)
+            if timestamp is not None:
+                last_seen = {'timestamp': timestamp, 'offset': offset, 'mtime': stat.st_mtime}
+            lines.append(cut_log_line(line, self.max_line_length))
+            timestamps.append(timestamp)
+            offset += len(raw_line) + 1
+        return {'lines': lines, 'timestamps': timestamps, 'last_seen': last_seen}
+
+    def read_new(self, relist=False) -> List[dict]:
+        if relist or time.time() - self.last_listed > RELIST_INTERVAL:
+            self.refresh_files()
+        return [chunk for file in list(self.files) if (chunk := self.read_file(file)) is not None]
+
+    def open_inotify(self):
+        if INotify is None or not os.path.isdir(self.path):
+            return None
+        try:
+            inotify = INotify()
+            inotify.add_watch(self.path, inotify_flags.MODIFY | inotify_flags.CREATE | inotify_flags.MOVED_TO)
+            return inotify
+        except Exception as e:
+            logger.warning(f'{self.path} 无法使用 inotify，改为轮询: {e}')
+            return None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        inotify = None
+        try:
+            await asyncwrap(self.refresh_files)(init=True)
+            self.ready.set()
+            changed = asyncio.Event()
+            relist = False
+
+            def on_inotify():
+                # add_reader 是水平触发的，不在回调里把事件读完的话 read_new 期间会一直被唤醒
+                nonlocal relist
+                events = inotify.read(timeout=0)
+                relist = relist or any(event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO) for event in events)
+                changed.set()
+
+            if (inotify := self.open_inotify()) is not None:
+                loop.add_reader(inotify.fd, on_inotify)
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), INOTIFY_POLL_INTERVAL if inotify is not None else POLL_INTERVAL)
+                    await asyncio.sleep(DEBOUNCE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                read_relist, relist = relist, False
+                for chunk in await asyncwrap(self.read_new)(read_relist):
+                    for subscription in list(self.subscribers):
+                        subscription.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'跟踪日志 {self.path} #{self.node_idx} 失败: {e}')
+            # 让订阅方重新订阅，重新订阅时会新建 follower
+            for subscription in list(self.subscribers):
+                subscription.lagged = True
+            self.stop()
+        finally:
+            self.ready.set()
+            if inotify is not None:
+                loop.remove_reader(inotify.fd)
+                inotify.close()
@@ -97,10 +97,36 @@ async def get_file_log(path, last_seen):
         return await file_read_all(fp, timestamp, 0, mtime)
 
 
+def cut_log_line(line: str, max_line_length: int):
+    if len(line) > max_line_length and line[29:40] != '[HFAI_PRINT':
+        line = line[0:max_line_length] + f'...(日志长度超过 {max_line_length}，已被截断)'
+    return line
+
+
 def check_file_match(file_name: str, idx: int):
     return f'#{idx}.' in file_name or file_name.endswith(f'#{idx}')
 
 
+def list_task_node_idx_log_files(path, node_idx: int, suffix_filter=None):
+    """
+    列出 path 下 node_idx 对应的日志文件，按修改时间排序，error 文件放在最后
+    :return: [(file_name, mtime)]
+    """
+    files = os.listdir(path)
+    valid_files = [(file, os.path.getmtime(os.path.join(path, file)))
+                   for file in files
+                   if check_file_match(file, node_idx) and not file.endswith('error') \
+                        and not file.startswith('events') and not file.startswith('debug') \
+                        and (suffix_filter is None or
+                             re.search(re.escape(suffix_filter)+r'(\.\d+)*$', file) is not None)
+                   ]
+    sorted_valid_files = sorted(valid_files, key=lambda t: t[1])
+    for file in files:
+        if check_file_match(file, node_idx) and file.endswith('error'):
+            sorted_valid_files.append((file, 0))
+    return sorted_valid_files
+
+
 async def get_task_node_idx_log(task_id, user, node_idx: int, last_seen=None, suffix_filter=None, max_line_length=4096):
     """
     :param task_id:
@@ -113,18 +139,7 @@ async def get_task_node_idx_log(task_id, user, node_idx: int, last_seen=None, su
     log_dir = user.config.log_dir()
     path = os.path.join(log_dir, str(task_id))
     try:
-        files = os.listdir(path)
-        valid_files = [(file, os.path.getmtime(os.path.join(path, file)))
-                       for file in files
-                       if check_file_match(file, node_idx) and not file.endswith('error') \
-                            and not file.startswith('events') and not file.startswith('debug') \
-                            and (suffix_filter is None or
-                                 re.search(re.escape(suffix_filter)+r'(\.\d+)*$', file) is not None)
-                       ]
-        sorted_valid_files = sorted(valid_files, key=lambda t: t[1])
-        for file in files:
-            if check_file_match(file, node_idx) and file.endswith('error'):
-                sorted_valid_files.append((file, 0))
+        sorted_valid_files = list_task_node_idx_log_files(path, node_idx, suffix_filter)
         data = []
         rst_last_seen = last_seen
         for file in sorted_valid_files:
@@ -134,11 +149,7 @@ async def get_task_node_idx_log(task_id, user, node_idx: int, last_seen=None, su
                     rst_last_seen = info['last_seen']
             data.append(info['data'])
         data = "".join(data)
-        cut_log = []
-        for line_log in data.split('\n'):
-            if len(line_log) > max_line_length and line_log[29:40] != '[HFAI_PRINT':
-                line_log = line_log[0:max_line_length] + f'...(日志长度超过 {max_line_length}，已被截断)'
-            cut_log.append(line_log)
+        cut_log = [cut_log_line(line_log, max_line_length) for line_log in data.split('\n')]
         return {
             "data": '\n'.join(cut_log) if cut_log else "还没产生日志",
             "success": 1,